@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark node lookup on a package with many same-named methods.
+
+Generates a package where every class defines the same few methods
+(__init__, get, run, name), so that each short name is shared by thousands
+of nodes, and times the analysis with the indexed CallGraphVisitor.get_node()
+against a linear scan of CallGraphVisitor.nodes[name] (the previous
+implementation).
+
+Usage: python benchmarks/node_lookup.py [NUM_CLASSES ...]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyan.analyzer import CallGraphVisitor  # noqa: E402
+from pyan.node import Flavor  # noqa: E402
+
+CLASSES_PER_MODULE = 50
+
+CLASS_TEMPLATE = """
+class C{i}:
+    def __init__(self):
+        self.value = C{j}()
+
+    def get(self):
+        return self.value.get()
+
+    def run(self):
+        self.get()
+        return self.name()
+
+    def name(self):
+        return "C{i}"
+"""
+
+
+class LinearLookupVisitor(CallGraphVisitor):
+    """CallGraphVisitor with the previous linear-scan node lookup."""
+
+    def get_node(self, namespace, name, ast_node=None, flavor=Flavor.UNSPECIFIED):
+        if name in self.nodes:
+            for n in self.nodes[name]:
+                if n.namespace == namespace:
+                    if Flavor.specificity(flavor) > Flavor.specificity(n.flavor):
+                        n.flavor = flavor
+                    return n
+        return super().get_node(namespace, name, ast_node, flavor)
+
+
+def make_package(root, num_classes):
+    """Write the synthetic package into root. Return the list of its files."""
+    pkg = os.path.join(root, "pkg")
+    os.makedirs(pkg)
+    filenames = [os.path.join(pkg, "__init__.py")]
+    with open(filenames[0], "w") as f:
+        f.write("")
+    num_modules = max(1, num_classes // CLASSES_PER_MODULE)
+    for m in range(num_modules):
+        filename = os.path.join(pkg, "mod%d.py" % m)
+        with open(filename, "w") as f:
+            first = m * CLASSES_PER_MODULE
+            last = first + CLASSES_PER_MODULE
+            for i in range(first, last):
+                j = i + 1 if i + 1 < last else first
+                f.write(CLASS_TEMPLATE.format(i=i, j=j))
+        filenames.append(filename)
+    return filenames
+
+
+def timeit(visitor_class, filenames):
+    start = time.perf_counter()
+    visitor_class(filenames)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "sizes",
+        nargs="*",
+        type=int,
+        default=[250, 500, 1000, 2000],
+        help="numbers of classes to generate",
+        metavar="NUM_CLASSES",
+    )
+    args = parser.parse_args()
+    print("%8s %12s %12s %8s" % ("classes", "linear [s]", "indexed [s]", "speedup"))
+    for num_classes in args.sizes:
+        with tempfile.TemporaryDirectory() as root:
+            filenames = make_package(root, num_classes)
+            linear = timeit(LinearLookupVisitor, filenames)
+            indexed = timeit(CallGraphVisitor, filenames)
+        print(
+            "%8d %12.3f %12.3f %7.1fx"
+            % (num_classes, linear, indexed, linear / indexed)
+        )
+
+
+if __name__ == "__main__":
+    main()
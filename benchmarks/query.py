@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark the call graph queries (pyan.query) on a large random graph.
+
+Builds a graph of NUM_NODES functions with NUM_EDGES uses edges directly
+(no source files are analyzed; the targets are skewed towards a few
+popular functions, as in real code), freezes it like
+CallGraphVisitor.freeze(), and times the CallGraph index and the median
+and maximum time of each kind of query over random definitions.
+
+Usage: python benchmarks/query.py [--nodes N] [--edges M] [--queries Q]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pyan.edgestore import CSRAdjacency, number_nodes  # noqa: E402
+from pyan.node import Flavor, Node  # noqa: E402
+from pyan.query import CallGraph  # noqa: E402
+
+
+class GraphStub:
+    """The parts of a frozen CallGraphVisitor that CallGraph uses."""
+
+    def __init__(self, num_nodes, num_edges, seed=0):
+        rng = random.Random(seed)
+        nodes = []
+        for i in range(num_nodes):
+            node = Node("m%d" % (i // 100), "f%d" % i, None, "m.py", Flavor.FUNCTION)
+            node.defined = True
+            nodes.append(node)
+        uses = {}
+        for _ in range(num_edges):
+            source = rng.choice(nodes)
+            target = nodes[int(num_nodes * rng.random() ** 2)]  # skewed
+            uses.setdefault(source, set()).add(target)
+        self.nodes = {node.name: [node] for node in nodes}
+        node_list, ids = number_nodes(nodes)
+        self.uses_edges = CSRAdjacency(node_list, ids, uses)
+        self.defines_edges = CSRAdjacency(node_list, ids, {})
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1e3
+
+
+def report(label, times):
+    times = sorted(times)
+    print(
+        "%-28s median %8.3f ms   max %8.3f ms"
+        % (label, times[len(times) // 2], times[-1])
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--nodes", type=int, default=100000)
+    parser.add_argument("--edges", type=int, default=1000000)
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    stub = GraphStub(args.nodes, args.edges)
+    print(
+        "Built a graph of %d nodes, %d edges in %.1f s"
+        % (args.nodes, stub.uses_edges.num_edges(), time.perf_counter() - start)
+    )
+    graph, ms = timed(CallGraph, stub)
+    print("Indexed in %.1f s" % (ms / 1e3))
+
+    rng = random.Random(1)
+    names = list(graph.by_name)
+    pairs = [(rng.choice(names), rng.choice(names)) for _ in range(args.queries)]
+    for label, query in (
+        ("callers", lambda s, t: graph.callers(s)),
+        ("callees", lambda s, t: graph.callees(s)),
+        ("callees, depth 2", lambda s, t: graph.reachable(s, depth=2)),
+        ("callers, depth 2", lambda s, t: graph.reachable(s, True, depth=2)),
+        ("shortest path", lambda s, t: graph.path(s, t)),
+        ("all paths, k=4, limit 100", lambda s, t: graph.all_paths(s, t, 4, limit=100)),
+    ):
+        report(label, [timed(query, s, t)[1] for s, t in pairs])
+
+
+if __name__ == "__main__":
+    main()
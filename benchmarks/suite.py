@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark suite for the analyzer and the writers.
+
+For each size (number of modules) of a synthetic package (see synthetic.py),
+times:
+
+  analyze               CallGraphVisitor, up to (not including) postprocessing
+  <stage>               each postprocessing stage, in order
+  freeze                CallGraphVisitor.freeze(), if the checkout has it
+  from_visitor          VisualGraph.from_visitor()
+  write_<format>        each writer in pyan/writers.py (the dot subprocess of
+                        DotRenderer only if Graphviz is installed)
+
+Each benchmark is run --repeat times, and the best time is kept. The suite
+then fits, for each benchmark, the exponent k of time ~ size**k, so that a
+quadratic regression shows up as k near 2 even if the absolute times on
+small inputs look harmless.
+
+The results can be saved as a JSON baseline, and two baselines compared,
+e.g. to compare two checkouts (the stages and writers are called directly,
+so the suite also runs against checkouts older than itself)::
+
+    python benchmarks/suite.py --output old.json --pyan-root ../pyan-old
+    python benchmarks/suite.py --output new.json
+    python benchmarks/suite.py --compare old.json new.json
+
+Usage: python benchmarks/suite.py [--sizes 10,20,40,80] [--repeat 3]
+       [--output FILE] [--baseline FILE] [--compare OLD NEW]
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from synthetic import Shape, generate  # noqa: E402
+
+STAGES = (
+    "expand_unknowns",
+    "contract_nonexistents",
+    "cull_inherited",
+    "collapse_inner",
+)
+GRAPH_OPTIONS = {
+    "draw_defines": True,
+    "draw_uses": True,
+    "colored": True,
+    "grouped_alt": False,
+    "grouped": True,
+    "nested_groups": True,
+    "annotated": True,
+}
+
+
+def import_pyan(root):
+    """Import pyan from the checkout at root. Return the needed classes."""
+    sys.path.insert(0, root)
+    from pyan.analyzer import CallGraphVisitor
+    from pyan.visgraph import VisualGraph
+    from pyan import writers
+
+    class BenchVisitor(CallGraphVisitor):
+        """CallGraphVisitor that leaves the postprocessing to the caller."""
+
+        def postprocess(self):
+            pass
+
+    return BenchVisitor, VisualGraph, writers
+
+
+def git_revision(root):
+    try:
+        out = subprocess.run(
+            ["git", "-C", root, "rev-parse", "--short", "HEAD"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+
+def run_once(pyan, filenames, outdir):
+    """Run the whole pipeline once. Return {benchmark name: seconds}, and the
+    size of the resulting graph."""
+    BenchVisitor, VisualGraph, writers = pyan
+    times = {}
+
+    start = time.perf_counter()
+    v = BenchVisitor(filenames)
+    times["analyze"] = time.perf_counter() - start
+
+    for stage in STAGES:
+        start = time.perf_counter()
+        getattr(v, stage)()
+        times[stage] = time.perf_counter() - start
+
+    counts = {
+        "files": len(filenames),
+        "nodes": sum(len(nodes) for nodes in v.nodes.values()),
+        "uses_edges": sum(len(targets) for targets in v.uses_edges.values()),
+        "defines_edges": sum(len(targets) for targets in v.defines_edges.values()),
+    }
+
+    if hasattr(v, "freeze"):
+        start = time.perf_counter()
+        v.freeze()
+        times["freeze"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    graph = VisualGraph.from_visitor(v, options=GRAPH_OPTIONS)
+    times["from_visitor"] = time.perf_counter() - start
+
+    outputs = [
+        ("tgf", writers.TgfWriter, {}),
+        ("dot", writers.DotWriter, {"options": ["rankdir=TB"]}),
+        ("yed", writers.YedWriter, {}),
+    ]
+    for fmt, writer_class, kwargs in outputs:
+        output = os.path.join(outdir, "graph." + fmt)
+        writer = writer_class(graph, output=output, **kwargs)
+        start = time.perf_counter()
+        writer.run()
+        times["write_" + fmt] = time.perf_counter() - start
+
+    if shutil.which("dot"):
+        output = os.path.join(outdir, "graph.svg")
+        writer = writers.DotRenderer(graph, output=output, output_format="svg")
+        start = time.perf_counter()
+        writer.run()
+        times["write_svg"] = time.perf_counter() - start
+
+    return times, counts
+
+
+def run_suite(pyan, sizes, repeat, shape_args, log=sys.stderr):
+    """Return {size: {benchmark: best seconds}}, and {size: graph size}."""
+    results = {}
+    graph_sizes = {}
+    for size in sizes:
+        shape = Shape(modules=size, **shape_args)
+        with tempfile.TemporaryDirectory() as root:
+            filenames = generate(root, shape)
+            best = {}
+            for _ in range(repeat):
+                times, counts = run_once(pyan, filenames, root)
+                for name, seconds in times.items():
+                    best[name] = min(best.get(name, seconds), seconds)
+        results[size] = best
+        graph_sizes[size] = counts
+        print(
+            "size %5d: %d files, %d nodes, %d uses edges, %.3f s"
+            % (
+                size,
+                counts["files"],
+                counts["nodes"],
+                counts["uses_edges"],
+                sum(best.values()),
+            ),
+            file=log,
+        )
+    return results, graph_sizes
+
+
+def fit_exponents(results):
+    """Least-squares fit of log(time) = k log(size) + c for each benchmark.
+    Return {benchmark: k}."""
+    sizes = sorted(results)
+    names = results[sizes[0]].keys()
+    exponents = {}
+    for name in names:
+        points = [
+            (math.log(size), math.log(max(results[size][name], 1e-9)))
+            for size in sizes
+            if name in results[size]
+        ]
+        if len(points) < 2:
+            continue
+        mean_x = sum(x for x, _ in points) / len(points)
+        mean_y = sum(y for _, y in points) / len(points)
+        sxx = sum((x - mean_x) ** 2 for x, _ in points)
+        sxy = sum((x - mean_x) * (y - mean_y) for x, y in points)
+        exponents[name] = sxy / sxx if sxx else 0.0
+    return exponents
+
+
+def format_results(data, max_exponent):
+    """Return a text table of a results document."""
+    results = data["results"]
+    sizes = sorted(results, key=int)
+    names = list(results[sizes[0]])
+    header = "%-24s" % "benchmark" + "".join("%10s" % s for s in sizes) + "%8s" % "k"
+    lines = [header, "-" * len(header)]
+    for name in names:
+        row = "%-24s" % name
+        for size in sizes:
+            seconds = results[size].get(name)
+            row += "%10.4f" % seconds if seconds is not None else "%10s" % "-"
+        k = data["exponents"].get(name)
+        if k is not None:
+            row += "%8.2f" % k
+            if k > max_exponent:
+                row += "  superlinear!"
+        lines.append(row)
+    return "\n".join(lines)
+
+
+def compare(old, new, tolerance):
+    """Compare two results documents. Return (text table, number of benchmarks
+    that got slower by more than tolerance at the largest common size)."""
+    sizes = sorted(set(old["results"]) & set(new["results"]), key=int)
+    if not sizes:
+        raise ValueError("The results have no sizes in common")
+    size = sizes[-1]
+    old_times, new_times = old["results"][size], new["results"][size]
+    header = "%-24s %10s %10s %8s %7s %7s" % (
+        "benchmark (size %s)" % size,
+        "old [s]",
+        "new [s]",
+        "ratio",
+        "old k",
+        "new k",
+    )
+    lines = [header, "-" * len(header)]
+    regressions = 0
+    for name in old_times:
+        if name not in new_times:
+            continue
+        ratio = new_times[name] / old_times[name] if old_times[name] else 1.0
+        old_k = old["exponents"].get(name, float("nan"))
+        new_k = new["exponents"].get(name, float("nan"))
+        row = "%-24s %10.4f %10.4f %7.2fx %7.2f %7.2f" % (
+            name,
+            old_times[name],
+            new_times[name],
+            ratio,
+            old_k,
+            new_k,
+        )
+        if ratio > 1 + tolerance:
+            row += "  slower"
+            regressions += 1
+        lines.append(row)
+    return "\n".join(lines), regressions
+
+
+def load(filename):
+    with open(filename, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark pyan on synthetic packages."
+    )
+    parser.add_argument(
+        "--sizes",
+        default="10,20,40,80",
+        help="comma-separated numbers of modules (default: %(default)s)",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="runs per size")
+    parser.add_argument(
+        "--pyan-root",
+        default=os.path.dirname(HERE),
+        help="checkout of pyan to benchmark (default: this one)",
+    )
+    for name, value in Shape().as_dict().items():
+        if name != "modules":
+            parser.add_argument(
+                "--" + name,
+                type=type(value),
+                default=value,
+                help="synthetic package shape (default: %(default)s)",
+            )
+    parser.add_argument("--output", help="save the results as JSON to FILE")
+    parser.add_argument("--baseline", help="compare the results against this JSON file")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("OLD", "NEW"),
+        help="only compare two saved JSON results",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="relative slowdown reported as a regression (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--max-exponent",
+        type=float,
+        default=1.5,
+        help="scaling exponent flagged as superlinear (default: %(default)s)",
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        text, regressions = compare(
+            load(args.compare[0]), load(args.compare[1]), args.tolerance
+        )
+        print(text)
+        return 1 if regressions else 0
+
+    shape_args = {
+        name: getattr(args, name) for name in Shape().as_dict() if name != "modules"
+    }
+    sizes = [int(s) for s in args.sizes.split(",")]
+    pyan = import_pyan(os.path.abspath(args.pyan_root))
+    results, graph_sizes = run_suite(pyan, sizes, args.repeat, shape_args)
+    data = {
+        "meta": {
+            "pyan_root": os.path.abspath(args.pyan_root),
+            "revision": git_revision(args.pyan_root),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "shape": shape_args,
+            "repeat": args.repeat,
+        },
+        # JSON keys are strings; use them from the start for consistency
+        "results": {str(size): times for size, times in results.items()},
+        "exponents": fit_exponents(results),
+        "graph_sizes": {str(size): counts for size, counts in graph_sizes.items()},
+    }
+    print(format_results(data, args.max_exponent))
+
+    if args.output:
+        with open(args.output, "wt", encoding="utf-8") as f:
+            json.dump(data, f, indent=1)
+
+    if args.baseline:
+        text, regressions = compare(load(args.baseline), data, args.tolerance)
+        print()
+        print(text)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Deterministic generator of synthetic Python packages for benchmarking.
+
+The shape of the generated package is controlled by a few knobs:
+
+  modules     number of modules in the package
+  depth       length of the inheritance chain of each class family
+  classes     number of class families per module
+  methods     number of methods per class
+  fanout      number of calls made by each method
+  collisions  fraction (0..1) of method names drawn from a small shared pool
+              (get, run, ...), which gives wildcard expansion and node lookup
+              many candidates per name
+  cycles      fraction (0..1) of modules that also import a later module,
+              closing import cycles
+
+The same parameters and seed always produce the same files.
+
+Usage: python benchmarks/synthetic.py OUTPUT_DIR [--modules N] [...]
+"""
+
+import argparse
+import os
+import random
+
+SHARED_NAMES = ["get", "run", "update", "close", "name", "value", "process"]
+
+
+class Shape:
+    """Parameters of a synthetic package (see the module docstring)."""
+
+    def __init__(
+        self,
+        modules=20,
+        depth=3,
+        classes=4,
+        methods=5,
+        fanout=3,
+        collisions=0.3,
+        cycles=0.2,
+        seed=0,
+    ):
+        self.modules = modules
+        self.depth = depth
+        self.classes = classes
+        self.methods = methods
+        self.fanout = fanout
+        self.collisions = collisions
+        self.cycles = cycles
+        self.seed = seed
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    def __repr__(self):
+        return "Shape(%s)" % ", ".join("%s=%r" % kv for kv in vars(self).items())
+
+
+def _method_names(rng, shape, m, c):
+    names = []
+    for k in range(shape.methods):
+        if rng.random() < shape.collisions:
+            name = rng.choice(SHARED_NAMES)
+        else:
+            name = "m%d_%d_%d" % (m, c, k)
+        if name not in names:
+            names.append(name)
+    return names
+
+
+def _module_source(rng, shape, m, imports, plan):
+    """Return the source text of module m.
+
+    plan: {module index: [(class family index, [method names])]}"""
+    lines = ['"""Synthetic module %d."""' % m, ""]
+    for j in imports:
+        lines.append("from . import mod%d" % j)
+    lines.append("")
+
+    def call(family_methods):
+        """Return a random call expression, as seen from inside a method."""
+        kind = rng.random()
+        if kind < 0.4 and family_methods:  # own or inherited method
+            return "self.%s()" % rng.choice(family_methods)
+        if kind < 0.7 and imports:  # class in an imported module
+            j = rng.choice(imports)
+            c, names = rng.choice(plan[j])
+            cls = "mod%d.C%d_%d_%d" % (j, j, c, rng.randrange(shape.depth))
+            return "%s().%s()" % (cls, rng.choice(names))
+        if kind < 0.85 and imports:  # module-level function elsewhere
+            return "mod%d.helper%d()" % (rng.choice(imports), rng.randrange(2))
+        # method of an object of unknown type: resolves to a wildcard
+        return "obj.%s()" % rng.choice(SHARED_NAMES)
+
+    for i in range(2):
+        lines.append("def helper%d(obj=None):" % i)
+        lines.append("    return %s" % call([]))
+        lines.append("")
+
+    for c, names in plan[m]:
+        for level in range(shape.depth):
+            cls = "C%d_%d_%d" % (m, c, level)
+            base = "(C%d_%d_%d)" % (m, c, level - 1) if level else ""
+            lines.append("class %s%s:" % (cls, base))
+            lines.append('    """Level %d of class family %d."""' % (level, c))
+            lines.append("")
+            if level == 0:
+                lines.append("    def __init__(self):")
+                lines.append("        self.state = None")
+                lines.append("")
+            for name in names:
+                # subclasses override about half of the methods
+                if level and rng.random() < 0.5:
+                    continue
+                lines.append("    def %s(self, obj=None):" % name)
+                for _ in range(shape.fanout):
+                    lines.append("        %s" % call(names))
+                if level:
+                    lines.append("        return super().%s(obj)" % name)
+                lines.append("")
+            lines.append("")
+    return "\n".join(lines)
+
+
+def generate(root, shape):
+    """Write a synthetic package "synth" of the given Shape into directory root.
+
+    Return the list of the generated files, in a deterministic order."""
+    rng = random.Random(shape.seed)
+    pkg = os.path.join(root, "synth")
+    os.makedirs(pkg, exist_ok=True)
+
+    plan = {
+        m: [(c, _method_names(rng, shape, m, c)) for c in range(shape.classes)]
+        for m in range(shape.modules)
+    }
+
+    filenames = [os.path.join(pkg, "__init__.py")]
+    with open(filenames[0], "w") as f:
+        f.write('"""Synthetic package."""\n')
+
+    for m in range(shape.modules):
+        # import a few earlier modules, and sometimes a later one (cycle)
+        imports = sorted(rng.sample(range(m), min(m, 3)))
+        if m + 1 < shape.modules and rng.random() < shape.cycles:
+            imports.append(rng.randrange(m + 1, shape.modules))
+        filename = os.path.join(pkg, "mod%d.py" % m)
+        with open(filename, "w") as f:
+            f.write(_module_source(rng, shape, m, imports, plan))
+        filenames.append(filename)
+    return filenames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("output", help="directory to write the package into")
+    defaults = Shape()
+    for name, value in defaults.as_dict().items():
+        parser.add_argument(
+            "--" + name, type=type(value), default=value, help="(default: %(default)s)"
+        )
+    args = parser.parse_args()
+    shape = Shape(**{name: getattr(args, name) for name in defaults.as_dict()})
+    filenames = generate(args.output, shape)
+    print("Wrote %d files for %r" % (len(filenames), shape))
+
+
+if __name__ == "__main__":
+    main()
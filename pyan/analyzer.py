@@ -4,17 +4,30 @@
 
 import logging
 import ast
-import symtable
+import time
+from collections import Counter
 
 from .node import Node, Flavor
+from .cache import (
+    AnalysisCache,
+    file_digest,
+    make_records,
+    restore_record,
+    text_digest,
+)
+from .edgestore import CSRAdjacency, number_nodes
+from .profiling import NULL_PROFILER
 from .anutils import (
     tail,
-    get_module_name,
+    PackageIndex,
     format_alias,
     get_ast_node_name,
     sanitize_exprs,
     resolve_method_resolution_order,
-    Scope,
+    extract_scopes,
+    parse_module,
+    read_source,
+    ModuleStore,
     ExecuteInInnerScope,
     UnresolvedSuperCallError,
 )
@@ -34,6 +47,10 @@ from .anutils import (
 #
 #    Namespaces also get a Node (with no associated AST node).
 
+# Value of a name that is not present in a Scope (see get_state()).
+MISSING = object()
+
+
 # These tables were useful for porting the visitor to Python 3:
 #
 # https://docs.python.org/2/library/compiler.html#module-compiler.ast
@@ -46,22 +63,83 @@ class CallGraphVisitor(ast.NodeVisitor):
     A single CallGraphVisitor object can be run over several ASTs (from a
     set of source files).  The resulting information is the aggregate from
     all files.  This way use information between objects in different files
-    can be gathered."""
-
-    def __init__(self, filenames, logger=None):
+    can be gathered.
+
+    Each file is read and parsed only once; the ASTs are kept in
+    a ModuleStore for the later passes. max_parse_cache, if given, caps the
+    total size (in characters of source text) of the ASTs kept in memory;
+    any evicted module is re-parsed when needed.
+
+    cache, if given, is an AnalysisCache (or a directory name for one).
+    Modules whose results are found in the cache, and which import no
+    changed modules, are reloaded from it instead of being analyzed again.
+    digests, if given with a cache, maps filenames to their content digests
+    where they are already known (e.g. from cache.load_state(), for the files
+    that have not changed since); only the other files are hashed.
+
+    sources, if given, maps filenames to source text that replaces the
+    contents of the file on disk (e.g. unsaved buffers in an editor).
+
+    max_passes caps the number of passes over the files (see process()).
+
+    packages, if given, is a PackageIndex (e.g. filled in while searching
+    for the files) that is used for determining the module names.
+
+    profiler, if given, is a pyan.profiling.Profiler that records the time
+    and memory taken by each phase of the analysis.
+
+    costs, if given, is a pyan.costs.CostTracker that collects per-file and
+    per-namespace cost counters."""
+
+    def __init__(
+        self,
+        filenames,
+        logger=None,
+        max_parse_cache=None,
+        cache=None,
+        max_passes=5,
+        packages=None,
+        profiler=None,
+        costs=None,
+        digests=None,
+        sources=None,
+    ):
         self.logger = logger or logging.getLogger(__name__)
+        self.update_log_level()
+        self.profiler = profiler or NULL_PROFILER
+        self.costs = costs
+        self.cost_namespace = None  # top-level namespace being visited
+        self.sources = sources or {}  # filename: source text overriding the file
+        self.module_store = ModuleStore(
+            max_size=max_parse_cache, logger=self.logger, sources=self.sources
+        )
+        if isinstance(cache, str):
+            cache = AnalysisCache(cache, logger=self.logger)
+        self.cache = cache
 
         # full module names for all given files
         self.module_names = {}
         self.module_to_filename = (
             {}
         )  # inverse mapping for recording which file each AST node came from
+        self.filename_to_module = {}
+        self.packages = packages if packages is not None else PackageIndex()
         for filename in filenames:
-            mod_name = get_module_name(filename)
+            mod_name = self.packages.module_name(filename)
             short_name = mod_name.rsplit(".", 1)[-1]
             self.module_names[short_name] = mod_name
             self.module_to_filename[mod_name] = filename
+            self.filename_to_module[filename] = mod_name
         self.filenames = filenames
+        self.module_imports = {}  # module name: set of names of modules it imports
+        self.module_digests = {}  # module name: content hash (when using a cache)
+        self.known_digests = digests or {}  # filename: content hash
+
+        # dependency tracking for the worklist (see process())
+        self.max_passes = max_passes
+        self.reads = {}  # filename: {state key: value seen during last visit}
+        self.current_reads = None
+        self.current_writes = None
 
         # data gathered from analysis
         self.defines_edges = {}
@@ -69,7 +147,11 @@ class CallGraphVisitor(ast.NodeVisitor):
         self.nodes = (
             {}
         )  # Node name: list of Node objects (in possibly different namespaces)
+        self.nodes_by_key = {}  # (namespace, name): Node; primary index for get_node()
         self.scopes = {}  # fully qualified name of namespace: Scope object
+        self.frozen = False  # see freeze()
+        self.node_list = None  # after freeze(): node ID: Node
+        self.node_ids = None  # after freeze(): Node: node ID
 
         self.class_base_ast_nodes = {}  # pass 1: class Node: list of AST nodes
         self.class_base_nodes = (
@@ -90,40 +172,241 @@ class CallGraphVisitor(ast.NodeVisitor):
         self.process()
 
     def process(self):
-        """Analyze the set of files, twice so that any forward-references are picked up."""
-        for pas in range(2):
-            for filename in self.filenames:
+        """Analyze the set of files, until the results no longer change.
+
+        Pass 1 visits every file. After that, only the files whose analysis
+        depended on something that has changed since they were visited
+        (e.g. a forward-reference to a name that has since been bound, or
+        the MRO of a class, which is available only after pass 1) are
+        visited again, until a fixed point is reached.
+        """
+        self.update_log_level()
+        profiler = self.profiler
+        if self.cache is not None:
+            with profiler.phase("load cache"):
+                filenames = self.load_cached()
+        else:
+            filenames = self.filenames
+        worklist = filenames
+        pas = 0
+        while len(worklist):
+            if pas == self.max_passes:
+                self.logger.warning(
+                    "Analysis did not converge in %d passes; results may be"
+                    " incomplete for %s"
+                    % (
+                        pas,
+                        ", ".join(self.filename_to_module[f] for f in worklist),
+                    )
+                )
+                break
+            pas += 1
+            with profiler.phase("pass %d" % pas, files=len(worklist)):
+                for filename in worklist:
+                    if self.log_info:
+                        self.logger.info(
+                            "========== pass %d, file '%s' =========="
+                            % (pas, filename)
+                        )
+                    self.process_one(filename)
+            with profiler.phase("resolve_base_classes"):
+                # must be done only after all files seen
+                self.resolve_base_classes()
+            worklist = [f for f in filenames if self.is_stale(f)]
+            if self.log_info:
                 self.logger.info(
-                    "========== pass %d, file '%s' ==========" % (pas + 1, filename)
+                    "Pass %d done; %d files to revisit" % (pas, len(worklist))
                 )
-                self.process_one(filename)
-            if pas == 0:
-                self.resolve_base_classes()  # must be done only after all files seen
-        self.postprocess()
+        self.reads = {}
+        if self.cache is not None:
+            with profiler.phase("store cache"):
+                self.store_cached(filenames)
+        self.module_store.clear()  # release the ASTs
+        with profiler.phase("postprocess"):
+            self.postprocess()
+
+    def update_log_level(self):
+        """Cache whether info and debug messages are enabled in self.logger.
+
+        Log calls in the analyzer are guarded by these flags, so that at the
+        default level no message strings (nor Node reprs) are ever built.
+        Call this again if the level of the logger is changed."""
+        self.log_info = self.logger.isEnabledFor(logging.INFO)
+        self.log_debug = self.logger.isEnabledFor(logging.DEBUG)
+
+    ###########################################################################
+    # Dependency tracking for the worklist in process()
+
+    # While a file is being visited, every lookup of analysis state that may
+    # still change later (scope contents, MROs, the set of known classes)
+    # is recorded, together with the value seen. After a pass, a file must
+    # be visited again if any of those values is now different.
+    #
+    # Lookups of state that the same visit has already written are not
+    # recorded, since the visit will reproduce those writes itself.
+    #
+    # Keys are tuples:
+    #   ("def", scope, name)   value of name in Scope (MISSING if not present)
+    #   ("has", scope, name)   whether name is present in Scope
+    #   ("scope", ns)          whether the scope ns is known
+    #   ("mro", class_node)    the MRO of class_node (None if not known)
+    #   ("class", node)        whether node is a known (analyzed) class
+
+    def get_state(self, key):
+        """Return the current value of the piece of analysis state described by key."""
+        kind = key[0]
+        if kind == "def":
+            return key[1].defs.get(key[2], MISSING)
+        elif kind == "has":
+            return key[2] in key[1].defs
+        elif kind == "scope":
+            return key[1] in self.scopes
+        elif kind == "mro":
+            return self.mro.get(key[1])
+        else:  # kind == "class"
+            return key[1] in self.class_base_ast_nodes
+
+    def record_read(self, key, value):
+        """Record that the analysis of the current file has seen value for key,
+        which must be the current value of get_state(key). Return value."""
+        reads = self.current_reads
+        if reads is not None and key not in reads and key not in self.current_writes:
+            reads[key] = value
+        return value
+
+    def record_write(self, scope, name):
+        """Record that the analysis of the current file has set name in scope."""
+        if self.current_writes is not None:
+            self.current_writes.add(("def", scope, name))
+            self.current_writes.add(("has", scope, name))
+
+    def is_stale(self, filename):
+        """Return whether the analysis of filename depends on state that has
+        changed since it was last visited."""
+        for key, value in self.reads.get(filename, {}).items():
+            if self.get_state(key) != value:
+                return True
+        return False
+
+    def load_cached(self):
+        """Reload the results of unchanged modules from self.cache.
+
+        A module is unchanged if the cache has an entry for its current
+        content, and none of the modules it imports (transitively) has changed.
+
+        Return the list of files that still need to be analyzed."""
+        for filename in self.filenames:
+            module_name = self.filename_to_module[filename]
+            digest = self.known_digests.get(filename)
+            if filename in self.sources:
+                digest = text_digest(self.sources[filename])
+            elif digest is None:
+                digest = file_digest(filename)
+            self.module_digests[module_name] = digest
+
+        # Results of files that share a module name can't be told apart.
+        counts = Counter(self.filename_to_module.values())
+        records = {}  # module name: ModuleRecord
+        for filename in self.filenames:
+            module_name = self.filename_to_module[filename]
+            if counts[module_name] > 1:
+                continue
+            digest = self.module_digests[module_name]
+            record = self.cache.load(filename, module_name, digest)
+            if record is not None and all(
+                self.module_digests.get(dep) == dep_digest
+                for dep, dep_digest in record.deps.items()
+            ):
+                records[module_name] = record
+
+        # Invalidate the importers of any module that must be re-analyzed.
+        changed = True
+        while changed:
+            changed = False
+            for module_name, record in list(records.items()):
+                for dep in record.deps:
+                    if dep in self.module_digests and dep not in records:
+                        del records[module_name]
+                        changed = True
+                        break
+
+        filenames = []
+        for filename in self.filenames:
+            module_name = self.filename_to_module[filename]
+            if module_name in records:
+                if self.log_info:
+                    self.logger.info("Reloading '%s' from cache" % (filename))
+                restore_record(self, records[module_name], filename)
+            else:
+                filenames.append(filename)
+        if self.log_info:
+            self.logger.info(
+                "Analysis cache: %d files reloaded, %d files to analyze"
+                % (len(self.filenames) - len(filenames), len(filenames))
+            )
+        return filenames
+
+    def store_cached(self, filenames):
+        """Save the results of the given (freshly analyzed) files into self.cache.
+
+        Must be called after pass 2, before postprocessing."""
+        counts = Counter(self.filename_to_module.values())
+        filenames = [f for f in filenames if counts[self.filename_to_module[f]] == 1]
+        for record in make_records(self, filenames):
+            self.cache.store(record)
 
     def process_one(self, filename):
-        """Analyze the specified Python source file."""
+        """Analyze the specified Python source file.
+
+        The file is read, parsed and scope-analyzed the first time only;
+        later calls reuse its AST from self.module_store."""
         if filename not in self.filenames:
             raise ValueError(
                 "Filename '%s' has not been preprocessed (was not given to __init__, which got %s)"
                 % (filename, self.filenames)
             )
-        with open(filename, "rt", encoding="utf-8") as f:
-            content = f.read()
         self.filename = filename
-        self.module_name = get_module_name(filename)
-        self.analyze_scopes(content, filename)  # add to the currently known scopes
-        self.visit(ast.parse(content, filename))
+        self.module_name = self.filename_to_module[filename]
+        profiler = self.profiler
+        start = time.perf_counter()
+        if filename in self.module_store:
+            with profiler.phase("get tree", "file", file=filename):
+                tree = self.module_store.get_tree(filename)  # may re-parse
+        else:
+            with profiler.phase("read", "file", file=filename):
+                content = self.sources.get(filename)
+                if content is None:
+                    content = read_source(filename)
+            with profiler.phase("symtable", "file", file=filename):
+                scopes = extract_scopes(content, filename, self.module_name)
+            scanned = (content, scopes)
+            with profiler.phase("parse", "file", file=filename):
+                module = parse_module(filename, self.module_name, scanned)
+            self.module_store.add(module)
+            self.add_scopes(module.scopes)  # add to the currently known scopes
+            tree = module.tree
+        if self.costs is not None:
+            elapsed = time.perf_counter() - start
+            self.costs.add(filename, self.module_name, "parse_s", elapsed)
+        self.current_reads = {}
+        self.current_writes = set()
+        with profiler.phase("visit", "file", file=filename):
+            self.visit(tree)
+        self.reads[filename] = self.current_reads
+        self.current_reads = None
+        self.current_writes = None
         self.module_name = None
         self.filename = None
 
     def resolve_base_classes(self):
         """Resolve base classes from AST nodes to Nodes.
 
-        Run this between pass 1 and pass 2 to pick up inherited methods.
-        Currently, this can parse ast.Names and ast.Attributes as bases.
+        process() runs this after every pass, so that the files visited again
+        pick up inherited methods. Currently, this can parse ast.Names and
+        ast.Attributes as bases.
         """
-        self.logger.debug("Resolving base classes")
+        if self.log_debug:
+            self.logger.debug("Resolving base classes")
         assert len(self.scope_stack) == 0  # only allowed between passes
         for node in self.class_base_ast_nodes:  # Node: list of AST nodes
             self.class_base_nodes[node] = []
@@ -148,18 +431,21 @@ class CallGraphVisitor(ast.NodeVisitor):
                 ):
                     self.class_base_nodes[node].append(baseclass_node)
 
-        self.logger.debug(
-            "All base classes (non-recursive, local level only): %s"
-            % self.class_base_nodes
-        )
+        if self.log_debug:
+            self.logger.debug(
+                "All base classes (non-recursive, local level only): %s"
+                % self.class_base_nodes
+            )
 
-        self.logger.debug(
-            "Resolving method resolution order (MRO) for all analyzed classes"
-        )
+        if self.log_debug:
+            self.logger.debug(
+                "Resolving method resolution order (MRO) for all analyzed classes"
+            )
         self.mro = resolve_method_resolution_order(self.class_base_nodes, self.logger)
-        self.logger.debug(
-            "Method resolution order (MRO) for all analyzed classes: %s" % self.mro
-        )
+        if self.log_debug:
+            self.logger.debug(
+                "Method resolution order (MRO) for all analyzed classes: %s" % self.mro
+            )
 
     def postprocess(self):
         """Finalize the analysis."""
@@ -178,10 +464,61 @@ class CallGraphVisitor(ast.NodeVisitor):
         # those references that could not be resolved to any known name, and
         # then remove any references pointing outside the analyzed file set.
 
-        self.expand_unknowns()
-        self.contract_nonexistents()
-        self.cull_inherited()
-        self.collapse_inner()
+        for stage in (
+            self.expand_unknowns,
+            self.contract_nonexistents,
+            self.cull_inherited,
+            self.collapse_inner,
+        ):
+            if not self.log_info:
+                # counting the edges is a pass over all of them; skip it
+                with self.profiler.phase(stage.__name__):
+                    stage()
+                continue
+            uses_before = self.count_edges(self.uses_edges)
+            defines_before = self.count_edges(self.defines_edges)
+            start = time.perf_counter()
+            with self.profiler.phase(stage.__name__):
+                stage()
+            elapsed = time.perf_counter() - start
+            uses_after = self.count_edges(self.uses_edges)
+            defines_after = self.count_edges(self.defines_edges)
+            self.logger.info(
+                "Postprocessing: %s took %.3f s; uses edges %d -> %d (%+d),"
+                " defines edges %d -> %d (%+d)"
+                % (
+                    stage.__name__,
+                    elapsed,
+                    uses_before,
+                    uses_after,
+                    uses_after - uses_before,
+                    defines_before,
+                    defines_after,
+                    defines_after - defines_before,
+                )
+            )
+
+    def freeze(self):
+        """Convert the edges into compact integer-ID form (see pyan.edgestore).
+
+        Call this once the analysis is complete, to reduce the memory used
+        by the edges. Afterwards, defines_edges and uses_edges are read-only
+        CSRAdjacency objects (still usable as dicts of sets); node_list maps
+        node IDs to Nodes, and node_ids maps Nodes to node IDs."""
+        if self.frozen:
+            return
+        all_nodes = [n for nodes in self.nodes.values() for n in nodes]
+        self.node_list, self.node_ids = number_nodes(all_nodes)
+        self.defines_edges = CSRAdjacency(
+            self.node_list, self.node_ids, self.defines_edges
+        )
+        self.uses_edges = CSRAdjacency(self.node_list, self.node_ids, self.uses_edges)
+        self.frozen = True
+
+    @staticmethod
+    def count_edges(edges):
+        """Return the number of edges in a dict of sets (defines_edges, uses_edges)."""
+        return sum(len(targets) for targets in edges.values())
 
     ###########################################################################
     # visitor methods
@@ -192,7 +529,8 @@ class CallGraphVisitor(ast.NodeVisitor):
     # https://docs.python.org/3/library/ast.html#abstract-grammar
 
     def visit_Module(self, node):
-        self.logger.debug("Module")
+        if self.log_debug:
+            self.logger.debug("Module")
 
         # Modules live in the top-level namespace, ''.
         module_node = self.get_node("", self.module_name, node, flavor=Flavor.MODULE)
@@ -202,20 +540,54 @@ class CallGraphVisitor(ast.NodeVisitor):
         self.name_stack.append(ns)
         self.scope_stack.append(self.scopes[ns])
         self.context_stack.append("Module %s" % (ns))
-        self.generic_visit(node)  # visit the **children** of node
+        if self.costs is None:
+            self.generic_visit(node)  # visit the **children** of node
+        else:
+            self.visit_module_body(node)
         self.context_stack.pop()
         self.scope_stack.pop()
         self.name_stack.pop()
         self.last_value = None
 
+    def visit_module_body(self, node):
+        """Visit the children of an ast.Module, timing each top-level
+        statement for self.costs."""
+        ns = self.module_name
+        for stmt in node.body:
+            if isinstance(stmt, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+                self.cost_namespace = ns + "." + stmt.name
+            else:
+                self.cost_namespace = ns
+            start = time.perf_counter()
+            self.visit(stmt)
+            elapsed = time.perf_counter() - start
+            self.costs.add(self.filename, self.cost_namespace, "visit_s", elapsed)
+        self.cost_namespace = None
+
+    def cost_site(self, graph_node):
+        """Return the (filename, top-level namespace) that the costs of
+        graph_node are attributed to, or None if it is not in an analyzed file."""
+        if self.cost_namespace is not None:  # visiting
+            return self.filename, self.cost_namespace
+        module_name = self.filename_to_module.get(graph_node.filename)
+        if module_name is None:
+            return None
+        fullname = graph_node.get_name()
+        if fullname.startswith(module_name + "."):
+            head = fullname[len(module_name) + 1 :].split(".", 1)[0]
+            return graph_node.filename, module_name + "." + head
+        return graph_node.filename, module_name
+
     def visit_ClassDef(self, node):
-        self.logger.debug("ClassDef %s" % (node.name))
+        if self.log_debug:
+            self.logger.debug("ClassDef %s" % (node.name))
 
         from_node = self.get_node_of_current_namespace()
         ns = from_node.get_name()
         to_node = self.get_node(ns, node.name, node, flavor=Flavor.CLASS)
         if self.add_defines_edge(from_node, to_node):
-            self.logger.info("Def from %s to Class %s" % (from_node, to_node))
+            if self.log_info:
+                self.logger.info("Def from %s to Class %s" % (from_node, to_node))
 
         # The graph Node may have been created earlier by a FromImport,
         # in which case its AST node points to the site of the import.
@@ -253,7 +625,8 @@ class CallGraphVisitor(ast.NodeVisitor):
         self.class_stack.pop()
 
     def visit_FunctionDef(self, node):
-        self.logger.debug("FunctionDef %s" % (node.name))
+        if self.log_debug:
+            self.logger.debug("FunctionDef %s" % (node.name))
 
         # To begin with:
         #
@@ -275,7 +648,8 @@ class CallGraphVisitor(ast.NodeVisitor):
         ns = from_node.get_name()
         to_node = self.get_node(ns, node.name, node, flavor=flavor)
         if self.add_defines_edge(from_node, to_node):
-            self.logger.info("Def from %s to Function %s" % (from_node, to_node))
+            if self.log_info:
+                self.logger.info("Def from %s to Function %s" % (from_node, to_node))
 
         # Same remarks as for ClassDef above.
         #
@@ -304,14 +678,15 @@ class CallGraphVisitor(ast.NodeVisitor):
         sc = self.scopes[inner_ns]
         nonsense_node = self.get_node(inner_ns, "^^^argument^^^", None)
         all_args = node.args  # args, vararg (*args), kwonlyargs, kwarg (**kwargs)
-        for a in all_args.args:  # positional
-            sc.defs[a.arg] = nonsense_node
+        arg_names = [a.arg for a in all_args.args]  # positional
         if all_args.vararg is not None:  # *args if present
-            sc.defs[all_args.vararg] = nonsense_node
-        for a in all_args.kwonlyargs:
-            sc.defs[a.arg] = nonsense_node
+            arg_names.append(all_args.vararg.arg)
+        arg_names.extend(a.arg for a in all_args.kwonlyargs)
         if all_args.kwarg is not None:  # **kwargs if present
-            sc.defs[all_args.kwarg] = nonsense_node
+            arg_names.append(all_args.kwarg.arg)
+        for arg_name in arg_names:
+            sc.defs[arg_name] = nonsense_node
+            self.record_write(sc, arg_name)
 
         # self_name is just an ordinary name in the method namespace, except
         # that its value is implicitly set by Python when the method is called.
@@ -325,9 +700,11 @@ class CallGraphVisitor(ast.NodeVisitor):
         if self_name is not None:
             class_node = self.get_current_class()
             self.scopes[inner_ns].defs[self_name] = class_node
-            self.logger.info(
-                'Method def: setting self name "%s" to %s' % (self_name, class_node)
-            )
+            self.record_write(self.scopes[inner_ns], self_name)
+            if self.log_info:
+                self.logger.info(
+                    'Method def: setting self name "%s" to %s' % (self_name, class_node)
+                )
 
         for d in node.args.defaults:
             self.visit(d)
@@ -349,7 +726,8 @@ class CallGraphVisitor(ast.NodeVisitor):
         )  # TODO: alias for now; tag async functions in output in a future version?
 
     def visit_Lambda(self, node):
-        self.logger.debug("Lambda")
+        if self.log_debug:
+            self.logger.debug("Lambda")
         with ExecuteInInnerScope(self, "lambda"):
             for d in node.args.defaults:
                 self.visit(d)
@@ -358,7 +736,8 @@ class CallGraphVisitor(ast.NodeVisitor):
             self.visit(node.body)  # single expr
 
     def visit_Import(self, node):
-        self.logger.debug("Import %s" % [format_alias(x) for x in node.names])
+        if self.log_debug:
+            self.logger.debug("Import %s" % [format_alias(x) for x in node.names])
 
         # TODO: add support for relative imports (path may be like "....something.something")
         # https://www.python.org/dev/peps/pep-0328/#id10
@@ -387,6 +766,7 @@ class CallGraphVisitor(ast.NodeVisitor):
                 mod_name = self.module_names[src_name]
             else:
                 mod_name = src_name
+            self.add_module_import(mod_name)
             tgt_module = self.get_node("", mod_name, node, flavor=Flavor.MODULE)
             # XXX: if there is no asname, it may happen that mod_name == tgt_name,
             # in which case these will be the same Node. They are semantically
@@ -398,28 +778,35 @@ class CallGraphVisitor(ast.NodeVisitor):
 
             # must do this after possibly munging flavor to avoid confusing
             # the user reading the log
-            self.logger.debug("Use from %s to Import %s" % (from_node, to_node))
+            if self.log_debug:
+                self.logger.debug("Use from %s to Import %s" % (from_node, to_node))
             if is_new_edge:
-                self.logger.info(
-                    "New edge added for Use from %s to Import %s" % (from_node, to_node)
-                )
+                if self.log_info:
+                    self.logger.info(
+                        "New edge added for Use from %s to Import %s"
+                        % (from_node, to_node)
+                    )
 
     def visit_ImportFrom(self, node):
-        self.logger.debug(
-            "ImportFrom: from %s import %s"
-            % (node.module, [format_alias(x) for x in node.names])
-        )
+        if self.log_debug:
+            self.logger.debug(
+                "ImportFrom: from %s import %s"
+                % (node.module, [format_alias(x) for x in node.names])
+            )
 
         tgt_name = node.module
         from_node = self.get_node_of_current_namespace()
         to_node = self.get_node(
             "", tgt_name, node, flavor=Flavor.MODULE
         )  # module, in top-level namespace
-        self.logger.debug("Use from %s to ImportFrom %s" % (from_node, to_node))
+        if self.log_debug:
+            self.logger.debug("Use from %s to ImportFrom %s" % (from_node, to_node))
         if self.add_uses_edge(from_node, to_node):
-            self.logger.info(
-                "New edge added for Use from %s to ImportFrom %s" % (from_node, to_node)
-            )
+            if self.log_info:
+                self.logger.info(
+                    "New edge added for Use from %s to ImportFrom %s"
+                    % (from_node, to_node)
+                )
 
         if tgt_name in self.module_names:
             mod_name = self.module_names[tgt_name]
@@ -428,11 +815,18 @@ class CallGraphVisitor(ast.NodeVisitor):
 
         for import_item in node.names:
             name = import_item.name
+            # the imported item may itself be a module ("from pkg import mod")
+            if mod_name is not None:
+                self.add_module_import(mod_name)
+                self.add_module_import("%s.%s" % (mod_name, name))
+            else:  # "from . import mod"
+                self.add_module_import(self.module_names.get(name, name))
             new_name = import_item.asname if import_item.asname is not None else name
             # we imported the identifier name from the module mod_name
             tgt_id = self.get_node(mod_name, name, node, flavor=Flavor.IMPORTEDITEM)
             self.set_value(new_name, tgt_id)
-            self.logger.info("From setting name %s to %s" % (new_name, tgt_id))
+            if self.log_info:
+                self.logger.info("From setting name %s to %s" % (new_name, tgt_id))
 
     #    # Edmund Horner's original post has info on what this fixed in Python 2.
     #    # https://ejrh.wordpress.com/2012/01/31/call-graphs-in-python-part-2/
@@ -452,9 +846,11 @@ class CallGraphVisitor(ast.NodeVisitor):
     # attribute access (node.ctx determines whether set (ast.Store) or get (ast.Load))
     def visit_Attribute(self, node):
         objname = get_ast_node_name(node.value)
-        self.logger.debug(
-            "Attribute %s of %s in context %s" % (node.attr, objname, type(node.ctx))
-        )
+        if self.log_debug:
+            self.logger.debug(
+                "Attribute %s of %s in context %s"
+                % (node.attr, objname, type(node.ctx))
+            )
 
         # TODO: self.last_value is a hack. Handle names in store context (LHS)
         # in analyze_binding(), so that visit_Attribute() only needs to handle
@@ -464,9 +860,10 @@ class CallGraphVisitor(ast.NodeVisitor):
             new_value = self.last_value
             try:
                 if self.set_attribute(node, new_value):
-                    self.logger.info(
-                        "setattr %s on %s to %s" % (node.attr, objname, new_value)
-                    )
+                    if self.log_info:
+                        self.logger.info(
+                            "setattr %s on %s to %s" % (node.attr, objname, new_value)
+                        )
             except UnresolvedSuperCallError:
                 # Trying to set something belonging to an unresolved super()
                 # of something; just ignore this attempt to setattr.
@@ -482,17 +879,21 @@ class CallGraphVisitor(ast.NodeVisitor):
 
             # Both object and attr known.
             if isinstance(attr_node, Node):
-                self.logger.info(
-                    "getattr %s on %s returns %s" % (node.attr, objname, attr_node)
-                )
+                if self.log_info:
+                    self.logger.info(
+                        "getattr %s on %s returns %s" % (node.attr, objname, attr_node)
+                    )
 
                 # add uses edge
                 from_node = self.get_node_of_current_namespace()
-                self.logger.debug("Use from %s to %s" % (from_node, attr_node))
+                if self.log_debug:
+                    self.logger.debug("Use from %s to %s" % (from_node, attr_node))
                 if self.add_uses_edge(from_node, attr_node):
-                    self.logger.info(
-                        "New edge added for Use from %s to %s" % (from_node, attr_node)
-                    )
+                    if self.log_info:
+                        self.logger.info(
+                            "New edge added for Use from %s to %s"
+                            % (from_node, attr_node)
+                        )
 
                 # remove resolved wildcard from current site to <Node *.attr>
                 if attr_node.namespace is not None:
@@ -520,15 +921,17 @@ class CallGraphVisitor(ast.NodeVisitor):
                 from_node = self.get_node_of_current_namespace()
                 ns = obj_node.get_name()  # fully qualified namespace **of attr**
                 to_node = self.get_node(ns, tgt_name, node, flavor=Flavor.ATTRIBUTE)
-                self.logger.debug(
-                    "Use from %s to %s (target obj %s known but target attr %s not resolved; maybe fwd ref or unanalyzed import)"
-                    % (from_node, to_node, obj_node, node.attr)
-                )
-                if self.add_uses_edge(from_node, to_node):
-                    self.logger.info(
-                        "New edge added for Use from %s to %s (target obj %s known but target attr %s not resolved; maybe fwd ref or unanalyzed import)"
+                if self.log_debug:
+                    self.logger.debug(
+                        "Use from %s to %s (target obj %s known but target attr %s not resolved; maybe fwd ref or unanalyzed import)"
                         % (from_node, to_node, obj_node, node.attr)
                     )
+                if self.add_uses_edge(from_node, to_node):
+                    if self.log_info:
+                        self.logger.info(
+                            "New edge added for Use from %s to %s (target obj %s known but target attr %s not resolved; maybe fwd ref or unanalyzed import)"
+                            % (from_node, to_node, obj_node, node.attr)
+                        )
 
                 # remove resolved wildcard from current site to <Node *.attr>
                 self.remove_wild(from_node, obj_node, node.attr)
@@ -540,21 +943,24 @@ class CallGraphVisitor(ast.NodeVisitor):
                 tgt_name = node.attr
                 from_node = self.get_node_of_current_namespace()
                 to_node = self.get_node(None, tgt_name, node, flavor=Flavor.UNKNOWN)
-                self.logger.debug(
-                    "Use from %s to %s (target obj %s not resolved; maybe fwd ref, function argument, or unanalyzed import)"
-                    % (from_node, to_node, objname)
-                )
-                if self.add_uses_edge(from_node, to_node):
-                    self.logger.info(
-                        "New edge added for Use from %s to %s (target obj %s not resolved; maybe fwd ref, function argument, or unanalyzed import)"
+                if self.log_debug:
+                    self.logger.debug(
+                        "Use from %s to %s (target obj %s not resolved; maybe fwd ref, function argument, or unanalyzed import)"
                         % (from_node, to_node, objname)
                     )
+                if self.add_uses_edge(from_node, to_node):
+                    if self.log_info:
+                        self.logger.info(
+                            "New edge added for Use from %s to %s (target obj %s not resolved; maybe fwd ref, function argument, or unanalyzed import)"
+                            % (from_node, to_node, objname)
+                        )
 
                 self.last_value = to_node
 
     # name access (node.ctx determines whether set (ast.Store) or get (ast.Load))
     def visit_Name(self, node):
-        self.logger.debug("Name %s in context %s" % (node.id, type(node.ctx)))
+        if self.log_debug:
+            self.logger.debug("Name %s in context %s" % (node.id, type(node.ctx)))
 
         # TODO: self.last_value is a hack. Handle names in store context (LHS)
         # in analyze_binding(), so that visit_Name() only needs to handle
@@ -579,12 +985,14 @@ class CallGraphVisitor(ast.NodeVisitor):
                     to_node = self.get_node(None, tgt_name, node, flavor=Flavor.UNKNOWN)
 
                 from_node = self.get_node_of_current_namespace()
-                self.logger.debug("Use from %s to Name %s" % (from_node, to_node))
+                if self.log_debug:
+                    self.logger.debug("Use from %s to Name %s" % (from_node, to_node))
                 if self.add_uses_edge(from_node, to_node):
-                    self.logger.info(
-                        "New edge added for Use from %s to Name %s"
-                        % (from_node, to_node)
-                    )
+                    if self.log_info:
+                        self.logger.info(
+                            "New edge added for Use from %s to Name %s"
+                            % (from_node, to_node)
+                        )
 
             self.last_value = to_node
 
@@ -593,7 +1001,10 @@ class CallGraphVisitor(ast.NodeVisitor):
         # - tuple unpacking works as a separate mechanism on top of that (see analyze_binding())
         #
         if len(node.targets) > 1:
-            self.logger.debug("Assign (chained with %d outputs)" % (len(node.targets)))
+            if self.log_debug:
+                self.logger.debug(
+                    "Assign (chained with %d outputs)" % (len(node.targets))
+                )
 
         # TODO: support lists, dicts, sets (so that we can recognize calls to their methods)
         # TODO: begin with supporting empty lists, dicts, sets
@@ -604,13 +1015,14 @@ class CallGraphVisitor(ast.NodeVisitor):
         )  # values is the same for each set of targets
         for targets in node.targets:
             targets = sanitize_exprs(targets)
-            self.logger.debug(
-                "Assign %s %s"
-                % (
-                    [get_ast_node_name(x) for x in targets],
-                    [get_ast_node_name(x) for x in values],
+            if self.log_debug:
+                self.logger.debug(
+                    "Assign %s %s"
+                    % (
+                        [get_ast_node_name(x) for x in targets],
+                        [get_ast_node_name(x) for x in values],
+                    )
                 )
-            )
             self.analyze_binding(targets, values)
 
     def visit_AnnAssign(self, node):
@@ -618,15 +1030,17 @@ class CallGraphVisitor(ast.NodeVisitor):
             node.value
         )  # values is the same for each set of targets
 
-        node.target = sanitize_exprs(node.target)
-        targets = node.target
-        self.logger.debug(
-            "Assign %s %s"
-            % (
-                [get_ast_node_name(x) for x in targets],
-                [get_ast_node_name(x) for x in values],
+        # Don't store the sanitized target back into the AST node;
+        # the same AST is visited again in pass 2.
+        targets = sanitize_exprs(node.target)
+        if self.log_debug:
+            self.logger.debug(
+                "Assign %s %s"
+                % (
+                    [get_ast_node_name(x) for x in targets],
+                    [get_ast_node_name(x) for x in values],
+                )
             )
-        )
         self.analyze_binding(targets, values)
 
     def visit_AugAssign(self, node):
@@ -635,14 +1049,15 @@ class CallGraphVisitor(ast.NodeVisitor):
             node.value
         )  # values is the same for each set of targets
 
-        self.logger.debug(
-            "AugAssign %s %s %s"
-            % (
-                [get_ast_node_name(x) for x in targets],
-                type(node.op),
-                [get_ast_node_name(x) for x in values],
+        if self.log_debug:
+            self.logger.debug(
+                "AugAssign %s %s %s"
+                % (
+                    [get_ast_node_name(x) for x in targets],
+                    type(node.op),
+                    [get_ast_node_name(x) for x in values],
+                )
             )
-        )
 
         # TODO: maybe no need to handle tuple unpacking in AugAssign? (but simpler to use the same implementation)
         self.analyze_binding(targets, values)
@@ -655,7 +1070,8 @@ class CallGraphVisitor(ast.NodeVisitor):
     #  in use elsewhere.)
     #
     def visit_For(self, node):
-        self.logger.debug("For-loop")
+        if self.log_debug:
+            self.logger.debug("For-loop")
 
         targets = sanitize_exprs(node.target)
         values = sanitize_exprs(node.iter)
@@ -672,32 +1088,37 @@ class CallGraphVisitor(ast.NodeVisitor):
         )  # TODO: alias for now; tag async for in output in a future version?
 
     def visit_ListComp(self, node):
-        self.logger.debug("ListComp")
+        if self.log_debug:
+            self.logger.debug("ListComp")
         with ExecuteInInnerScope(self, "listcomp"):
-            self.visit(node.elt)
             self.analyze_generators(node.generators)
+            self.visit(node.elt)
 
     def visit_SetComp(self, node):
-        self.logger.debug("SetComp")
+        if self.log_debug:
+            self.logger.debug("SetComp")
         with ExecuteInInnerScope(self, "setcomp"):
-            self.visit(node.elt)
             self.analyze_generators(node.generators)
+            self.visit(node.elt)
 
     def visit_DictComp(self, node):
-        self.logger.debug("DictComp")
+        if self.log_debug:
+            self.logger.debug("DictComp")
         with ExecuteInInnerScope(self, "dictcomp"):
+            self.analyze_generators(node.generators)
             self.visit(node.key)
             self.visit(node.value)
-            self.analyze_generators(node.generators)
 
     def visit_GeneratorExp(self, node):
-        self.logger.debug("GeneratorExp")
+        if self.log_debug:
+            self.logger.debug("GeneratorExp")
         with ExecuteInInnerScope(self, "genexpr"):
-            self.visit(node.elt)
             self.analyze_generators(node.generators)
+            self.visit(node.elt)
 
     def visit_Call(self, node):
-        self.logger.debug("Call %s" % (get_ast_node_name(node.func)))
+        if self.log_debug:
+            self.logger.debug("Call %s" % (get_ast_node_name(node.func)))
 
         # visit args to detect uses
         for arg in node.args:
@@ -716,15 +1137,17 @@ class CallGraphVisitor(ast.NodeVisitor):
 
             from_node = self.get_node_of_current_namespace()
             to_node = result_node
-            self.logger.debug(
-                "Use from %s to %s (via resolved call to built-ins)"
-                % (from_node, to_node)
-            )
-            if self.add_uses_edge(from_node, to_node):
-                self.logger.info(
-                    "New edge added for Use from %s to %s (via resolved call to built-ins)"
+            if self.log_debug:
+                self.logger.debug(
+                    "Use from %s to %s (via resolved call to built-ins)"
                     % (from_node, to_node)
                 )
+            if self.add_uses_edge(from_node, to_node):
+                if self.log_info:
+                    self.logger.info(
+                        "New edge added for Use from %s to %s (via resolved call to built-ins)"
+                        % (from_node, to_node)
+                    )
 
         else:  # generic function call
             # Visit the function name part last, so that inside a binding form,
@@ -741,24 +1164,30 @@ class CallGraphVisitor(ast.NodeVisitor):
             # the AST nodes; the keys just conveniently happen to be the Nodes
             # of known classes.
             #
-            if self.last_value in self.class_base_ast_nodes:
+            if self.record_read(
+                ("class", self.last_value),
+                self.last_value in self.class_base_ast_nodes,
+            ):
                 from_node = self.get_node_of_current_namespace()
                 class_node = self.last_value
                 to_node = self.get_node(
                     class_node.get_name(), "__init__", None, flavor=Flavor.METHOD
                 )
-                self.logger.debug(
-                    "Use from %s to %s (call creates an instance)"
-                    % (from_node, to_node)
-                )
-                if self.add_uses_edge(from_node, to_node):
-                    self.logger.info(
-                        "New edge added for Use from %s to %s (call creates an instance)"
+                if self.log_debug:
+                    self.logger.debug(
+                        "Use from %s to %s (call creates an instance)"
                         % (from_node, to_node)
                     )
+                if self.add_uses_edge(from_node, to_node):
+                    if self.log_info:
+                        self.logger.info(
+                            "New edge added for Use from %s to %s (call creates an instance)"
+                            % (from_node, to_node)
+                        )
 
     def visit_With(self, node):
-        self.logger.debug("With (context manager)")
+        if self.log_debug:
+            self.logger.debug("With (context manager)")
 
         def add_uses_enter_exit_of(graph_node):
             # add uses edges to __enter__ and __exit__ methods of given Node
@@ -766,9 +1195,10 @@ class CallGraphVisitor(ast.NodeVisitor):
                 from_node = self.get_node_of_current_namespace()
                 withed_obj_node = graph_node
 
-                self.logger.debug(
-                    "Use from %s to With %s" % (from_node, withed_obj_node)
-                )
+                if self.log_debug:
+                    self.logger.debug(
+                        "Use from %s to With %s" % (from_node, withed_obj_node)
+                    )
                 for methodname in ("__enter__", "__exit__"):
                     to_node = self.get_node(
                         withed_obj_node.get_name(),
@@ -777,10 +1207,11 @@ class CallGraphVisitor(ast.NodeVisitor):
                         flavor=Flavor.METHOD,
                     )
                     if self.add_uses_edge(from_node, to_node):
-                        self.logger.info(
-                            "New edge added for Use from %s to %s"
-                            % (from_node, to_node)
-                        )
+                        if self.log_info:
+                            self.logger.info(
+                                "New edge added for Use from %s to %s"
+                                % (from_node, to_node)
+                            )
 
         for withitem in node.items:
             expr = withitem.context_expr
@@ -968,8 +1399,10 @@ class CallGraphVisitor(ast.NodeVisitor):
             funcname = func_ast_node.id
             if funcname == "super":
                 class_node = self.get_current_class()
-                self.logger.debug("Resolving super() of %s" % (class_node))
-                if class_node in self.mro:
+                if self.log_debug:
+                    self.logger.debug("Resolving super() of %s" % (class_node))
+                mro = self.record_read(("mro", class_node), self.mro.get(class_node))
+                if mro is not None:
                     # Our super() class is the next one in the MRO.
                     #
                     # Note that we consider only the **static type** of the
@@ -982,40 +1415,47 @@ class CallGraphVisitor(ast.NodeVisitor):
                     # This is a limitation of pure lexical scope based static
                     # code analysis.
                     #
-                    if len(self.mro[class_node]) > 1:
-                        result = self.mro[class_node][1]
-                        self.logger.debug("super of %s is %s" % (class_node, result))
+                    if len(mro) > 1:
+                        result = mro[1]
+                        if self.log_debug:
+                            self.logger.debug(
+                                "super of %s is %s" % (class_node, result)
+                            )
                         return result
                     else:
                         msg = "super called for %s, but no known bases" % (class_node)
-                        self.logger.info(msg)
+                        if self.log_info:
+                            self.logger.info(msg)
                         raise UnresolvedSuperCallError(msg)
                 else:
                     msg = (
                         "super called for %s, but MRO not determined for it (maybe still in pass 1?)"
                         % (class_node)
                     )
-                    self.logger.info(msg)
+                    if self.log_info:
+                        self.logger.info(msg)
                     raise UnresolvedSuperCallError(msg)
 
             if funcname in ("str", "repr"):
                 if len(ast_node.args) == 1:  # these take only one argument
                     obj_astnode = ast_node.args[0]
                     if isinstance(obj_astnode, (ast.Name, ast.Attribute)):
-                        self.logger.debug(
-                            "Resolving %s() of %s"
-                            % (funcname, get_ast_node_name(obj_astnode))
-                        )
+                        if self.log_debug:
+                            self.logger.debug(
+                                "Resolving %s() of %s"
+                                % (funcname, get_ast_node_name(obj_astnode))
+                            )
                         attrname = "__%s__" % (funcname)
                         # build a temporary ast.Attribute AST node so that we can use get_attribute()
                         tmp_astnode = ast.Attribute(
                             value=obj_astnode, attr=attrname, ctx=obj_astnode.ctx
                         )
                         obj_node, attr_node = self.get_attribute(tmp_astnode)
-                        self.logger.debug(
-                            "Resolve %s() of %s: returning attr node %s"
-                            % (funcname, get_ast_node_name(obj_astnode), attr_node)
-                        )
+                        if self.log_debug:
+                            self.logger.debug(
+                                "Resolve %s() of %s: returning attr node %s"
+                                % (funcname, get_ast_node_name(obj_astnode), attr_node)
+                            )
                         return attr_node
 
             # add implementations for other built-in funcnames here if needed
@@ -1035,10 +1475,11 @@ class CallGraphVisitor(ast.NodeVisitor):
         if not isinstance(ast_node, ast.Attribute):
             raise TypeError("Expected ast.Attribute; got %s" % (type(ast_node)))
 
-        self.logger.debug(
-            "Resolve %s.%s in context %s"
-            % (get_ast_node_name(ast_node.value), ast_node.attr, type(ast_node.ctx))
-        )
+        if self.log_debug:
+            self.logger.debug(
+                "Resolve %s.%s in context %s"
+                % (get_ast_node_name(ast_node.value), ast_node.attr, type(ast_node.ctx))
+            )
 
         # Resolve nested attributes
         #
@@ -1050,15 +1491,17 @@ class CallGraphVisitor(ast.NodeVisitor):
 
             if isinstance(obj_node, Node) and obj_node.namespace is not None:
                 ns = obj_node.get_name()  # fully qualified namespace **of attr**
-                if (
-                    ns in self.scopes
+                if self.record_read(
+                    ("scope", ns), ns in self.scopes
                 ):  # imported modules not in the set of analyzed files are not seen by Pyan
                     sc = self.scopes[ns]
-                    if attr_name in sc.defs:
-                        self.logger.debug(
-                            "Resolved to attr %s of %s"
-                            % (ast_node.attr, sc.defs[attr_name])
-                        )
+                    value = sc.defs.get(attr_name, MISSING)
+                    if self.record_read(("def", sc, attr_name), value) is not MISSING:
+                        if self.log_debug:
+                            self.logger.debug(
+                                "Resolved to attr %s of %s"
+                                % (ast_node.attr, sc.defs[attr_name])
+                            )
                         return sc.defs[attr_name], ast_node.attr
 
             # It may happen that ast_node.value has no corresponding graph Node,
@@ -1068,9 +1511,10 @@ class CallGraphVisitor(ast.NodeVisitor):
             # In this case, return None for the object to let visit_Attribute()
             # add a wildcard reference to *.attr.
             #
-            self.logger.debug(
-                "Unresolved, returning attr %s of unknown" % (ast_node.attr)
-            )
+            if self.log_debug:
+                self.logger.debug(
+                    "Unresolved, returning attr %s of unknown" % (ast_node.attr)
+                )
             return None, ast_node.attr
         else:
             # detect str.join() and similar (attributes of constant literals)
@@ -1100,10 +1544,11 @@ class CallGraphVisitor(ast.NodeVisitor):
 
                 # can't resolve result of general function call
                 if not isinstance(obj_node, Node):
-                    self.logger.debug(
-                        "Unresolved function call as obj, returning attr %s of unknown"
-                        % (ast_node.attr)
-                    )
+                    if self.log_debug:
+                        self.logger.debug(
+                            "Unresolved function call as obj, returning attr %s of unknown"
+                            % (ast_node.attr)
+                        )
                     return None, ast_node.attr
             else:
                 # Get the Node object corresponding to node.value in the current ns.
@@ -1115,7 +1560,8 @@ class CallGraphVisitor(ast.NodeVisitor):
                     get_ast_node_name(ast_node.value)
                 )  # resolves "self" if needed
 
-        self.logger.debug("Resolved to attr %s of %s" % (ast_node.attr, obj_node))
+        if self.log_debug:
+            self.logger.debug("Resolved to attr %s of %s" % (ast_node.attr, obj_node))
         return obj_node, ast_node.attr
 
     ###########################################################################
@@ -1123,26 +1569,10 @@ class CallGraphVisitor(ast.NodeVisitor):
 
     def analyze_scopes(self, code, filename):
         """Gather lexical scope information."""
+        self.add_scopes(extract_scopes(code, filename, self.module_name))
 
-        # Below, ns is the fully qualified ("dotted") name of sc.
-        #
-        # Technically, the module scope is anonymous, but we treat it as if
-        # it was in a namespace named after the module, to support analysis
-        # of several files as a set (keeping their module-level definitions
-        # in different scopes, as we should).
-        #
-        scopes = {}
-
-        def process(parent_ns, table):
-            sc = Scope(table)
-            ns = "%s.%s" % (parent_ns, sc.name) if len(sc.name) else parent_ns
-            scopes[ns] = sc
-            for t in table.get_children():
-                process(ns, t)
-
-        process(
-            self.module_name, symtable.symtable(code, filename, compile_type="exec")
-        )
+    def add_scopes(self, scopes):
+        """Merge scope information (dict ns: Scope) of one module into self.scopes."""
 
         # add to existing scopes (while not overwriting any existing definitions with None)
         for ns in scopes:
@@ -1155,7 +1585,14 @@ class CallGraphVisitor(ast.NodeVisitor):
                     if name not in oldsc.defs:
                         oldsc.defs[name] = sc.defs[name]
 
-        self.logger.debug("Scopes now: %s" % (self.scopes))
+        if self.log_debug:
+            self.logger.debug("Scopes now: %s" % (self.scopes))
+
+    def add_module_import(self, mod_name):
+        """Record that the current module depends on the module mod_name."""
+        if self.module_name not in self.module_imports:
+            self.module_imports[self.module_name] = set()
+        self.module_imports[self.module_name].add(mod_name)
 
     def get_current_class(self):
         """Return the node representing the current class, or None if not inside a class definition."""
@@ -1189,29 +1626,33 @@ class CallGraphVisitor(ast.NodeVisitor):
         # get the innermost scope that has name **and where name has a value**
         def find_scope(name):
             for sc in reversed(self.scope_stack):
-                if name in sc.defs and sc.defs[name] is not None:
+                value = sc.defs.get(name, MISSING)
+                if self.record_read(("def", sc, name), value) not in (None, MISSING):
                     return sc
 
         sc = find_scope(name)
         if sc is not None:
             value = sc.defs[name]
             if isinstance(value, Node):
-                self.logger.info(
-                    "Get %s in %s, found in %s, value %s"
-                    % (name, self.scope_stack[-1], sc, value)
-                )
+                if self.log_info:
+                    self.logger.info(
+                        "Get %s in %s, found in %s, value %s"
+                        % (name, self.scope_stack[-1], sc, value)
+                    )
                 return value
             else:
                 # TODO: should always be a Node or None
+                if self.log_debug:
+                    self.logger.debug(
+                        "Get %s in %s, found in %s: value %s is not a Node"
+                        % (name, self.scope_stack[-1], sc, value)
+                    )
+        else:
+            if self.log_debug:
                 self.logger.debug(
-                    "Get %s in %s, found in %s: value %s is not a Node"
-                    % (name, self.scope_stack[-1], sc, value)
+                    "Get %s in %s: no Node value (or name not in scope)"
+                    % (name, self.scope_stack[-1])
                 )
-        else:
-            self.logger.debug(
-                "Get %s in %s: no Node value (or name not in scope)"
-                % (name, self.scope_stack[-1])
-            )
 
     def set_value(self, name, value):
         """Set the value of name in the current scope. Value must be a Node."""
@@ -1219,21 +1660,25 @@ class CallGraphVisitor(ast.NodeVisitor):
         # get the innermost scope that has name (should be the current scope unless name is a global)
         def find_scope(name):
             for sc in reversed(self.scope_stack):
-                if name in sc.defs:
+                if self.record_read(("has", sc, name), name in sc.defs):
                     return sc
 
         sc = find_scope(name)
         if sc is not None:
             if isinstance(value, Node):
                 sc.defs[name] = value
-                self.logger.info("Set %s in %s to %s" % (name, sc, value))
+                self.record_write(sc, name)
+                if self.log_info:
+                    self.logger.info("Set %s in %s to %s" % (name, sc, value))
             else:
                 # TODO: should always be a Node or None
-                self.logger.debug(
-                    "Set %s in %s: value %s is not a Node" % (name, sc, value)
-                )
+                if self.log_debug:
+                    self.logger.debug(
+                        "Set %s in %s: value %s is not a Node" % (name, sc, value)
+                    )
         else:
-            self.logger.debug("Set: name %s not in scope" % (name))
+            if self.log_debug:
+                self.logger.debug("Set: name %s not in scope" % (name))
 
     ###########################################################################
     # Attribute getter and setter
@@ -1277,10 +1722,12 @@ class CallGraphVisitor(ast.NodeVisitor):
 
             # look up attr_name in the given namespace, return Node or None
             def lookup(ns):
-                if ns in self.scopes:
+                if self.record_read(("scope", ns), ns in self.scopes):
                     sc = self.scopes[ns]
-                    if attr_name in sc.defs:
-                        return sc.defs[attr_name]
+                    value = sc.defs.get(attr_name, MISSING)
+                    self.record_read(("def", sc, attr_name), value)
+                    if value is not MISSING:
+                        return value
 
             # first try directly in object's ns (this works already in pass 1)
             value_node = lookup(ns)
@@ -1290,7 +1737,7 @@ class CallGraphVisitor(ast.NodeVisitor):
             # next try ns of each ancestor (this works only in pass 2,
             # after self.mro has been populated)
             #
-            if obj_node in self.mro:
+            if self.record_read(("mro", obj_node), self.mro.get(obj_node)) is not None:
                 for base_node in tail(
                     self.mro[obj_node]
                 ):  # the first element is always obj itself
@@ -1330,9 +1777,10 @@ class CallGraphVisitor(ast.NodeVisitor):
 
         if isinstance(obj_node, Node) and obj_node.namespace is not None:
             ns = obj_node.get_name()  # fully qualified namespace **of attr**
-            if ns in self.scopes:
+            if self.record_read(("scope", ns), ns in self.scopes):
                 sc = self.scopes[ns]
                 sc.defs[attr_name] = new_value
+                self.record_write(sc, attr_name)
                 return True
         return False
 
@@ -1364,12 +1812,11 @@ class CallGraphVisitor(ast.NodeVisitor):
         !!!
         """
 
-        if name in self.nodes:
-            for n in self.nodes[name]:
-                if n.namespace == namespace:
-                    if Flavor.specificity(flavor) > Flavor.specificity(n.flavor):
-                        n.flavor = flavor
-                    return n
+        n = self.nodes_by_key.get((namespace, name))
+        if n is not None:
+            if Flavor.specificity(flavor) > Flavor.specificity(n.flavor):
+                n.flavor = flavor
+            return n
 
         # Try to figure out which source file this Node belongs to
         # (for annotated output).
@@ -1390,6 +1837,9 @@ class CallGraphVisitor(ast.NodeVisitor):
             filename = self.filename
 
         n = Node(namespace, name, ast_node, filename, flavor)
+        self.nodes_by_key[(namespace, name)] = n
+        if self.costs is not None and self.cost_namespace is not None:
+            self.costs.add(self.filename, self.cost_namespace, "nodes")
 
         # Add to the list of nodes that have this short name.
         if name in self.nodes:
@@ -1401,11 +1851,21 @@ class CallGraphVisitor(ast.NodeVisitor):
 
     def get_parent_node(self, graph_node):
         """Get the parent node of the given Node. (Used in postprocessing.)"""
+        return self.get_node(*self.get_parent_key(graph_node), None)
+
+    def find_parent_node(self, graph_node):
+        """Like get_parent_node(), but return None if the parent does not exist,
+        instead of creating it."""
+        return self.nodes_by_key.get(self.get_parent_key(graph_node))
+
+    @staticmethod
+    def get_parent_key(graph_node):
+        """Return the (namespace, name) key of the parent of the given Node."""
         if "." in graph_node.namespace:
             ns, name = graph_node.namespace.rsplit(".", 1)
         else:
             ns, name = "", graph_node.namespace
-        return self.get_node(ns, name, None)
+        return ns, name
 
     def associate_node(self, graph_node, ast_node, filename=None):
         """Change the AST node (and optionally filename) mapping of a graph node.
@@ -1425,8 +1885,10 @@ class CallGraphVisitor(ast.NodeVisitor):
 
         This method re-associates the given graph Node with a different
         AST node, which allows updating the context when the definition
-        of a function or class is encountered."""
-        graph_node.ast_node = ast_node
+        of a function or class is encountered.
+
+        Only the source position of the AST node is kept (see Node)."""
+        graph_node.set_location(ast_node)
         if filename is not None:
             graph_node.filename = filename
 
@@ -1451,6 +1913,12 @@ class CallGraphVisitor(ast.NodeVisitor):
         if to_node in self.uses_edges[from_node]:
             return False
         self.uses_edges[from_node].add(to_node)
+        if self.costs is not None:
+            site = self.cost_site(from_node)
+            if site is not None:
+                self.costs.add(*site, "uses_edges")
+                if to_node.namespace is None:
+                    self.costs.add(*site, "wildcard_edges")
 
         # for pass 2: remove uses edge to any matching wildcard target node
         # if the given to_node has a known namespace.
@@ -1552,20 +2020,15 @@ class CallGraphVisitor(ast.NodeVisitor):
         if to_node == from_node:
             return
 
-        matching_wilds = [
-            n
-            for n in self.uses_edges[from_node]
-            if n.namespace is None and n.name == name
-        ]
-        assert (
-            len(matching_wilds) < 2
-        )  # the set can have only one wild of matching name
-        if len(matching_wilds):
-            wild_node = matching_wilds[0]
-            self.logger.info(
-                "Use from %s to %s resolves %s; removing wildcard"
-                % (from_node, to_node, wild_node)
-            )
+        # There is only one wildcard node *.name, so we can look it up directly
+        # instead of scanning all the uses edges of from_node.
+        wild_node = self.nodes_by_key.get((None, name))
+        if wild_node is not None and wild_node in self.uses_edges[from_node]:
+            if self.log_info:
+                self.logger.info(
+                    "Use from %s to %s resolves %s; removing wildcard"
+                    % (from_node, to_node, wild_node)
+                )
             self.remove_uses_edge(from_node, wild_node)
 
     ###########################################################################
@@ -1579,13 +2042,15 @@ class CallGraphVisitor(ast.NodeVisitor):
         for n in self.uses_edges:
             for n2 in self.uses_edges[n]:
                 if n2.namespace is not None and not n2.defined:
-                    n3 = self.get_node(None, n2.name, n2.ast_node)
+                    # (n2 carries the source position for a newly created n3)
+                    n3 = self.get_node(None, n2.name, n2)
                     n3.defined = False
                     new_uses_edges.append((n, n3))
                     removed_uses_edges.append((n, n2))
-                    self.logger.info(
-                        "Contracting non-existent from %s to %s as %s" % (n, n2, n3)
-                    )
+                    if self.log_info:
+                        self.logger.info(
+                            "Contracting non-existent from %s to %s as %s" % (n, n2, n3)
+                        )
 
         for from_node, to_node in new_uses_edges:
             self.add_uses_edge(from_node, to_node)
@@ -1598,65 +2063,107 @@ class CallGraphVisitor(ast.NodeVisitor):
 
         Also mark all unknown nodes as not defined (so that they won't be visualized)."""
 
+        # Possible expansions of each wildcard, computed once per name.
+        expansions = {}
+
+        def expand(name):
+            if name not in expansions:
+                expansions[name] = [
+                    n3 for n3 in self.nodes[name] if n3.namespace is not None
+                ]
+            return expansions[name]
+
         new_defines_edges = []
         for n in self.defines_edges:
             for n2 in self.defines_edges[n]:
                 if n2.namespace is None:
-                    for n3 in self.nodes[n2.name]:
-                        if n3.namespace is not None:
-                            new_defines_edges.append((n, n3))
+                    for n3 in expand(n2.name):
+                        new_defines_edges.append((n, n3))
 
         for from_node, to_node in new_defines_edges:
             self.add_defines_edge(from_node, to_node)
-            self.logger.info(
-                "Expanding unknowns: new defines edge from %s to %s"
-                % (from_node, to_node)
-            )
+            if self.log_info:
+                self.logger.info(
+                    "Expanding unknowns: new defines edge from %s to %s"
+                    % (from_node, to_node)
+                )
 
+        # Uses edges to nodes that are not defined would only be contracted
+        # back to the wildcard by contract_nonexistents(), so skip those.
         new_uses_edges = []
         for n in self.uses_edges:
             for n2 in self.uses_edges[n]:
                 if n2.namespace is None:
-                    for n3 in self.nodes[n2.name]:
-                        if n3.namespace is not None:
+                    for n3 in expand(n2.name):
+                        if n3.defined:
                             new_uses_edges.append((n, n3))
 
         for from_node, to_node in new_uses_edges:
-            self.add_uses_edge(from_node, to_node)
-            self.logger.info(
-                "Expanding unknowns: new uses edge from %s to %s" % (from_node, to_node)
-            )
+            if self.add_uses_edge(from_node, to_node) and self.costs is not None:
+                site = self.cost_site(from_node)
+                if site is not None:
+                    self.costs.add(*site, "expanded_edges")
+            if self.log_info:
+                self.logger.info(
+                    "Expanding unknowns: new uses edge from %s to %s"
+                    % (from_node, to_node)
+                )
 
         for name in self.nodes:
-            for n in self.nodes[name]:
-                if n.namespace is None:
-                    n.defined = False
+            n = self.nodes_by_key.get((None, name))
+            if n is not None:
+                n.defined = False
 
     def cull_inherited(self):
         """For each use edge from W to X.name, if it also has an edge to W to Y.name where Y is used by X, then remove the first edge."""
 
+        # Only targets of W sharing the same name can cull each other, so group
+        # the targets by name, and for each X.name check the parents of its
+        # siblings against the uses edges of X, going through the smaller set.
+        parents = {}  # memoization of find_parent_node()
+
+        def parent_of(node):
+            if node not in parents:
+                parents[node] = self.find_parent_node(node)
+            return parents[node]
+
         removed_uses_edges = []
         for n in self.uses_edges:
+            by_name = {}
             for n2 in self.uses_edges[n]:
-                inherited = False
-                for n3 in self.uses_edges[n]:
-                    if (
-                        n3.name == n2.name
-                        and n2.namespace is not None
-                        and n3.namespace is not None
-                        and n3.namespace != n2.namespace
-                    ):
-                        pn2 = self.get_parent_node(n2)
-                        pn3 = self.get_parent_node(n3)
-                        if (
-                            pn2 in self.uses_edges and pn3 in self.uses_edges[pn2]
-                        ):  # remove the first edge W to X.name
-                            #                        if pn3 in self.uses_edges and pn2 in self.uses_edges[pn3]:  # remove the second edge W to Y.name (TODO: add an option to choose this)
-                            inherited = True
-
-                if inherited and n in self.uses_edges:
-                    removed_uses_edges.append((n, n2))
-                    self.logger.info("Removing inherited edge from %s to %s" % (n, n2))
+                if n2.namespace is not None:
+                    if n2.name in by_name:
+                        by_name[n2.name].append(n2)
+                    else:
+                        by_name[n2.name] = [n2]
+
+            for group in by_name.values():
+                if len(group) < 2:
+                    continue
+                group_parents = {parent_of(n3) for n3 in group}
+                for n2 in group:
+                    pn2 = parent_of(n2)
+                    used_by_pn2 = self.uses_edges.get(pn2, ())
+                    # Distinct namespaces have distinct parents, so "pn3 is not
+                    # pn2" excludes n2 itself.
+                    if len(used_by_pn2) < len(group_parents):
+                        inherited = any(
+                            pn3 is not pn2 and pn3 in group_parents
+                            for pn3 in used_by_pn2
+                        )
+                    else:
+                        inherited = any(
+                            pn3 is not pn2 and pn3 in used_by_pn2
+                            for pn3 in group_parents
+                        )
+                    # remove the first edge W to X.name
+                    # (TODO: add an option to remove the second edge W to Y.name instead)
+                    if inherited:
+                        removed_uses_edges.append((n, n2))
+                        if self.log_info:
+                            self.logger.info(
+                                "Removing inherited edge from %s to %s" % (n, n2)
+                            )
 
         for from_node, to_node in removed_uses_edges:
             self.remove_uses_edge(from_node, to_node)
@@ -1680,8 +2187,10 @@ class CallGraphVisitor(ast.NodeVisitor):
                     pn = self.get_parent_node(n)
                     if n in self.uses_edges:
                         for n2 in self.uses_edges[n]:  # outgoing uses edges
-                            self.logger.info(
-                                "Collapsing inner from %s to %s, uses %s" % (n, pn, n2)
-                            )
+                            if self.log_info:
+                                self.logger.info(
+                                    "Collapsing inner from %s to %s, uses %s"
+                                    % (n, pn, n2)
+                                )
                             self.add_uses_edge(pn, n2)
                     n.defined = False
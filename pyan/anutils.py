@@ -4,6 +4,9 @@
 
 import os.path
 import ast
+import logging
+import symtable
+from collections import OrderedDict
 from .node import Flavor
 
 
@@ -19,23 +22,58 @@ def tail(lst):
         return []
 
 
-def get_module_name(filename):
-    """Try to determine the full module name of a source file, by figuring out
-    if its directory looks like a package (i.e. has an __init__.py file)."""
-
-    if os.path.basename(filename) == "__init__.py":
-        return get_module_name(os.path.dirname(filename))
-
-    init_path = os.path.join(os.path.dirname(filename), "__init__.py")
-    mod_name = os.path.basename(filename).replace(".py", "")
+class PackageIndex:
+    """Memoized knowledge of which directories are packages.
 
-    if not os.path.exists(init_path):
-        return mod_name
+    Determining the module name of a source file requires checking each of
+    its ancestor directories for an __init__.py. This caches the result per
+    directory, so that naming many files in the same tree costs at most one
+    stat call per directory. Directory listings that are already known
+    (e.g. from scanning a tree for source files) can be recorded with
+    set_package(), and then cost no stat calls at all.
+    """
 
-    if not os.path.dirname(filename):
-        return mod_name
+    def __init__(self):
+        self._is_package = {}  # directory: whether it contains __init__.py
+        self._names = {}  # directory: module name of the directory
+
+    def set_package(self, dirname, is_package):
+        """Record whether dirname contains an __init__.py."""
+        self._is_package[dirname] = is_package
+
+    def is_package(self, dirname):
+        """Return whether dirname contains an __init__.py."""
+        if dirname not in self._is_package:
+            init_path = os.path.join(dirname, "__init__.py")
+            self._is_package[dirname] = os.path.exists(init_path)
+        return self._is_package[dirname]
+
+    def _name_of(self, path):
+        """Module name of a file or directory, from its position in packages."""
+        parent = os.path.dirname(path)
+        mod_name = os.path.basename(path).replace(".py", "")
+        if not self.is_package(parent) or not parent:
+            return mod_name
+        if parent not in self._names:
+            self._names[parent] = self._name_of(parent)
+        return self._names[parent] + "." + mod_name
+
+    def module_name(self, filename):
+        """Try to determine the full module name of a source file, by figuring
+        out if its directory looks like a package (i.e. has an __init__.py file)."""
+        if os.path.basename(filename) == "__init__.py":
+            return self._name_of(os.path.dirname(filename))
+        return self._name_of(filename)
+
+
+def get_module_name(filename, packages=None):
+    """Try to determine the full module name of a source file, by figuring out
+    if its directory looks like a package (i.e. has an __init__.py file).
 
-    return get_module_name(os.path.dirname(filename)) + "." + mod_name
+    packages, if given, is a PackageIndex to memoize the lookups in."""
+    if packages is None:
+        packages = PackageIndex()
+    return packages.module_name(filename)
 
 
 def format_alias(x):
@@ -211,10 +249,160 @@ class Scope:
             iden: None for iden in table.get_identifiers()
         }  # name:assigned_value
 
+    @classmethod
+    def from_defs(cls, name, type, defs):
+        """Create a Scope directly from its parts, without a symbol table.
+
+        (Used when reloading analysis results from a cache.)"""
+        sc = cls.__new__(cls)
+        sc.name = name
+        sc.type = type
+        sc.defs = defs
+        return sc
+
     def __repr__(self):
         return "<Scope: %s %s>" % (self.type, self.name)
 
 
+def extract_scopes(code, filename, module_name):
+    """Gather lexical scope information for one module.
+
+    Return a dict mapping the fully qualified ("dotted") name of each
+    namespace to its Scope object.
+
+    Technically, the module scope is anonymous, but we treat it as if it was
+    in a namespace named after the module, to support analysis of several
+    files as a set (keeping their module-level definitions in different
+    scopes, as we should).
+    """
+    scopes = {}
+
+    def process(parent_ns, table):
+        sc = Scope(table)
+        ns = "%s.%s" % (parent_ns, sc.name) if len(sc.name) else parent_ns
+        scopes[ns] = sc
+        for t in table.get_children():
+            process(ns, t)
+
+    process(module_name, symtable.symtable(code, filename, compile_type="exec"))
+    return scopes
+
+
+class ParsedModule:
+    """Front-end result for one source file: its AST and lexical scopes."""
+
+    def __init__(self, filename, module_name, tree, scopes, size):
+        self.filename = filename
+        self.module_name = module_name
+        self.tree = tree  # ast.Module
+        self.scopes = scopes  # fully qualified name of namespace: Scope object
+        self.size = size  # length of the source text, used for memory accounting
+
+    def __repr__(self):
+        return "<ParsedModule %s (%s)>" % (self.module_name, self.filename)
+
+
+def read_source(filename):
+    with open(filename, "rt", encoding="utf-8") as f:
+        return f.read()
+
+
+def scan_module(filename, module_name):
+    """Read the specified Python source file and extract its scopes.
+
+    Return (content, scopes)."""
+    content = read_source(filename)
+    return content, extract_scopes(content, filename, module_name)
+
+
+def parse_module(filename, module_name, scanned=None):
+    """Read, parse and extract the scopes of the specified Python source file.
+
+    scanned: (content, scopes) as from scan_module(), if already available.
+
+    Return a ParsedModule."""
+    if scanned is None:
+        scanned = scan_module(filename, module_name)
+    content, scopes = scanned
+    tree = ast.parse(content, filename)
+    return ParsedModule(filename, module_name, tree, scopes, len(content))
+
+
+class ModuleStore:
+    """Keep the ASTs of parsed modules, so that each file needs to be read and
+    parsed only once, even though the analyzer visits it several times.
+
+    max_size, if given, caps the total size (in characters of source text,
+    which is roughly proportional to AST size) of the modules kept in memory.
+    When the cap is exceeded, the least recently used modules are evicted,
+    and re-parsed from disk (or from sources, {filename: source text}, if
+    given there) if they are needed again.
+    """
+
+    def __init__(self, max_size=None, logger=None, sources=None):
+        self.max_size = max_size
+        self.sources = sources or {}
+        self.logger = logger or logging.getLogger(__name__)
+        self._modules = OrderedDict()  # filename: ParsedModule, in LRU order
+        self._seen = set()  # filenames added at any point, including evicted ones
+        self.size = 0
+
+    def __contains__(self, filename):
+        """Return whether filename has already been parsed (even if evicted since)."""
+        return filename in self._seen
+
+    def add(self, module):
+        """Add a ParsedModule, evicting older modules if over the size cap."""
+        self.discard(module.filename)
+        self._modules[module.filename] = module
+        self._seen.add(module.filename)
+        self.size += module.size
+        self._evict()
+
+    def discard(self, filename):
+        """Forget the AST of filename, if it is kept."""
+        module = self._modules.pop(filename, None)
+        if module is not None:
+            self.size -= module.size
+
+    def get_tree(self, filename):
+        """Return the AST of an already parsed file, re-parsing it if it has been evicted."""
+        module = self._modules.get(filename)
+        if module is not None:
+            self._modules.move_to_end(filename)
+            return module.tree
+
+        self.logger.info("Re-parsing evicted module '%s'" % (filename))
+        content = self.sources.get(filename)
+        if content is None:
+            content = read_source(filename)
+        tree = ast.parse(content, filename)
+        if self.max_size is None or len(content) <= self.max_size:
+            self._modules[filename] = ParsedModule(
+                filename, None, tree, None, len(content)
+            )
+            self.size += len(content)
+            self._evict(keep=filename)
+        return tree
+
+    def clear(self):
+        """Release all kept ASTs."""
+        self._modules.clear()
+        self._seen.clear()
+        self.size = 0
+
+    def _evict(self, keep=None):
+        if self.max_size is None:
+            return
+        while self.size > self.max_size and len(self._modules):
+            filename, module = next(iter(self._modules.items()))
+            if filename == keep:
+                break
+            del self._modules[filename]
+            self.size -= module.size
+            self.logger.debug("Evicting parsed module '%s'" % (filename))
+
+
 # A context manager, sort of a friend of CallGraphVisitor (depends on implementation details)
 class ExecuteInInnerScope:
     """Execute a code block with the scope stack augmented with an inner scope.
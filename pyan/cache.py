@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Persistent, content-addressed cache of per-module analysis results.
+
+For each analyzed module, the cache stores what the module contributed to the
+analysis after pass 2 (i.e. before postprocessing): its scopes, the nodes it
+created or refers to, its defines and uses edges (including the uses edges to
+wildcards *.name, i.e. its unresolved references), and the base class
+expressions of its classes (as source text).
+
+Entries and state files are plain JSON, so loading them never runs code, and
+they do not depend on the AST classes of the Python version that wrote them.
+
+An entry is keyed by the content hash of the source file, its module name, its
+path relative to the root of its package tree (see source_path()) and the pyan
+version, and it also records the content hashes of the modules it imported.
+No absolute paths go into the keys, so a cache or state made in one checkout
+of a repository is valid in another. An entry is reused only if neither the module itself, nor any of
+the modules it (transitively) imports, has changed. Postprocessing is always
+run on the combined result, since it is global.
+
+The analysis state of a whole run (e.g. of one revision of a repository) can
+also be saved into a single file with save_state(), and loaded back into a
+cache with load_state(). Together with the list of files changed since then,
+the next run then hashes and analyzes only the changed files and their
+importers, and reloads everything else.
+"""
+
+from collections import namedtuple
+import ast
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+from .node import Flavor
+from .anutils import Scope
+
+# Bump this when the layout of ModuleRecord changes.
+CACHE_FORMAT = 3
+# Bump this when the layout of the state files of save_state() changes.
+STATE_FORMAT = 3
+
+_pyan_version = None
+
+# Stand-in for an AST node, carrying only its source position, for
+# Node.set_location().
+Location = namedtuple("Location", ["lineno", "col_offset"])
+
+
+def get_pyan_version():
+    """Return the version of pyan, for invalidating cache entries.
+
+    If pyan is not installed (e.g. running from a source checkout), use
+    a hash of the sources of the analyzer instead."""
+    global _pyan_version
+    if _pyan_version is None:
+        try:
+            from importlib.metadata import version
+
+            _pyan_version = version("pyan")
+        except Exception:
+            h = hashlib.sha256()
+            here = os.path.dirname(os.path.abspath(__file__))
+            for name in ("analyzer.py", "anutils.py", "node.py", "cache.py"):
+                with open(os.path.join(here, name), "rb") as f:
+                    h.update(f.read())
+            _pyan_version = "dev-" + h.hexdigest()[:16]
+    return _pyan_version
+
+
+def file_digest(filename):
+    """Return the SHA-256 hex digest of the contents of filename."""
+    with open(filename, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def source_path(filename, module_name):
+    """Return the path of the source file filename, whose module name is
+    module_name, relative to the root of its package tree (the directory
+    holding its top-level package), e.g. "pkg/sub/mod.py". It does not
+    depend on where the tree is checked out."""
+    parts = module_name.split(".")
+    basename = os.path.basename(filename)
+    if basename != "__init__.py":
+        parts = parts[:-1]
+    return "/".join(parts + [basename])
+
+
+def text_digest(text):
+    """Return the digest of source text that is not (yet) in a file."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ModuleRecord:
+    """Analysis results contributed by one module.
+
+    Nodes are stored as tuples (namespace, name, flavor, owned, lineno,
+    col_offset), where owned tells whether the node is inside the namespace
+    of the module (and so located in its file), and the position is given
+    only for those nodes. Edges, scope
+    definitions and class bases refer to nodes by index into this list.
+    """
+
+    def __init__(self, filename, module_name, digest, deps):
+        self.filename = filename
+        self.module_name = module_name
+        self.digest = digest  # content hash of the source file
+        self.deps = deps  # imported module name: its digest (None if not analyzed)
+        self.nodes = []
+        self.scopes = {}  # ns: (scope name, scope type, {name: node index or None})
+        self.defines_edges = []  # (from index, to index)
+        self.uses_edges = []  # (from index, to index)
+        self.class_bases = []  # (class node index, [source text of bases, or None])
+
+    def __repr__(self):
+        return "<ModuleRecord %s (%s)>" % (self.module_name, self.filename)
+
+    def to_data(self):
+        """Return the record as plain data, for JSON."""
+        return {
+            "filename": self.filename,
+            "module_name": self.module_name,
+            "digest": self.digest,
+            "deps": self.deps,
+            "nodes": self.nodes,
+            "scopes": self.scopes,
+            "defines_edges": self.defines_edges,
+            "uses_edges": self.uses_edges,
+            "class_bases": self.class_bases,
+        }
+
+    @classmethod
+    def from_data(cls, data):
+        """Return the record described by data, from to_data(). Raise
+        KeyError, TypeError or ValueError if data is not such a record."""
+        record = cls(data["filename"], data["module_name"], data["digest"], data["deps"])
+        record.nodes = [tuple(item) for item in data["nodes"]]
+        record.scopes = {
+            ns: (name, type, defs) for ns, (name, type, defs) in data["scopes"].items()
+        }
+        record.defines_edges = [tuple(edge) for edge in data["defines_edges"]]
+        record.uses_edges = [tuple(edge) for edge in data["uses_edges"]]
+        record.class_bases = [(i, list(bases)) for i, bases in data["class_bases"]]
+        return record
+
+
+def make_records(visitor, filenames):
+    """Capture the contributions of the given files from a CallGraphVisitor.
+
+    Must be called after pass 2, before postprocessing. Return a list of
+    ModuleRecords, one for each file.
+    """
+    module_names = set(visitor.filename_to_module.values())
+    owners = {}  # memoization
+
+    def owner_of(fullname):
+        """Return the analyzed module that fullname lives in, or None."""
+        if fullname not in owners:
+            name = fullname
+            while name and name not in module_names:
+                name = name.rpartition(".")[0]
+            owners[fullname] = name or None
+        return owners[fullname]
+
+    def owner_of_node(node):
+        if node.namespace is None:
+            return None
+        return owner_of(node.get_name())
+
+    records = {}
+    for filename in filenames:
+        module_name = visitor.filename_to_module[filename]
+        deps = {
+            name: visitor.module_digests.get(name)
+            for name in sorted(visitor.module_imports.get(module_name, ()))
+        }
+        digest = visitor.module_digests[module_name]
+        records[module_name] = ModuleRecord(filename, module_name, digest, deps)
+    indices = {module_name: {} for module_name in records}
+
+    def index(record, node):
+        index_of = indices[record.module_name]
+        if node not in index_of:
+            index_of[node] = len(record.nodes)
+            item = (node.namespace, node.name, node.flavor.value)
+            if owner_of_node(node) == record.module_name:
+                record.nodes.append(item + (True, node.lineno, node.col_offset))
+            else:
+                record.nodes.append(item + (False, None, None))
+        return index_of[node]
+
+    for ns, sc in visitor.scopes.items():
+        record = records.get(owner_of(ns))
+        if record is not None:
+            defs = {
+                name: (index(record, value) if value is not None else None)
+                for name, value in sc.defs.items()
+            }
+            record.scopes[ns] = (sc.name, sc.type, defs)
+
+    for edges, attr in (
+        (visitor.defines_edges, "defines_edges"),
+        (visitor.uses_edges, "uses_edges"),
+    ):
+        for from_node, to_nodes in edges.items():
+            record = records.get(owner_of_node(from_node))
+            if record is not None:
+                out = getattr(record, attr)
+                i = index(record, from_node)
+                for to_node in to_nodes:
+                    out.append((i, index(record, to_node)))
+
+    for class_node, bases in visitor.class_base_ast_nodes.items():
+        record = records.get(owner_of_node(class_node))
+        if record is not None:
+            # resolve_base_classes() understands only names and attributes
+            bases = [
+                ast.unparse(b) if isinstance(b, (ast.Name, ast.Attribute)) else None
+                for b in bases
+            ]
+            record.class_bases.append((index(record, class_node), bases))
+
+    return list(records.values())
+
+
+def restore_record(visitor, record, filename):
+    """Replay a ModuleRecord into a CallGraphVisitor, for the module now in
+    the file filename (the record may come from another checkout)."""
+    visitor.filename = filename
+    visitor.module_name = record.module_name
+
+    nodes = []
+    for namespace, name, flavor, owned, lineno, col_offset in record.nodes:
+        node = visitor.get_node(namespace, name, None, flavor=Flavor(flavor))
+        if owned:
+            node.filename = filename
+            node.set_location(Location(lineno, col_offset))
+        nodes.append(node)
+
+    scopes = {}
+    for ns, (name, type, defs) in record.scopes.items():
+        defs = {k: (nodes[v] if v is not None else None) for k, v in defs.items()}
+        scopes[ns] = Scope.from_defs(name, type, defs)
+    visitor.add_scopes(scopes)
+
+    for i, j in record.defines_edges:
+        visitor.add_defines_edge(nodes[i], nodes[j])
+
+    # Insert uses edges directly; add_uses_edge() would try to resolve
+    # wildcards again, but the record already holds the final edge set.
+    for i, j in record.uses_edges:
+        visitor.uses_edges.setdefault(nodes[i], set()).add(nodes[j])
+
+    for i, bases in record.class_bases:
+        visitor.class_base_ast_nodes[nodes[i]] = [
+            ast.parse(text, mode="eval").body if text is not None else ast.Constant(None)
+            for text in bases
+        ]
+
+    visitor.module_imports[record.module_name] = set(record.deps)
+
+    visitor.module_name = None
+    visitor.filename = None
+
+
+class AnalysisCache:
+    """Store of ModuleRecords.
+
+    If cache_dir is given, records are saved as JSON files in that
+    directory, and persist across runs. Otherwise they are kept in memory only, which is
+    useful for long-running processes that re-analyze the same set of files.
+    """
+
+    def __init__(self, cache_dir=None, logger=None):
+        self.cache_dir = cache_dir
+        self.logger = logger or logging.getLogger(__name__)
+        self._memory = {}  # key: ModuleRecord
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _key(self, module_name, filename, digest):
+        text = "%s\0%d\0%s\0%s\0%s" % (
+            get_pyan_version(),
+            CACHE_FORMAT,
+            module_name,
+            source_path(filename, module_name),
+            digest,
+        )
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def load(self, filename, module_name, digest):
+        """Return the ModuleRecord for this version of the file, or None."""
+        key = self._key(module_name, filename, digest)
+        if key in self._memory:
+            return self._memory[key]
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._path(key), "rt", encoding="utf-8") as f:
+                record = ModuleRecord.from_data(json.load(f))
+        except FileNotFoundError:
+            return None
+        except Exception as e:  # corrupted or incompatible entry
+            self.logger.warning(
+                "Ignoring unreadable cache entry for %s: %s" % (filename, e)
+            )
+            return None
+        self._memory[key] = record
+        return record
+
+    def add(self, record):
+        """Keep a ModuleRecord in memory only (e.g. one from load_state())."""
+        key = self._key(record.module_name, record.filename, record.digest)
+        self._memory[key] = record
+
+    def store(self, record):
+        """Save a ModuleRecord."""
+        key = self._key(record.module_name, record.filename, record.digest)
+        self._memory[key] = record
+        if self.cache_dir is None:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write atomically, so that concurrent runs never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wt", encoding="utf-8") as f:
+                json.dump(record.to_data(), f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+def save_state(visitor, filename):
+    """Write the analysis state of a CallGraphVisitor, which must have been
+    run with a cache, to filename: the content digest of each analyzed file,
+    by its source_path(), and the ModuleRecords of the analyzed modules."""
+    digests = {}
+    records = []
+    for source in visitor.filenames:
+        module_name = visitor.filename_to_module[source]
+        digest = visitor.module_digests[module_name]
+        digests[source_path(source, module_name)] = digest
+        record = visitor.cache.load(source, module_name, digest)
+        if record is not None:  # (None if several files share the module name)
+            records.append(record)
+    state = {
+        "format": STATE_FORMAT,
+        "version": get_pyan_version(),
+        "digests": digests,
+        "records": [record.to_data() for record in records],
+    }
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wt", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, filename)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_state(filename, cache, logger=None):
+    """Read an analysis state written by save_state() into the AnalysisCache
+    cache (in memory only). Return the content digests of the files, as
+    {source_path(): digest}.
+
+    A state written by another version of pyan is ignored (with a warning),
+    and then {} is returned. Raise OSError if filename cannot be read."""
+    logger = logger or logging.getLogger(__name__)
+    with open(filename, "rt", encoding="utf-8") as f:
+        try:
+            state = json.load(f)
+        except ValueError as e:
+            logger.warning("Ignoring unreadable analysis state %s: %s" % (filename, e))
+            return {}
+    if (
+        not isinstance(state, dict)
+        or state.get("format") != STATE_FORMAT
+        or state.get("version") != get_pyan_version()
+    ):
+        logger.warning(
+            "Ignoring analysis state %s, written by another version of pyan" % filename
+        )
+        return {}
+    try:
+        records = [ModuleRecord.from_data(data) for data in state["records"]]
+    except (KeyError, TypeError, ValueError) as e:
+        logger.warning("Ignoring unreadable analysis state %s: %s" % (filename, e))
+        return {}
+    for record in records:
+        cache.add(record)
+    return state["digests"]
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Attribution of analysis cost to source files and top-level namespaces.
+
+A CostTracker, when given to CallGraphVisitor, collects for each source file
+and each top-level namespace (module-level class or function, or the module
+body itself) of that file:
+
+  parse_s         time spent reading, symtable-analyzing and parsing the file
+                  (attributed to the module itself)
+  visit_s         time spent visiting the definition, summed over all passes
+  nodes           graph nodes created while visiting it
+  uses_edges      uses edges added from it (including by expand_unknowns())
+  wildcard_edges  of those, uses edges to unresolved names *.name
+  expanded_edges  uses edges added from it by expand_unknowns(), i.e. the
+                  fan-out of its unresolved names
+
+Files reloaded from an analysis cache are not visited, and cost nothing.
+"""
+
+from collections import Counter
+import csv
+import io
+import json
+
+FIELDS = (
+    "parse_s",
+    "visit_s",
+    "nodes",
+    "uses_edges",
+    "wildcard_edges",
+    "expanded_edges",
+)
+COLUMNS = ("file", "namespace") + FIELDS
+
+
+class CostTracker:
+    """Counters of analysis cost, keyed by (filename, top-level namespace)."""
+
+    def __init__(self):
+        self.costs = {}  # (filename, namespace): Counter of FIELDS
+
+    def add(self, filename, namespace, field, amount=1):
+        """Add amount to the counter field of namespace in filename."""
+        key = (filename, namespace)
+        if key not in self.costs:
+            self.costs[key] = Counter()
+        self.costs[key][field] += amount
+
+    def rows(self, by="namespace", sort_by="visit_s"):
+        """Return the costs as a list of dicts with the keys COLUMNS.
+
+        by: "namespace" for one row per top-level namespace, or "file" for
+        one row per file (then the namespace is the module).
+        sort_by: a column name; rows are sorted by it in descending order
+        (ascending for the text columns file and namespace)."""
+        if by not in ("namespace", "file"):
+            raise ValueError("by must be 'namespace' or 'file', got %r" % (by,))
+        if sort_by not in COLUMNS:
+            raise ValueError(
+                "Unknown cost column %r; expected one of %s"
+                % (sort_by, ", ".join(COLUMNS))
+            )
+        totals = {}  # (filename, namespace): Counter
+        modules = {}  # filename: module name (the shortest namespace seen)
+        for (filename, namespace), counts in self.costs.items():
+            if filename not in modules or len(namespace) < len(modules[filename]):
+                modules[filename] = namespace
+            key = (filename, None if by == "file" else namespace)
+            if key not in totals:
+                totals[key] = Counter()
+            totals[key].update(counts)
+        result = []
+        for (filename, namespace), counts in totals.items():
+            row = {"file": filename, "namespace": namespace or modules[filename]}
+            for field in FIELDS:
+                value = counts[field]
+                row[field] = round(value, 6) if field.endswith("_s") else value
+            result.append(row)
+        text_column = sort_by in ("file", "namespace")
+        result.sort(key=lambda row: row[sort_by] or 0, reverse=not text_column)
+        return result
+
+    def format(self, fmt="text", by="namespace", sort_by="visit_s"):
+        """Return the report as a string in format fmt (text, json or csv)."""
+        rows = self.rows(by, sort_by)
+        if fmt == "json":
+            return json.dumps(rows, indent=1)
+        elif fmt == "csv":
+            out = io.StringIO()
+            writer = csv.DictWriter(out, fieldnames=COLUMNS, lineterminator="\n")
+            writer.writeheader()
+            writer.writerows(rows)
+            return out.getvalue()
+        elif fmt == "text":
+            label = "file" if by == "file" else "namespace"
+            header = "%-40s %9s %9s %7s %7s %7s %7s" % (
+                label,
+                "parse [s]",
+                "visit [s]",
+                "nodes",
+                "uses",
+                "wild",
+                "expand",
+            )
+            lines = [header, "-" * len(header)]
+            for row in rows:
+                name = row["file"] if by == "file" else row["namespace"]
+                if len(name) > 40:
+                    name = "..." + name[-37:]
+                lines.append(
+                    "%-40s %9.3f %9.3f %7d %7d %7d %7d"
+                    % (
+                        name,
+                        row["parse_s"],
+                        row["visit_s"],
+                        row["nodes"],
+                        row["uses_edges"],
+                        row["wildcard_edges"],
+                        row["expanded_edges"],
+                    )
+                )
+            return "\n".join(lines) + "\n"
+        else:
+            raise ValueError("Unknown cost report format %r" % (fmt,))
+
+    def write(self, filename, by="namespace", sort_by="visit_s"):
+        """Write the report to filename. The format is chosen by the
+        extension: .json, .csv, or text for anything else."""
+        if filename.endswith(".json"):
+            fmt = "json"
+        elif filename.endswith(".csv"):
+            fmt = "csv"
+        else:
+            fmt = "text"
+        with open(filename, "wt", encoding="utf-8") as f:
+            f.write(self.format(fmt, by, sort_by))
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Discovery of the source files to analyze.
+
+The command line accepts, in any mix:
+
+  - source files,
+  - glob patterns (expanded like before),
+  - directories, which are searched recursively,
+  - names of importable packages or modules (e.g. "json", "email.mime"),
+    which are located on sys.path without importing anything.
+
+Directories are searched with a single os.scandir() walk, which also records
+which of them are packages in a PackageIndex, so that naming the modules
+afterwards needs no further stat calls inside the searched trees.
+"""
+
+from fnmatch import fnmatch
+from glob import glob
+import logging
+import os
+import re
+import sys
+
+from .anutils import PackageIndex
+
+DEFAULT_INCLUDE = ("*.py",)
+
+_dotted_name = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$")
+
+
+def _matches(name, relpath, patterns):
+    """Return whether the basename or the relative path matches any pattern."""
+    for pattern in patterns:
+        if fnmatch(name, pattern) or fnmatch(relpath, pattern):
+            return True
+    return False
+
+
+def find_package(name, path=None):
+    """Locate an importable package or module by dotted name, on path
+    (default sys.path). Return the directory of the package, or the filename
+    of the module, or None if not found. Nothing is imported."""
+    parts = name.split(".")
+    for entry in sys.path if path is None else path:
+        base = os.path.join(entry or os.curdir, *parts)
+        if os.path.isdir(base):
+            return base
+        if os.path.isfile(base + ".py"):
+            return base + ".py"
+    return None
+
+
+class SourceFinder:
+    """Collect source files from command line style arguments.
+
+    include, exclude: lists of fnmatch patterns. In directories, a file is
+    collected if it matches an include pattern and no exclude pattern, and
+    subdirectories matching an exclude pattern are not entered. A pattern
+    matches if it matches either the name, or the path relative to the
+    directory given as the argument. Files named explicitly are always
+    collected.
+
+    packages: PackageIndex in which to record the package directories seen.
+    """
+
+    def __init__(self, include=None, exclude=None, packages=None, logger=None):
+        self.include = list(include or DEFAULT_INCLUDE)
+        self.exclude = list(exclude or ())
+        self.packages = packages if packages is not None else PackageIndex()
+        self.logger = logger or logging.getLogger(__name__)
+        self.filenames = []
+        self._seen = set()
+
+    def _add(self, filename):
+        if filename not in self._seen:
+            self._seen.add(filename)
+            self.filenames.append(filename)
+
+    def _walk(self, dirname, reldir=""):
+        """Collect the files under dirname, in sorted order. reldir is the
+        path of dirname relative to the directory given as the argument."""
+        try:
+            with os.scandir(dirname) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as e:
+            self.logger.warning("Cannot read directory %s: %s" % (dirname, e))
+            return
+        self.packages.set_package(
+            dirname, any(entry.name == "__init__.py" for entry in entries)
+        )
+        subdirs = []
+        for entry in entries:
+            relpath = os.path.join(reldir, entry.name)
+            if _matches(entry.name, relpath, self.exclude):
+                continue
+            # Symlinked directories are not followed, to avoid cycles.
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append((entry.path, relpath))
+            elif entry.is_file() and _matches(entry.name, relpath, self.include):
+                self._add(entry.path)
+        for subdir, relpath in subdirs:
+            self._walk(subdir, relpath)
+
+    def add(self, arg):
+        """Collect the files given by one argument. Return the number of
+        files found for it."""
+        count = len(self.filenames)
+        if os.path.isdir(arg):
+            self._walk(arg.rstrip(os.sep) or os.sep)
+        elif os.path.isfile(arg):
+            self._add(arg)
+        elif any(c in arg for c in "*?["):
+            for path in glob(arg):
+                if os.path.isdir(path):
+                    self._walk(path)
+                else:
+                    self._add(path)
+        elif _dotted_name.match(arg):
+            path = find_package(arg)
+            if path is None:
+                self.logger.warning("No file, directory or package named %s" % arg)
+            elif os.path.isdir(path):
+                self._walk(path)
+            else:
+                self._add(path)
+        else:
+            self.logger.warning("No file or directory named %s" % arg)
+        return len(self.filenames) - count
+
+
+def find_source_files(args, include=None, exclude=None, packages=None, logger=None):
+    """Return the list of source files given by args (see SourceFinder),
+    without duplicates, in the order found."""
+    finder = SourceFinder(include, exclude, packages, logger)
+    for arg in args:
+        finder.add(arg)
+    return finder.filenames
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Compact storage for the edges of a finished analysis.
+
+During the analysis, CallGraphVisitor keeps its defines and uses edges as
+dicts of sets of Node objects, which are easy to update but cost hundreds
+of bytes per edge. Once the analysis is complete, CallGraphVisitor.freeze()
+gives each node a dense integer ID, and converts the edges into compressed
+sparse row (CSR) adjacency arrays: the targets of node i are the IDs
+indices[indptr[i]:indptr[i + 1]].
+
+The converted edges still look like a (read-only) dict of sets, so existing
+code can keep using them as before; code that cares about speed can iterate
+over the integer IDs directly.
+"""
+
+from array import array
+from collections.abc import Mapping
+
+
+def sort_key(node):
+    """Sort key that orders nodes by namespace and name (unknown nodes last)."""
+    return (
+        node.namespace is None,
+        node.namespace or "",
+        node.name is None,
+        node.name or "",
+    )
+
+
+def number_nodes(nodes):
+    """Give dense integer IDs to the given Nodes, in a deterministic order.
+
+    Return (node_list, ids), where node_list[i] is the Node with ID i,
+    and ids maps each Node to its ID."""
+    node_list = sorted(nodes, key=sort_key)
+    ids = {node: i for i, node in enumerate(node_list)}
+    return node_list, ids
+
+
+class CSRAdjacency(Mapping):
+    """Read-only adjacency of a set of edges, in compressed sparse row format.
+
+    As a Mapping, this behaves like the dict of sets it was built from:
+    the keys are the Nodes that have outgoing edges, and the value for each
+    key is the (frozen) set of target Nodes.
+
+    Targets are stored in ascending order of ID, so iteration order is
+    deterministic.
+    """
+
+    def __init__(self, node_list, ids, edges):
+        """node_list, ids: from number_nodes(); must include all nodes in edges.
+        edges: dict from Node to set of Nodes."""
+        self.node_list = node_list
+        self.ids = ids
+        self.indptr = array("Q", [0])
+        self.indices = array("I")
+        num_sources = 0
+        for node in node_list:
+            targets = edges.get(node)
+            if targets:
+                self.indices.extend(sorted(ids[t] for t in targets))
+                num_sources += 1
+            self.indptr.append(len(self.indices))
+        self._num_sources = num_sources
+
+    def targets_of(self, i):
+        """Return the array of IDs of the targets of the node with ID i."""
+        return self.indices[self.indptr[i] : self.indptr[i + 1]]
+
+    def degree(self, i):
+        """Return the number of outgoing edges of the node with ID i."""
+        return self.indptr[i + 1] - self.indptr[i]
+
+    def id_pairs(self):
+        """Iterate over all edges, as (source ID, target ID) pairs."""
+        indptr = self.indptr
+        indices = self.indices
+        for i in range(len(self.node_list)):
+            for k in range(indptr[i], indptr[i + 1]):
+                yield i, indices[k]
+
+    def num_edges(self):
+        """Return the total number of edges."""
+        return len(self.indices)
+
+    def __getitem__(self, node):
+        i = self.ids.get(node)
+        if i is None or not self.degree(i):
+            raise KeyError(node)
+        node_list = self.node_list
+        return frozenset(node_list[j] for j in self.targets_of(i))
+
+    def __contains__(self, node):
+        i = self.ids.get(node)
+        return i is not None and self.degree(i) > 0
+
+    def __iter__(self):
+        indptr = self.indptr
+        for i, node in enumerate(self.node_list):
+            if indptr[i] < indptr[i + 1]:
+                yield node
+
+    def __len__(self):
+        return self._num_sources
+
+    def __repr__(self):
+        return "<CSRAdjacency: %d nodes, %d edges>" % (
+            len(self.node_list),
+            self.num_edges(),
+        )
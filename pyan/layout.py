@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Choice of the Graphviz layout engine and options by graph size.
+
+dot gives the most readable layouts of call graphs, but its running time
+grows superlinearly with the size of the graph (crossing minimization and
+spline routing dominate). Larger graphs are therefore laid out by dot with
+its iteration limits lowered and straight edges, then by neato (stress
+majorization, with a capped number of iterations), and the largest ones by
+sfdp (multiscale force-directed), which scales to hundreds of thousands of
+nodes.
+"""
+
+ENGINES = ("auto", "dot", "neato", "sfdp")
+
+# (max nodes, max edges, engine, options), from the smallest graphs up;
+# a graph uses the first tier it fits in.
+TIERS = (
+    (1000, 3000, "dot", ["-Granksep=1.5"]),
+    (
+        3000,
+        10000,
+        "dot",
+        [
+            "-Granksep=1.5",
+            "-Gnslimit=2",
+            "-Gnslimit1=2",
+            "-Gmclimit=0.5",
+            "-Gsplines=line",
+        ],
+    ),
+    (
+        8000,
+        30000,
+        "neato",
+        ["-Gmode=major", "-Gmaxiter=200", "-Goverlap=scale", "-Gsplines=false"],
+    ),
+    (
+        None,
+        None,
+        "sfdp",
+        ["-Goverlap=prism", "-Gsplines=false", "-Goutputorder=edgesfirst"],
+    ),
+)
+
+
+class LayoutStrategy:
+    """A Graphviz layout engine with its command line options, and the
+    reason it was chosen."""
+
+    def __init__(self, engine, options, reason=""):
+        self.engine = engine
+        self.options = list(options)
+        self.reason = reason
+
+    def command(self):
+        """Return the start of the dot command line, before the output
+        options. (The other engines are selected with -K, so that only dot
+        needs to be on the path.)"""
+        return ["dot", "-K" + self.engine, *self.options]
+
+    def __repr__(self):
+        return "<LayoutStrategy %s>" % " ".join([self.engine] + self.options)
+
+
+def _fits(tier, num_nodes, num_edges):
+    max_nodes, max_edges = tier[0], tier[1]
+    if max_nodes is None or num_nodes is None:
+        return True
+    return num_nodes <= max_nodes and num_edges <= max_edges
+
+
+def choose_strategy(num_nodes, num_edges, engine="auto"):
+    """Return the LayoutStrategy for a graph of the given size.
+
+    engine: "auto" to choose the engine by size, or the name of an engine
+    to use it with the options of its tier that fits the size best. If the
+    size is unknown (None), the options for the smallest graphs are used."""
+    if engine not in ENGINES:
+        raise ValueError(
+            "Unknown layout engine %r; expected one of %s"
+            % (engine, ", ".join(ENGINES))
+        )
+    tiers = [tier for tier in TIERS if engine in ("auto", tier[2])]
+    for tier in tiers:
+        if _fits(tier, num_nodes, num_edges):
+            break
+    else:
+        tier = tiers[-1]  # the largest tier of the requested engine
+    if num_nodes is None:
+        size = "graph of unknown size"
+    else:
+        size = "%d nodes, %d edges" % (num_nodes, num_edges)
+    if engine == "auto":
+        reason = "chosen for %s" % size
+    else:
+        reason = "requested, options for %s" % size
+    return LayoutStrategy(tier[2], tier[3], reason)
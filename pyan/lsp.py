@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Minimal language server providing call hierarchy from pyan's analysis.
+
+    pyan lsp [FILES...]
+
+speaks the Language Server Protocol on stdin and stdout, and answers
+
+  textDocument/prepareCallHierarchy
+  callHierarchy/incomingCalls
+  callHierarchy/outgoingCalls
+
+from the uses edges of the analysis (see query.CallGraph). Without FILES,
+the workspace root given by the editor is analyzed.
+
+The analysis is kept warm in an AnalysisSession. didOpen and didChange
+(full document sync) replace the contents of the file by the editor buffer,
+and didClose drops it. The analysis is brought up to date lazily, before
+answering a query, so a burst of edits costs one re-analysis, of the edited
+files and their importers only. The file system is searched again for new
+files at most every --rescan-interval seconds.
+
+The server measures the latency of each request. Requests slower than
+--latency-target milliseconds are logged, and the custom request
+pyan/stats returns the number of requests, the median, 95th percentile
+and maximum latency per method, and the last analysis time.
+
+Definitions are located by the line and column of their def or class
+statement, which pyan keeps for each node. pyan does not record where in
+a function a call happens, so the fromRanges of a call are the name of the
+calling (or, for outgoing calls, the called) definition.
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import time
+from urllib.parse import unquote, urlparse
+from urllib.request import pathname2url
+
+from .anutils import read_source
+from .node import Flavor
+from .session import AnalysisSession
+
+# LSP SymbolKind values
+SYMBOL_KINDS = {
+    Flavor.MODULE: 2,
+    Flavor.CLASS: 5,
+    Flavor.METHOD: 6,
+    Flavor.STATICMETHOD: 6,
+    Flavor.CLASSMETHOD: 6,
+    Flavor.FUNCTION: 12,
+}
+SYMBOL_KIND_VARIABLE = 13
+
+# JSON-RPC error codes
+METHOD_NOT_FOUND = -32601
+INTERNAL_ERROR = -32603
+
+_identifier = re.compile(r"\w+")
+
+
+def read_message(stream):
+    """Read one JSON-RPC message from the binary stream. Return None at the
+    end of the stream."""
+    length = None
+    while True:
+        line = stream.readline()
+        if not line:
+            return None
+        line = line.strip()
+        if not line:
+            if length is None:
+                continue  # no header yet
+            break
+        name, _, value = line.decode("ascii").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    return json.loads(stream.read(length).decode("utf-8"))
+
+
+def write_message(stream, message):
+    """Write one JSON-RPC message to the binary stream."""
+    body = json.dumps(message).encode("utf-8")
+    stream.write(b"Content-Length: %d\r\n\r\n" % len(body) + body)
+    stream.flush()
+
+
+def uri_to_path(uri):
+    return os.path.abspath(unquote(urlparse(uri).path))
+
+
+def path_to_uri(path):
+    return "file://" + pathname2url(os.path.abspath(path))
+
+
+class LatencyStats:
+    """Latencies of the requests, by method."""
+
+    def __init__(self):
+        self.latencies = {}  # method: [milliseconds]
+
+    def add(self, method, ms):
+        self.latencies.setdefault(method, []).append(ms)
+
+    def summary(self):
+        result = {}
+        for method, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            n = len(latencies)
+            result[method] = {
+                "count": n,
+                "p50_ms": latencies[(n - 1) // 2],
+                "p95_ms": latencies[min(n - 1, int(n * 0.95))],
+                "max_ms": latencies[-1],
+            }
+        return result
+
+
+class CallHierarchyServer:
+    """Language server state: the AnalysisSession and the open documents."""
+
+    def __init__(
+        self,
+        session,
+        rescan_interval=5.0,
+        latency_target=100.0,
+        logger=None,
+    ):
+        self.session = session
+        self.rescan_interval = rescan_interval
+        self.latency_target = latency_target
+        self.logger = logger or logging.getLogger(__name__)
+        self.last_scan = None
+        self.stats = LatencyStats()
+        self.shutdown_requested = False
+        self.lines = {}  # filename: source lines, for locating names
+        self.paths = {}  # absolute path: name of the analyzed file
+
+    # Analysis
+
+    def filename_of(self, uri):
+        """Return the name of the analyzed file for uri, or None."""
+        return self.paths.get(uri_to_path(uri))
+
+    def refresh(self):
+        """Bring the analysis up to date with the files and buffers."""
+        now = time.monotonic()
+        rescan = self.last_scan is None or now - self.last_scan >= self.rescan_interval
+        try:
+            changed = self.session.refresh(rescan=rescan)
+        except (SyntaxError, OSError, UnicodeDecodeError) as e:
+            # Typically a buffer being edited; answer from the last analysis.
+            # The session does not analyze again until something changes.
+            self.logger.info("%s; keeping the previous analysis" % e)
+            changed = []
+        if rescan:
+            self.last_scan = now
+            self.paths = {os.path.abspath(f): f for f in self.session.filenames}
+        if changed:
+            self.lines = {}
+
+    def source_lines(self, filename):
+        if filename not in self.lines:
+            text = self.session.sources.get(filename)
+            if text is None:
+                try:
+                    text = read_source(filename)
+                except (OSError, UnicodeDecodeError):
+                    text = ""
+            self.lines[filename] = text.splitlines()
+        return self.lines[filename]
+
+    def name_range(self, node):
+        """Return the LSP range of the name in the def or class statement
+        of node (or the start of the file, if its position is unknown)."""
+        if node.lineno is None:
+            position = {"line": 0, "character": 0}
+            return {"start": position, "end": position}
+        line = node.lineno - 1
+        lines = self.source_lines(node.filename)
+        text = lines[line] if line < len(lines) else ""
+        start = text.find(node.name, node.col_offset or 0)
+        if start < 0:
+            start = node.col_offset or 0
+        return {
+            "start": {"line": line, "character": start},
+            "end": {"line": line, "character": start + len(node.name)},
+        }
+
+    def item(self, node):
+        """Return the CallHierarchyItem of node."""
+        selection = self.name_range(node)
+        start = dict(selection["start"], character=node.col_offset or 0)
+        return {
+            "name": node.name,
+            "kind": SYMBOL_KINDS.get(node.flavor, SYMBOL_KIND_VARIABLE),
+            "detail": node.get_name(),
+            "uri": path_to_uri(node.filename),
+            "range": {"start": start, "end": selection["end"]},
+            "selectionRange": selection,
+            "data": {"name": node.get_name()},
+        }
+
+    def located(self, nodes):
+        return [node for node in nodes if node.filename is not None]
+
+    # Requests
+
+    def do_initialize(self, params):
+        if not self.session.args:
+            root = params.get("rootUri")
+            if root:
+                self.session.args = [uri_to_path(root)]
+            elif params.get("rootPath"):
+                self.session.args = [params["rootPath"]]
+        return {
+            "capabilities": {
+                "textDocumentSync": {"openClose": True, "change": 1},
+                "callHierarchyProvider": True,
+            },
+            "serverInfo": {"name": "pyan"},
+        }
+
+    def do_initialized(self, params):
+        self.refresh()  # warm up before the first query
+
+    def do_shutdown(self, params):
+        self.shutdown_requested = True
+        self.logger.info("Request latencies: %s" % json.dumps(self.stats.summary()))
+        return None
+
+    def do_textDocument_didOpen(self, params):
+        document = params["textDocument"]
+        self.set_source(document["uri"], document["text"])
+
+    def do_textDocument_didChange(self, params):
+        changes = params["contentChanges"]
+        if changes:
+            self.set_source(params["textDocument"]["uri"], changes[-1]["text"])
+
+    def do_textDocument_didClose(self, params):
+        filename = self.filename_of(params["textDocument"]["uri"])
+        if self.session.sources.pop(filename, None) is not None:
+            self.lines.pop(filename, None)
+
+    def set_source(self, uri, text):
+        filename = self.filename_of(uri)
+        if filename is None:
+            self.last_scan = None  # may be a new file; search again
+            filename = uri_to_path(uri)
+        self.session.sources[filename] = text
+        self.lines.pop(filename, None)
+
+    def do_textDocument_prepareCallHierarchy(self, params):
+        self.refresh()
+        filename = self.filename_of(params["textDocument"]["uri"])
+        graph = self.session.graph
+        if filename is None or graph is None:
+            return None
+        line = params["position"]["line"]
+        character = params["position"]["character"]
+        lines = self.source_lines(filename)
+        if line >= len(lines):
+            return None
+        for match in _identifier.finditer(lines[line]):
+            if match.start() <= character <= match.end():
+                word = match.group()
+                break
+        else:
+            return None
+        candidates = self.located(graph.by_short_name.get(word, ()))
+        # On a def or class statement, the definition itself; elsewhere,
+        # every definition of that name (pyan does not resolve the name at
+        # an arbitrary position).
+        here = [
+            node
+            for node in candidates
+            if node.filename == filename and node.lineno == line + 1
+        ]
+        nodes = here or sorted(candidates, key=lambda n: n.get_name())
+        return [self.item(node) for node in nodes] or None
+
+    def _calls(self, params, query, key):
+        """Return the calls found by query (the name of a CallGraph method)
+        for the item in params, as a list of {key: item, "fromRanges": ranges}."""
+        self.refresh()
+        graph = self.session.graph
+        name = params["item"].get("data", {}).get("name") or params["item"]["detail"]
+        if graph is None or name not in graph.by_name:
+            return []
+        result = []
+        for node in self.located(getattr(graph, query)(name)):
+            item = self.item(node)
+            if key == "from":
+                ranges = [item["selectionRange"]]
+            else:
+                ranges = [params["item"]["selectionRange"]]
+            result.append({key: item, "fromRanges": ranges})
+        return result
+
+    def do_callHierarchy_incomingCalls(self, params):
+        return self._calls(params, "callers", "from")
+
+    def do_callHierarchy_outgoingCalls(self, params):
+        return self._calls(params, "callees", "to")
+
+    def do_pyan_stats(self, params):
+        return {
+            "latency": self.stats.summary(),
+            "latency_target_ms": self.latency_target,
+            "files": len(self.session.filenames),
+            "open_documents": len(self.session.sources),
+            "analyses": self.session.analyses,
+            "analysis_ms": (self.session.analysis_time or 0.0) * 1e3,
+        }
+
+    # Dispatch
+
+    def handle(self, message):
+        """Handle one message. Return the response, or None for a
+        notification."""
+        method = message.get("method", "")
+        handler = getattr(self, "do_" + method.replace("/", "_"), None)
+        is_request = "id" in message
+        start = time.perf_counter()
+        response = {"jsonrpc": "2.0", "id": message.get("id")}
+        if handler is None:
+            response["error"] = {
+                "code": METHOD_NOT_FOUND,
+                "message": "Method not found: %s" % method,
+            }
+        else:
+            try:
+                response["result"] = handler(message.get("params") or {})
+            except Exception as e:
+                self.logger.exception("Error handling %s" % method)
+                response["error"] = {"code": INTERNAL_ERROR, "message": str(e)}
+        if not is_request:
+            return None
+        ms = (time.perf_counter() - start) * 1e3
+        self.stats.add(method, ms)
+        if ms > self.latency_target:
+            self.logger.warning(
+                "%s took %.1f ms (target %.0f ms)" % (method, ms, self.latency_target)
+            )
+        return response
+
+    def run(self, input, output):
+        """Serve the binary streams input and output until exit. Return the
+        exit code."""
+        while True:
+            message = read_message(input)
+            if message is None:
+                return 1
+            if message.get("method") == "exit":
+                return 0 if self.shutdown_requested else 1
+            response = self.handle(message)
+            if response is not None:
+                write_message(output, response)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog="pyan lsp",
+        description=(
+            "Language server on stdin/stdout answering call hierarchy"
+            " requests from the analysis of Python source files."
+        ),
+    )
+    parser.add_argument(
+        "filename",
+        nargs="*",
+        help=(
+            "Python files, directories or package names (default: the"
+            " workspace root given by the editor)"
+        ),
+    )
+    parser.add_argument("--include", action="append", dest="include", metavar="PATTERN")
+    parser.add_argument("--exclude", action="append", dest="exclude", metavar="PATTERN")
+    parser.add_argument(
+        "--rescan-interval",
+        type=float,
+        default=5.0,
+        dest="rescan_interval",
+        help="search for new files at most every SECONDS (default: 5)",
+        metavar="SECONDS",
+    )
+    parser.add_argument(
+        "--latency-target",
+        type=float,
+        default=100.0,
+        dest="latency_target",
+        help="log requests slower than MS milliseconds (default: 100)",
+        metavar="MS",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="count",
+        default=0,
+        dest="verbose",
+        help="verbose output. (Use twice for very verbose)",
+    )
+    parser.add_argument(
+        "-l", "--log", dest="logname", help="write log to LOG", metavar="LOG"
+    )
+    args = parser.parse_args(argv)
+
+    logger = logging.getLogger(__name__)
+    if args.verbose >= 2:
+        logger.setLevel(logging.DEBUG)
+    elif args.verbose == 1:
+        logger.setLevel(logging.INFO)
+    else:
+        logger.setLevel(logging.WARN)
+    logger.addHandler(logging.StreamHandler())  # stderr; stdout is the protocol
+    if args.logname:
+        logger.addHandler(logging.FileHandler(args.logname))
+
+    # Absolute paths, to match the document URIs.
+    filenames = [
+        os.path.abspath(arg) if os.path.exists(arg) else arg for arg in args.filename
+    ]
+    session = AnalysisSession(
+        filenames,
+        include=args.include,
+        exclude=args.exclude,
+        logger=logger,
+    )
+    server = CallHierarchyServer(
+        session,
+        rescan_interval=args.rescan_interval,
+        latency_target=args.latency_target,
+        logger=logger,
+    )
+    return server.run(sys.stdin.buffer, sys.stdout.buffer)
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 """Abstract node representing data gathered from the analysis."""
 
+import sys
 from enum import Enum
 
 
@@ -74,6 +75,10 @@ class Node:
     provides the line number at which the syntax object appears in the
     analyzed code. The filename, however, must be given manually.
 
+    To keep memory usage down on large analyses, a Node does not keep
+    a reference to the AST node itself (which would keep the whole AST of
+    the file alive), but only its source position, as lineno and col_offset.
+
     Nodes can also represent namespaces. These namespace nodes do not have an
     associated AST node. For a namespace node, the "namespace" argument is the
     **parent** namespace, and the "name" argument is the (last component of
@@ -87,13 +92,36 @@ class Node:
     See the Flavor enum for currently supported values.
     """
 
+    __slots__ = (
+        "namespace",
+        "name",
+        "lineno",
+        "col_offset",
+        "filename",
+        "flavor",
+        "defined",
+        "_full_name",
+        "_level",
+    )
+
     def __init__(self, namespace, name, ast_node, filename, flavor):
-        self.namespace = namespace
-        self.name = name
-        self.ast_node = ast_node
+        # Namespaces (and names) repeat across many nodes, so share the strings.
+        self.namespace = sys.intern(namespace) if namespace is not None else None
+        self.name = sys.intern(name) if name is not None else None
+        self.set_location(ast_node)
         self.filename = filename
         self.flavor = flavor
         self.defined = namespace is None  # assume that unknown nodes are defined
+        self._full_name = None  # cache for get_name()
+        self._level = None  # cache for get_level()
+
+    def set_location(self, ast_node):
+        """Record the source position of ast_node as the location of this Node.
+
+        ast_node can be an AST node, anything else that has lineno and
+        col_offset attributes (such as another Node), or None."""
+        self.lineno = getattr(ast_node, "lineno", None)
+        self.col_offset = getattr(ast_node, "col_offset", None)
 
     def get_short_name(self):
         """Return the short name (i.e. excluding the namespace), of this Node.
@@ -110,8 +138,8 @@ class Node:
         if self.namespace is None:
             return "*." + self.name
         else:
-            if self.get_level() >= 1 and self.ast_node is not None:
-                return "%s\\n(%s:%d)" % (self.name, self.filename, self.ast_node.lineno)
+            if self.get_level() >= 1 and self.lineno is not None:
+                return "%s\\n(%s:%d)" % (self.name, self.filename, self.lineno)
             else:
                 return self.name
 
@@ -122,11 +150,11 @@ class Node:
             return "*." + self.name
         else:
             if self.get_level() >= 1:
-                if self.ast_node is not None:
+                if self.lineno is not None:
                     return "%s\\n\\n(%s:%d,\\n%s in %s)" % (
                         self.name,
                         self.filename,
-                        self.ast_node.lineno,
+                        self.lineno,
                         repr(self.flavor),
                         self.namespace,
                     )
@@ -142,15 +170,16 @@ class Node:
     def get_name(self):
         """Return the full name of this node."""
 
-        if self.name is None:
-            return "??"
-
-        if self.namespace == "":
-            return self.name
-        elif self.namespace is None:
-            return "*." + self.name
-        else:
-            return self.namespace + "." + self.name
+        if self._full_name is None:
+            if self.name is None:
+                self._full_name = "??"
+            elif self.namespace == "":
+                self._full_name = self.name
+            elif self.namespace is None:
+                self._full_name = "*." + self.name
+            else:
+                self._full_name = self.namespace + "." + self.name
+        return self._full_name
 
     def get_level(self):
         """Return the level of this node (in terms of nested namespaces).
@@ -159,10 +188,12 @@ class Node:
         Top level is level 0.
 
         """
-        if self.namespace == "":
-            return 0
-        else:
-            return 1 + self.namespace.count(".")
+        if self._level is None:
+            if self.namespace == "":
+                self._level = 0
+            else:
+                self._level = 1 + self.namespace.count(".")
+        return self._level
 
     def get_toplevel_namespace(self):
         """Return the name of the top-level namespace of this node, or "" if none."""
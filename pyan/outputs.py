@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Producing several outputs from one analysis.
+
+Each output is described by an OutputSpec: a file (or None for stdout), a
+format, the graph_options for VisualGraph.from_visitor(), and the dot
+rankdir. The outputs can be given as repeated -f options on the command
+line, or in a view manifest, a JSON file like::
+
+    {
+        "graph_options": {"grouped": true},
+        "rankdir": "LR",
+        "outputs": [
+            {"file": "calls.svg"},
+            {"file": "calls.dot"},
+            {"file": "defines.graphml", "format": "yed",
+             "graph_options": {"draw_defines": true, "draw_uses": false}}
+        ]
+    }
+
+The top-level "graph_options" and "rankdir" are defaults for all outputs,
+on top of the options given on the command line. A missing "format" is
+determined from the extension of the file. Relative filenames are relative
+to the directory of the manifest.
+
+write_outputs() then builds one VisualGraph per distinct set of
+graph_options, generates the DOT text once for all of the dot and rendered
+outputs that share a graph and a rankdir (one dot run renders all of the
+formats), and writes the independent outputs concurrently. Renders that
+exceed their share of the time limit are redone from a coarse, module-level
+graph, within what is left of the limit; if that times out too, the output
+is skipped.
+
+A dot or rendered output can also be partitioned ("partition": true in the
+manifest, or --partition): the graph is then split into one graph per
+top-level group of the nested groups (see VisualGraph.partition()),
+written to FILE.NAME.EXT for a FILE.EXT, and the index graph of the edges
+between the partitions is written to FILE.EXT. The partitions are rendered
+concurrently in a process pool.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import json
+import logging
+import os
+import shutil
+import time
+
+from .profiling import NULL_PROFILER
+from .visgraph import VisualGraph
+from .writers import (
+    DotRenderer,
+    DotWriter,
+    RenderTimeout,
+    TgfWriter,
+    YedWriter,
+    dot_version,
+)
+
+RENDER_FORMATS = ("svg", "png", "eps", "pdf", "ps", "webp")
+FORMATS = ("dot", "tgf", "yed") + RENDER_FORMATS
+EXTENSIONS = {"graphml": "yed", "gv": "dot"}  # extensions that are not formats
+
+# Share of the render time limit kept for the module-level fallback render.
+FALLBACK_SHARE = 0.25
+
+GRAPH_OPTIONS = (
+    "draw_defines",
+    "draw_uses",
+    "colored",
+    "grouped_alt",
+    "grouped",
+    "nested_groups",
+    "annotated",
+)
+
+
+def format_for(filename):
+    """Return the output format implied by the extension of filename, or
+    None if it implies none."""
+    extension = os.path.splitext(filename)[1][1:].lower()
+    extension = EXTENSIONS.get(extension, extension)
+    return extension if extension in FORMATS else None
+
+
+class OutputSpec:
+    """One output: filename (None for stdout), format, graph_options (a dict
+    with the keys GRAPH_OPTIONS), dot rankdir, and whether to partition the
+    graph (which implies nested grouping)."""
+
+    def __init__(self, filename, format, graph_options, rankdir="TB", partition=False):
+        if format not in FORMATS:
+            raise ValueError(
+                "Unknown output format %r for %s; expected one of %s"
+                % (format, filename or "stdout", ", ".join(FORMATS))
+            )
+        if format in RENDER_FORMATS and filename is None:
+            raise ValueError("Cannot render %s to stdout" % format)
+        if partition:
+            if format not in ("dot",) + RENDER_FORMATS:
+                raise ValueError("Cannot partition %s output" % format)
+            if filename is None:
+                raise ValueError("Cannot write partitions to stdout")
+            # Flat groups would make every namespace a partition of its own.
+            graph_options = dict(graph_options, grouped=True, nested_groups=True)
+        self.filename = filename
+        self.format = format
+        self.graph_options = graph_options
+        self.rankdir = rankdir
+        self.partition = partition
+
+    @property
+    def graph_key(self):
+        """Hashable key of the graph_options."""
+        return tuple(sorted(self.graph_options.items()))
+
+    def __repr__(self):
+        return "<OutputSpec %s: %s>" % (self.filename or "stdout", self.format)
+
+
+def merge_graph_options(graph_options, overrides):
+    """Return graph_options updated with overrides, checking the keys.
+    nested_groups implies grouped, as on the command line."""
+    unknown = set(overrides) - set(GRAPH_OPTIONS)
+    if unknown:
+        raise ValueError(
+            "Unknown graph option(s) %s; expected some of %s"
+            % (", ".join(sorted(unknown)), ", ".join(GRAPH_OPTIONS))
+        )
+    result = dict(graph_options)
+    result.update(overrides)
+    if result.get("nested_groups"):
+        result["grouped"] = True
+    return result
+
+
+def load_manifest(filename, graph_options, rankdir="TB", partition=False):
+    """Read a view manifest (see the module docstring). graph_options,
+    rankdir and partition are the defaults from the command line. Return a
+    list of OutputSpecs. Raise ValueError if the manifest is invalid."""
+    try:
+        with open(filename, "rt", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        raise ValueError("Cannot read view manifest %s: %s" % (filename, e))
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("outputs"), list):
+        raise ValueError("View manifest %s has no list of outputs" % filename)
+
+    base = os.path.dirname(filename)
+    defaults = merge_graph_options(graph_options, manifest.get("graph_options", {}))
+    rankdir = manifest.get("rankdir", rankdir)
+    partition = manifest.get("partition", partition)
+    specs = []
+    for entry in manifest["outputs"]:
+        if not isinstance(entry, dict) or "file" not in entry:
+            raise ValueError(
+                "Each output in view manifest %s must have a file" % filename
+            )
+        output = os.path.join(base, entry["file"])
+        format = entry.get("format") or format_for(output)
+        if format is None:
+            raise ValueError("Cannot determine the output format of %s" % output)
+        specs.append(
+            OutputSpec(
+                output,
+                format,
+                merge_graph_options(defaults, entry.get("graph_options", {})),
+                entry.get("rankdir", rankdir),
+                entry.get("partition", partition),
+            )
+        )
+    return specs
+
+
+def partition_filename(filename, name):
+    """Return the filename of partition name of the output filename."""
+    root, ext = os.path.splitext(filename)
+    return "%s.%s%s" % (root, name, ext)
+
+
+def _writer_task(writer):
+    """Return a task running writer."""
+
+    def run(profiler):
+        writer.profiler = profiler
+        writer.run()
+
+    return type(writer).__name__, run
+
+
+def _dot_task(graph, specs, logger, render_options, coarse_graph):
+    """Return a task writing all of the dot and rendered outputs in specs,
+    which share graph and rankdir, with a single DOT generation.
+
+    render_options: keyword arguments for DotRenderer (cache, layout,
+    timeout). coarse_graph: function returning the graph to render instead,
+    if the rendering of graph times out, or None to only log the timeout.
+    With a coarse_graph, the timeout covers both renders: graph gets all but
+    FALLBACK_SHARE of it, and the coarse graph what is left."""
+    options = ["rankdir=" + specs[0].rankdir]
+    dot_files = [spec.filename for spec in specs if spec.format == "dot"]
+    renders = [(spec.format, spec.filename) for spec in specs if spec.format != "dot"]
+    if renders:
+        (output_format, output), renders = renders[0], renders[1:]
+        skipped = ", ".join([output] + [filename for _, filename in renders])
+        limit = render_options.get("timeout")
+        timeout = limit
+        if limit is not None and coarse_graph is not None:
+            timeout = limit * (1 - FALLBACK_SHARE)
+        writer = DotRenderer(
+            graph,
+            options=options,
+            output=output,
+            output_format=output_format,
+            logger=logger,
+            renders=renders,
+            dot_outputs=dot_files,
+            **dict(render_options, timeout=timeout)
+        )
+
+        def run(profiler):
+            writer.profiler = profiler
+            start = time.monotonic()
+            try:
+                writer.run()
+            except RenderTimeout as e:
+                if coarse_graph is None:
+                    logger.warning("%s" % e)
+                    return
+                # The fallback gets only what is left of the time limit.
+                remaining = limit - (time.monotonic() - start)
+                if remaining <= 0:
+                    logger.warning("%s; skipping %s" % (e, skipped))
+                    return
+                logger.warning("%s; rendering a module-level graph instead" % e)
+                fallback = DotRenderer(
+                    coarse_graph(),
+                    options=options,
+                    output=output,
+                    output_format=output_format,
+                    logger=logger,
+                    renders=renders,
+                    **dict(render_options, timeout=remaining)
+                )
+                fallback.profiler = profiler
+                try:
+                    fallback.run()
+                except RenderTimeout as e:
+                    logger.warning("%s; skipping %s" % (e, skipped))
+
+        return "DotRenderer", run
+
+    writer = DotWriter(graph, options=options, output=dot_files[0], logger=logger)
+
+    def run(profiler):
+        writer.profiler = profiler
+        writer.run()
+        for filename in dot_files[1:]:
+            shutil.copyfile(dot_files[0], filename)
+
+    return "DotWriter", run
+
+
+def _write_partition(graph, outputs, rankdir, logger, render_options):
+    """Write one partition graph to outputs, a list of (format, filename).
+    Run in a worker process."""
+    specs = [OutputSpec(filename, format, {}, rankdir) for format, filename in outputs]
+    _, run = _dot_task(graph, specs, logger, render_options, None)
+    run(NULL_PROFILER)
+
+
+def _partitioned_task(graph, specs, logger, render_options, jobs):
+    """Return a task writing the dot and rendered outputs in specs, which
+    share graph and rankdir, partitioned (see the module docstring), in a
+    pool of jobs processes."""
+
+    def run(profiler):
+        with profiler.phase("partition"):
+            index, parts = graph.partition()
+        logger.info(
+            "Partitioned the graph for %s into %d graphs"
+            % (", ".join(spec.filename for spec in specs), len(parts))
+        )
+        work = [(index, [(spec.format, spec.filename) for spec in specs])]
+        for name, part in parts:
+            outputs = [
+                (spec.format, partition_filename(spec.filename, name)) for spec in specs
+            ]
+            work.append((part, outputs))
+        rankdir = specs[0].rankdir
+        with profiler.phase("render partitions", partitions=len(parts), jobs=jobs):
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                futures = [
+                    executor.submit(
+                        _write_partition,
+                        part,
+                        outputs,
+                        rankdir,
+                        logger,
+                        render_options,
+                    )
+                    for part, outputs in work
+                ]
+                for future in futures:
+                    future.result()
+
+    return "partitions", run
+
+
+def plan_tasks(
+    graphs, specs, logger=None, render_options=None, coarse_graph=None, jobs=None
+):
+    """Return the list of (name, function) tasks that produce specs; the
+    function takes a profiler.
+
+    graphs: {graph_key: VisualGraph}. render_options: see _dot_task().
+    coarse_graph: function returning the coarse graph for a graph_key, used
+    when a rendering times out. jobs: number of processes rendering the
+    partitions of a partitioned output (default: one per CPU). Raise
+    NoDotError if a rendered format is requested but Graphviz is not
+    installed."""
+    logger = logger or logging.getLogger(__name__)
+    render_options = render_options or {}
+    tasks = []
+    dot_groups = {}  # (graph_key, rankdir, partition): [OutputSpec]
+    for spec in specs:
+        graph = graphs[spec.graph_key]
+        if spec.format == "tgf":
+            tasks.append(
+                _writer_task(TgfWriter(graph, output=spec.filename, logger=logger))
+            )
+        elif spec.format == "yed":
+            tasks.append(
+                _writer_task(YedWriter(graph, output=spec.filename, logger=logger))
+            )
+        else:
+            key = (spec.graph_key, spec.rankdir, spec.partition)
+            dot_groups.setdefault(key, []).append(spec)
+    for (graph_key, _, partition), group in dot_groups.items():
+        graph = graphs[graph_key]
+        if partition:
+            if any(spec.format != "dot" for spec in group):
+                dot_version()  # fail before starting the processes
+            task = _partitioned_task(
+                graph, group, logger, render_options, jobs or os.cpu_count() or 1
+            )
+        else:
+            task = _dot_task(
+                graph,
+                group,
+                logger,
+                render_options,
+                lambda graph_key=graph_key: coarse_graph(graph_key),
+            )
+        tasks.append(task)
+    return tasks
+
+
+def write_outputs(
+    visitor, specs, logger=None, profiler=NULL_PROFILER, jobs=None, render_options=None
+):
+    """Produce all of the outputs in specs from the analyzed visitor.
+
+    render_options: keyword arguments for DotRenderer: cache (a RenderCache),
+    layout (engine name or "auto"), and timeout (in seconds). Renders that
+    time out are redone from VisualGraph.modules_from_visitor() within the
+    rest of the time limit, or else skipped with a warning.
+    The layout strategy and time of each render are logged at info level.
+    jobs: maximum number of outputs written concurrently (default: one per
+    CPU). The dot subprocesses then run in parallel with each other and with
+    the pure-Python writers. Raise NoDotError if a rendered format is
+    requested but Graphviz is not installed; then no output is created."""
+    graphs = {}
+    for spec in specs:
+        if spec.graph_key not in graphs:
+            with profiler.phase("build visual graph"):
+                graphs[spec.graph_key] = VisualGraph.from_visitor(
+                    visitor, options=spec.graph_options, logger=logger
+                )
+    coarse_graphs = {}  # graph_key: module-level VisualGraph
+
+    def coarse_graph(graph_key):
+        if graph_key not in coarse_graphs:
+            coarse_graphs[graph_key] = VisualGraph.modules_from_visitor(
+                visitor, options=dict(graph_key), logger=logger
+            )
+        return coarse_graphs[graph_key]
+
+    tasks = plan_tasks(graphs, specs, logger, render_options, coarse_graph, jobs)
+
+    jobs = min(len(tasks), jobs or os.cpu_count() or 1)
+    if jobs <= 1:
+        for name, run in tasks:
+            with profiler.phase("write", writer=name):
+                run(profiler)
+        return
+
+    # The profiler is not thread-safe; time the outputs only as a whole.
+    with profiler.phase("write", outputs=len(specs), jobs=jobs):
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(run, NULL_PROFILER) for _, run in tasks]
+            for future in futures:
+                future.result()
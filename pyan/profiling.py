@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Phase-level profiling of a pyan run.
+
+A Profiler records, for each phase of a run (reading, symtable analysis and
+visiting of each file, resolving base classes, each postprocessing stage,
+building the visual graph, writing, running dot...), its wall time, CPU
+time and peak traced memory. The result can be exported as Chrome
+trace-event JSON (viewable in chrome://tracing or https://ui.perfetto.dev),
+and summarized as text.
+
+Instrumented code calls profiler.phase(); when no profiling is wanted, it
+uses NULL_PROFILER, whose phase() does nothing.
+
+Usage as a library::
+
+    profiler = Profiler()
+    v = CallGraphVisitor(filenames, profiler=profiler)
+    ...
+    profiler.write_trace("trace.json")
+    print(profiler.summary())
+"""
+
+from contextlib import contextmanager
+import json
+import os
+import time
+import tracemalloc
+
+
+class Phase:
+    """One recorded phase."""
+
+    __slots__ = ("name", "category", "args", "start", "wall", "cpu", "peak", "path")
+
+    def __init__(self, name, category, args, start, path):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = start  # seconds since the profiler was created
+        self.wall = 0.0  # seconds
+        self.cpu = 0.0  # seconds
+        self.peak = None  # bytes, if memory was traced
+        self.path = path  # names of the enclosing phases and this one
+
+    def __repr__(self):
+        return "<Phase %s: %.3f s>" % (self.name, self.wall)
+
+
+class NullProfiler:
+    """A profiler that records nothing."""
+
+    enabled = False
+
+    @contextmanager
+    def phase(self, name, category="phase", **args):
+        yield
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class Profiler:
+    """Record the wall time, CPU time and peak memory of nested phases.
+
+    trace_memory: whether to use tracemalloc to measure the peak memory use
+    of each phase. Tracing memory slows the run down considerably, so the
+    times are then mainly useful for comparing phases with each other.
+    """
+
+    enabled = True
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.phases = []  # in order of start
+        self._stack = []  # [Phase, peak of children so far]
+        self._origin = time.perf_counter()
+        self._started_tracing = False
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def stop(self):
+        """Stop tracing memory, if this profiler started it."""
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    @contextmanager
+    def phase(self, name, category="phase", **args):
+        """Context manager that records the enclosed code as a phase.
+
+        category groups similar phases (e.g. "file" for per-file work);
+        args are arbitrary JSON-serializable details, e.g. file=filename."""
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            # tracemalloc has only one peak counter; save the enclosing
+            # phase's peak before resetting it for this phase.
+            if self._stack:
+                peak = tracemalloc.get_traced_memory()[1]
+                self._stack[-1][1] = max(self._stack[-1][1], peak)
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        parent_path = self._stack[-1][0].path if self._stack else ()
+        phase = Phase(name, category, args, start - self._origin, parent_path + (name,))
+        self.phases.append(phase)
+        entry = [phase, 0]
+        self._stack.append(entry)
+        cpu_start = time.process_time()
+        try:
+            yield phase
+        finally:
+            phase.cpu = time.process_time() - cpu_start
+            phase.wall = time.perf_counter() - start
+            self._stack.pop()
+            if tracing:
+                phase.peak = max(entry[1], tracemalloc.get_traced_memory()[1])
+                if self._stack:
+                    self._stack[-1][1] = max(self._stack[-1][1], phase.peak)
+
+    def to_chrome_trace(self):
+        """Return the recorded phases as a Chrome trace-event JSON object."""
+        pid = os.getpid()
+        events = []
+        for phase in self.phases:
+            args = dict(phase.args)
+            args["cpu_ms"] = round(phase.cpu * 1e3, 3)
+            if phase.peak is not None:
+                args["peak_memory_kB"] = round(phase.peak / 1024, 1)
+            events.append(
+                {
+                    "name": phase.name,
+                    "cat": phase.category,
+                    "ph": "X",
+                    "ts": round(phase.start * 1e6, 1),
+                    "dur": round(phase.wall * 1e6, 1),
+                    "pid": pid,
+                    "tid": 0,
+                    "args": args,
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_trace(self, filename):
+        """Write the recorded phases to filename as Chrome trace-event JSON."""
+        with open(filename, "wt", encoding="utf-8") as f:
+            json.dump(self.to_chrome_trace(), f)
+
+    def summary(self, max_files=10):
+        """Return a text summary of the recorded phases.
+
+        Phases with the same name inside the same enclosing phases are
+        aggregated. The max_files files that took the longest are listed
+        separately."""
+        totals = {}  # path: [count, wall, cpu, peak]
+        for phase in self.phases:
+            total = totals.setdefault(phase.path, [0, 0.0, 0.0, None])
+            total[0] += 1
+            total[1] += phase.wall
+            total[2] += phase.cpu
+            if phase.peak is not None:
+                total[3] = max(total[3] or 0, phase.peak)
+
+        def format_row(label, count, wall, cpu, peak):
+            peak = "%10.1f" % (peak / 2**20) if peak is not None else "%10s" % "-"
+            return "%-44s %6d %10.3f %10.3f %s" % (label, count, wall, cpu, peak)
+
+        header = "%-44s %6s %10s %10s %10s" % (
+            "phase",
+            "count",
+            "wall [s]",
+            "cpu [s]",
+            "peak [MB]",
+        )
+        lines = [header, "-" * len(header)]
+        for path, (count, wall, cpu, peak) in totals.items():
+            label = ("  " * (len(path) - 1) + path[-1])[:44]
+            lines.append(format_row(label, count, wall, cpu, peak))
+
+        files = {}  # filename: [count, wall, cpu, peak]
+        for phase in self.phases:
+            filename = phase.args.get("file")
+            if filename is not None:
+                total = files.setdefault(filename, [0, 0.0, 0.0, None])
+                total[0] += 1
+                total[1] += phase.wall
+                total[2] += phase.cpu
+                if phase.peak is not None:
+                    total[3] = max(total[3] or 0, phase.peak)
+        if files:
+            lines.append("")
+            lines.append(header.replace("phase", "file ", 1))
+            lines.append("-" * len(header))
+            ranked = sorted(files.items(), key=lambda item: item[1][1], reverse=True)
+            for filename, (count, wall, cpu, peak) in ranked[:max_files]:
+                label = filename if len(filename) <= 44 else "..." + filename[-41:]
+                lines.append(format_row(label, count, wall, cpu, peak))
+            if len(ranked) > max_files:
+                lines.append("(%d more files)" % (len(ranked) - max_files))
+        return "\n".join(lines)
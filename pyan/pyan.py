@@ -1,23 +1,31 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-    pyan.py - Generate approximate call graphs for Python programs.
+pyan.py - Generate approximate call graphs for Python programs.
 
-    This program takes one or more Python source files, does a superficial
-    analysis, and constructs a directed graph of the objects in the combined
-    source, and how they define or use each other.  The graph can be output
-    for rendering by e.g. Graphviz or yEd.
+This program takes one or more Python source files, does a superficial
+analysis, and constructs a directed graph of the objects in the combined
+source, and how they define or use each other.  The graph can be output
+for rendering by e.g. Graphviz or yEd.
 """
 
 import argparse
 import logging
-from glob import glob
-import os.path
+import os
 import sys
 
 from pyan.analyzer import CallGraphVisitor
-from pyan.visgraph import VisualGraph
-from pyan.writers import TgfWriter, DotWriter, YedWriter, DotRenderer, NoDotError
+from pyan.anutils import PackageIndex
+from pyan.cache import AnalysisCache, load_state, save_state, source_path
+from pyan.costs import COLUMNS, CostTracker
+from pyan.discovery import find_source_files
+from pyan.layout import ENGINES
+from pyan.outputs import OutputSpec, format_for, load_manifest, write_outputs
+from pyan.profiling import NULL_PROFILER, Profiler
+from pyan.rendercache import DEFAULT_MAX_SIZE, RenderCache
+from pyan.session import AnalysisSession
+from pyan.watch import DEFAULT_DEBOUNCE, watch
+from pyan.writers import NoDotError
 
 
 def process_command_line(argv):
@@ -34,7 +42,15 @@ def process_command_line(argv):
     parser = argparse.ArgumentParser(description=desc)
 
     # required arguments
-    parser.add_argument("filename", nargs="+", help="Python files to process")
+    parser.add_argument(
+        "filename",
+        nargs="+",
+        help=(
+            "Python files to process; directories are searched recursively,"
+            " and names of importable packages (e.g. json.tool) are looked"
+            " up on the Python path"
+        ),
+    )
 
     # optional arguments
 
@@ -53,15 +69,28 @@ def process_command_line(argv):
     parser.add_argument(
         "-f",
         "--file",
-        dest="outfilename",
+        action="append",
+        dest="outfilenames",
         help=(
             "write graph to FILE.  If no file format is specified using the"
             " --format option, then the extension of FILE will be used to"
-            " determine desired output file format."
+            " determine desired output file format.  Can be given several"
+            " times to write several outputs from one analysis; --format"
+            " then applies to every FILE."
         ),
         metavar="FILE",
         default=None,
     )
+    parser.add_argument(
+        "--views",
+        dest="views",
+        default=None,
+        help=(
+            "also write the outputs listed in the JSON view manifest FILE,"
+            " each with its own format and graph options (see pyan/outputs.py)"
+        ),
+        metavar="FILE",
+    )
 
     # drawing options
     parser.add_argument(
@@ -134,6 +163,219 @@ def process_command_line(argv):
         ),
     )
 
+    # file discovery options
+    parser.add_argument(
+        "--include",
+        action="append",
+        dest="include",
+        help=(
+            "in directories, collect only files matching PATTERN (a glob"
+            " matched against the name or the path inside the directory)."
+            " Can be given several times. (default: *.py)"
+        ),
+        metavar="PATTERN",
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        dest="exclude",
+        help=(
+            "in directories, skip files and subdirectories matching PATTERN."
+            " Can be given several times."
+        ),
+        metavar="PATTERN",
+    )
+
+    # analysis options
+    parser.add_argument(
+        "--max-parse-cache",
+        type=int,
+        default=None,
+        dest="max_parse_cache",
+        help=(
+            "keep parsed ASTs of at most SIZE characters of source in memory"
+            " between analysis passes; evicted files are re-parsed when"
+            " needed (default: no limit)"
+        ),
+        metavar="SIZE",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        default=None,
+        help=(
+            "cache per-module analysis results in DIR, and reuse them on later"
+            " runs for files that have not changed"
+        ),
+        metavar="DIR",
+    )
+    parser.add_argument(
+        "--save-state",
+        dest="save_state",
+        default=None,
+        help=(
+            "save the analysis state (the content hash and analysis results of"
+            " each file) in FILE, for a later --base-state"
+        ),
+        metavar="FILE",
+    )
+    parser.add_argument(
+        "--base-state",
+        dest="base_state",
+        default=None,
+        help=(
+            "reuse the analysis results saved with --save-state in FILE (e.g."
+            " by the run for a base revision) for the files that have not"
+            " changed since"
+        ),
+        metavar="FILE",
+    )
+    parser.add_argument(
+        "--changed",
+        dest="changed",
+        default=None,
+        help=(
+            "with --base-state, read the files changed since the base state"
+            " from FILE ('-' for stdin), one per line, e.g. the output of git"
+            " diff --name-only run in the current directory; only these files"
+            " (and their importers) are then read and analyzed again. Without"
+            " --changed, every file is hashed to find the changes"
+        ),
+        metavar="FILE",
+    )
+
+    parser.add_argument(
+        "--layout",
+        choices=ENGINES,
+        default="auto",
+        dest="layout",
+        help=(
+            "Graphviz layout engine for rendered formats; auto chooses dot,"
+            " neato or sfdp, and speed-oriented options, by the size of the"
+            " graph (default: %(default)s)"
+        ),
+    )
+    parser.add_argument(
+        "--render-timeout",
+        type=float,
+        default=None,
+        dest="render_timeout",
+        help=(
+            "limit the rendering of a graph to SECONDS; if the full graph"
+            " takes more than 3/4 of that, render a module-level graph"
+            " instead in the rest, or skip the output (default: no limit)"
+        ),
+        metavar="SECONDS",
+    )
+    parser.add_argument(
+        "--partition",
+        action="store_true",
+        default=False,
+        dest="partition",
+        help=(
+            "split dot and rendered outputs FILE.EXT into one graph per"
+            " top-level namespace, written to FILE.NAMESPACE.EXT and rendered"
+            " in parallel processes, plus an index graph of the uses between"
+            " namespaces, written to FILE.EXT (implies -e)"
+        ),
+    )
+    parser.add_argument(
+        "--render-cache",
+        dest="render_cache",
+        default=None,
+        help=(
+            "cache rendered graphs (png, svg, ...) in DIR, keyed by a hash of"
+            " the DOT text, format and dot options, and reuse them instead of"
+            " running dot again when the graph has not changed"
+        ),
+        metavar="DIR",
+    )
+    parser.add_argument(
+        "--render-cache-size",
+        type=int,
+        default=DEFAULT_MAX_SIZE // 2**20,
+        dest="render_cache_size",
+        help=(
+            "with --render-cache, delete the least recently used renders when"
+            " the cache grows beyond SIZE megabytes (default: %(default)s)"
+        ),
+        metavar="SIZE",
+    )
+
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        default=None,
+        help=(
+            "record the wall time, CPU time and peak memory of each phase of"
+            " the run, write them to FILE as Chrome trace-event JSON (for"
+            " chrome://tracing or ui.perfetto.dev), and print a summary to"
+            " stderr"
+        ),
+        metavar="FILE",
+    )
+    parser.add_argument(
+        "--profile-no-memory",
+        action="store_false",
+        default=True,
+        dest="profile_memory",
+        help=(
+            "with --profile, do not trace memory use (tracing memory makes"
+            " the run several times slower)"
+        ),
+    )
+
+    parser.add_argument(
+        "--cost-report",
+        dest="cost_report",
+        default=None,
+        help=(
+            "write a report of the analysis cost (parse and visit time, nodes,"
+            " uses edges, wildcard edges, expansion fan-out) of each top-level"
+            " namespace to FILE, as JSON or CSV if FILE ends with .json or"
+            " .csv, else as a text table"
+        ),
+        metavar="FILE",
+    )
+    parser.add_argument(
+        "--cost-by",
+        choices=("namespace", "file"),
+        default="namespace",
+        dest="cost_by",
+        help="with --cost-report, report per namespace or per file",
+    )
+    parser.add_argument(
+        "--cost-sort",
+        choices=COLUMNS,
+        default="visit_s",
+        dest="cost_sort",
+        help="with --cost-report, sort by this column (default: visit_s)",
+        metavar="COLUMN",
+    )
+
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        default=False,
+        dest="watch",
+        help=(
+            "after writing the outputs, watch the source files (with inotify,"
+            " or by polling), and rewrite the outputs whenever they change,"
+            " re-analyzing only the changed modules and their importers"
+        ),
+    )
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=DEFAULT_DEBOUNCE,
+        dest="debounce",
+        help=(
+            "with --watch, wait until no file has changed for SECONDS before"
+            " regenerating (default: %(default)s)"
+        ),
+        metavar="SECONDS",
+    )
+
     # general options
     parser.add_argument(
         "-l", "--log", dest="logname", help="write log to LOG", metavar="LOG"
@@ -149,13 +391,40 @@ def process_command_line(argv):
 
     args = parser.parse_args(argv)
 
+    if args.watch:
+        # these apply to a single analysis run
+        unsupported = [
+            option
+            for option, value in (
+                ("--profile", args.profile),
+                ("--cost-report", args.cost_report),
+                ("--save-state", args.save_state),
+                ("--base-state", args.base_state),
+                ("--changed", args.changed),
+            )
+            if value
+        ]
+        if unsupported:
+            parser.error("%s cannot be used with --watch" % ", ".join(unsupported))
+
     return args
 
 
 def main():
-    args = process_command_line(sys.argv)
+    if sys.argv[1:2] == ["serve"]:
+        from pyan.server import main as serve_main
+
+        sys.exit(serve_main(sys.argv[2:]))
+    if sys.argv[1:2] == ["lsp"]:
+        from pyan.lsp import main as lsp_main
 
-    filenames = [y for x in args.filename for y in glob(x)]
+        sys.exit(lsp_main(sys.argv[2:]))
+    if sys.argv[1:2] == ["query"]:
+        from pyan.query import main as query_main
+
+        sys.exit(query_main(sys.argv[2:]))
+
+    args = process_command_line(sys.argv)
 
     if args.nested_groups:
         args.grouped = True
@@ -170,12 +439,6 @@ def main():
         "annotated": args.annotated,
     }
 
-    out_format = args.format
-    if args.outfilename and not args.format:
-        out_format = os.path.splitext(args.outfilename)[1][1:]
-    if not out_format:
-        out_format = "dot"
-
     logger = logging.getLogger(__name__)
     if args.verbose >= 2:
         logger.setLevel(logging.DEBUG)
@@ -188,44 +451,196 @@ def main():
         handler = logging.FileHandler(args.logname)
         logger.addHandler(handler)
 
-    v = CallGraphVisitor(filenames, logger)
-    graph = VisualGraph.from_visitor(v, options=graph_options, logger=logger)
+    if args.profile:
+        profiler = Profiler(trace_memory=args.profile_memory)
+    else:
+        profiler = NULL_PROFILER
+    try:
+        run(args, graph_options, logger, profiler)
+    finally:
+        if args.profile:
+            profiler.stop()
+            profiler.write_trace(args.profile)
+            print(profiler.summary(), file=sys.stderr)
 
-    if out_format == "dot":
-        writer = DotWriter(
-            graph,
-            options=["rankdir=" + args.rankdir],
-            output=args.outfilename,
-            logger=logger,
+
+def output_specs(args, graph_options):
+    """Return the OutputSpecs given by the command line, or None if an
+    output format cannot be determined."""
+    outfilenames = args.outfilenames or []
+    if args.views:
+        specs = load_manifest(args.views, graph_options, args.rankdir, args.partition)
+    else:
+        specs = []
+        if not outfilenames:
+            outfilenames = [None]  # stdout
+
+    for outfilename in outfilenames:
+        if args.format:
+            out_format = args.format
+        elif outfilename:
+            out_format = format_for(outfilename)
+        else:
+            out_format = "dot"
+        if out_format is None:
+            return None
+        specs.append(
+            OutputSpec(
+                outfilename, out_format, graph_options, args.rankdir, args.partition
+            )
         )
-    elif out_format == "tgf":
-        writer = TgfWriter(graph, output=args.outfilename, logger=logger)
-    elif out_format == "yed":
-        writer = YedWriter(graph, output=args.outfilename, logger=logger)
-    elif out_format in ["svg", "png", "eps", "pdf", "ps", "webp"]:
-        try:
-            writer = DotRenderer(
-                graph,
-                options=["rankdir=" + args.rankdir],
-                output=args.outfilename,
-                output_format=out_format,
+    return specs
+
+
+def run(args, graph_options, logger, profiler):
+    try:
+        specs = output_specs(args, graph_options)
+    except ValueError as e:
+        print("%s.  Stopping without creating any output." % e)
+        return
+    if specs is None:
+        print("Cannot determine output format.  Stopping without creating any output.")
+        return
+
+    try:
+        cache, state, changed = base_state(args, logger)
+    except ValueError as e:
+        print("%s.  Stopping without creating any output." % e)
+        return
+
+    render_options = {"layout": args.layout, "timeout": args.render_timeout}
+    if args.render_cache:
+        render_options["cache"] = RenderCache(
+            args.render_cache, max_size=args.render_cache_size * 2**20, logger=logger
+        )
+
+    def write(v):
+        v.freeze()  # no-op after analyze(); compacts the edges in watch mode
+        write_outputs(
+            v, specs, logger=logger, profiler=profiler, render_options=render_options
+        )
+
+    try:
+        if args.watch:
+            session = AnalysisSession(
+                args.filename,
+                include=args.include,
+                exclude=args.exclude,
                 logger=logger,
+                cache=args.cache_dir,
+                max_parse_cache=args.max_parse_cache,
+                index=False,
             )
-        except NoDotError:
-            print(
-                "No executable 'dot' found in PATH.  Stopping without creating"
-                " any output."
-            )
-            print(
-                "To enable this functionality, install Graphviz's dot utility"
-                " to your path."
-            )
-            return
+            watch(session, write, debounce=args.debounce, logger=logger)
+        else:
+            write(analyze(args, logger, profiler, cache, state, changed))
+    except NoDotError:
+        print(
+            "No executable 'dot' found in PATH.  Stopping without creating"
+            " any output."
+        )
+        print(
+            "To enable this functionality, install Graphviz's dot utility"
+            " to your path."
+        )
+
+
+def read_file_list(filename):
+    """Return the set of absolute paths listed in filename ('-' for stdin),
+    one per line."""
+    if filename == "-":
+        lines = sys.stdin.read().splitlines()
     else:
-        print("Cannot determine output format.  Stopping without creating any output.")
-        return
-    # actually write file output
-    writer.run()
+        with open(filename, "rt", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    return {os.path.abspath(line.strip()) for line in lines if line.strip()}
+
+
+def base_state(args, logger):
+    """Return the AnalysisCache (or the cache directory name, or None), the
+    file digests of the base state (as {source path: digest}, or None), and
+    the set of changed files (or None) for the analysis, from --cache-dir,
+    --base-state, --changed and --save-state. Raise ValueError if they
+    cannot be used."""
+    if args.changed and not args.base_state:
+        raise ValueError("--changed requires --base-state")
+    if not args.base_state and not args.save_state:
+        return args.cache_dir, None, None
+    cache = AnalysisCache(args.cache_dir, logger=logger)
+    if not args.base_state:
+        return cache, None, None
+    try:
+        state = load_state(args.base_state, cache, logger=logger)
+        changed = read_file_list(args.changed) if args.changed else None
+    except OSError as e:
+        raise ValueError("Cannot read %s: %s" % (e.filename, e.strerror))
+    return cache, state, changed
+
+
+def unchanged_digests(args, filenames, packages, state, changed, logger):
+    """Return the known digests {filename: digest} of the files among
+    filenames that are in the base state state and not among the changed
+    files, or None if there is no list of changed files (then every file is
+    hashed to find the changes). Warn if the state matches none of the
+    files, e.g. when it was saved for another set of files."""
+    matched = {}
+    for filename in filenames:
+        path = source_path(filename, packages.module_name(filename))
+        if path in state:
+            matched[filename] = state[path]
+    if state and not matched:
+        logger.warning(
+            "Base state %s matches none of the input files; analyzing all of them"
+            % args.base_state
+        )
+    if changed is None:
+        return None
+    digests = {
+        filename: digest
+        for filename, digest in matched.items()
+        if os.path.abspath(filename) not in changed
+    }
+    logger.info("Base state %s: %d files unchanged" % (args.base_state, len(digests)))
+    return digests
+
+
+def analyze(args, logger, profiler, cache=None, state=None, changed=None):
+    """Analyze the files given on the command line, with the cache, base
+    state digests and changed files from base_state(). Return the frozen
+    CallGraphVisitor."""
+    packages = PackageIndex()
+    with profiler.phase("discover files"):
+        filenames = find_source_files(
+            args.filename,
+            include=args.include,
+            exclude=args.exclude,
+            packages=packages,
+            logger=logger,
+        )
+    digests = None
+    if state is not None:
+        digests = unchanged_digests(args, filenames, packages, state, changed, logger)
+
+    costs = CostTracker() if args.cost_report else None
+    with profiler.phase("analyze", files=len(filenames)):
+        v = CallGraphVisitor(
+            filenames,
+            logger,
+            max_parse_cache=args.max_parse_cache,
+            cache=cache,
+            packages=packages,
+            profiler=profiler,
+            costs=costs,
+            digests=digests,
+        )
+    if args.save_state:
+        with profiler.phase("save state"):
+            save_state(v, args.save_state)
+    if costs is not None:
+        costs.write(args.cost_report, by=args.cost_by, sort_by=args.cost_sort)
+    with profiler.phase("freeze"):
+        v.freeze()  # analysis complete; switch to compact edge storage
+    return v
 
 
 if __name__ == "__main__":
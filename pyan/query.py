@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Queries over the call graph of an analyzed CallGraphVisitor.
+
+A CallGraph numbers the defined nodes (those found in the analyzed files),
+and indexes their uses and defines edges in both directions as compressed
+sparse row arrays of node IDs (see edgestore), so that queries need no
+VisualGraph, and take time proportional to the part of the graph they
+explore. It answers:
+
+  callers, callees     the direct neighbors of a definition
+  reachable            transitive callers or callees, up to a depth
+  path                 a shortest call path (bidirectional BFS)
+  all_paths            all simple call paths up to a length, shortest first
+
+Definitions are looked up by full name (e.g. "billing.Invoice.charge").
+
+    pyan query FILES... --callers NAME [--depth N]
+    pyan query FILES... --callees NAME [--depth N]
+    pyan query FILES... --path SOURCE TARGET
+    pyan query FILES... --all-paths SOURCE TARGET [--max-length K]
+
+runs one query from the command line.
+"""
+
+import argparse
+from array import array
+import json
+import logging
+import sys
+import time
+
+from .analyzer import CallGraphVisitor
+from .anutils import PackageIndex
+from .discovery import find_source_files
+from .edgestore import number_nodes
+
+EDGE_KINDS = ("uses", "defines")
+
+
+def describe(node):
+    """Return a JSON-serializable description of a Node."""
+    return {
+        "name": node.get_name(),
+        "flavor": node.flavor.value,
+        "filename": node.filename,
+        "lineno": node.lineno,
+    }
+
+
+class Adjacency:
+    """Edges between node IDs in compressed sparse row form: the targets of
+    node i are indices[indptr[i]:indptr[i + 1]]."""
+
+    def __init__(self, num_nodes, rows):
+        """rows: iterable of (source ID, list of target IDs)."""
+        targets = dict(rows)
+        self.indptr = array("Q", [0])
+        self.indices = array("I")
+        for i in range(num_nodes):
+            self.indices.extend(targets.get(i, ()))
+            self.indptr.append(len(self.indices))
+
+    def targets_of(self, i):
+        return self.indices[self.indptr[i] : self.indptr[i + 1]]
+
+    def transpose(self):
+        """Return the Adjacency of the reversed edges."""
+        num_nodes = len(self.indptr) - 1
+        indptr, indices = self.indptr, self.indices
+        counts = [0] * (num_nodes + 1)
+        for j in indices:
+            counts[j + 1] += 1
+        for i in range(num_nodes):
+            counts[i + 1] += counts[i]
+        result = Adjacency(0, ())
+        result.indptr = array("Q", counts)
+        result.indices = array("I", bytes(4 * len(indices)))
+        position = counts[:-1]
+        for i in range(num_nodes):  # sources ascending, so each row is sorted
+            for k in range(indptr[i], indptr[i + 1]):
+                j = indices[k]
+                result.indices[position[j]] = i
+                position[j] += 1
+        return result
+
+
+def _bfs(adjacency, starts, depth=None):
+    """Return {ID: distance} of the nodes within depth steps of the IDs in
+    starts (all reachable nodes if depth is None)."""
+    distance = {i: 0 for i in starts}
+    frontier = list(distance)
+    level = 0
+    while frontier and (depth is None or level < depth):
+        level += 1
+        next_frontier = []
+        for i in frontier:
+            for j in adjacency.targets_of(i):
+                if j not in distance:
+                    distance[j] = level
+                    next_frontier.append(j)
+        frontier = next_frontier
+    return distance
+
+
+class CallGraph:
+    """Index of the defined nodes and their edges in an analyzed
+    CallGraphVisitor (frozen or not)."""
+
+    def __init__(self, visitor):
+        nodes = [n for ns in visitor.nodes.values() for n in ns if n.defined]
+        self.node_list, self.ids = number_nodes(nodes)
+        self.by_name = {}  # full name: [Node]
+        self.by_short_name = {}  # short name: [Node]
+        for node in self.node_list:
+            self.by_name.setdefault(node.get_name(), []).append(node)
+            self.by_short_name.setdefault(node.name, []).append(node)
+
+        num_nodes = len(self.node_list)
+        self.forward = {}  # edge kind: Adjacency
+        self.backward = {}
+        for kind, edges in (
+            ("uses", visitor.uses_edges),
+            ("defines", visitor.defines_edges),
+        ):
+            self.forward[kind] = Adjacency(num_nodes, self._rows(edges))
+            self.backward[kind] = self.forward[kind].transpose()
+
+    def _rows(self, edges):
+        """Iterate over the edges between defined nodes, as (source ID,
+        [target IDs]), from a dict of sets of Nodes or a CSRAdjacency."""
+        ids = self.ids
+        if hasattr(edges, "targets_of"):  # frozen visitor; avoid the Nodes
+            remap = [ids.get(node, -1) for node in edges.node_list]
+            for i, source in enumerate(remap):
+                if source >= 0 and edges.degree(i):
+                    targets = [remap[j] for j in edges.targets_of(i)]
+                    yield source, sorted(j for j in targets if j >= 0)
+        else:
+            for node, targets in edges.items():
+                if node in ids:
+                    yield ids[node], sorted(ids[t] for t in targets if t in ids)
+
+    def _adjacency(self, kind, reverse):
+        if kind not in EDGE_KINDS:
+            raise ValueError(
+                "Unknown edge kind %r; expected one of %s"
+                % (kind, ", ".join(EDGE_KINDS))
+            )
+        return (self.backward if reverse else self.forward)[kind]
+
+    def lookup(self, name):
+        """Return the nodes with the full name name. Raise ValueError if
+        there are none."""
+        try:
+            return self.by_name[name]
+        except KeyError:
+            raise ValueError("No definition named %r" % (name,))
+
+    def _lookup_ids(self, name):
+        return [self.ids[node] for node in self.lookup(name)]
+
+    def _nodes(self, ids):
+        node_list = self.node_list
+        return sorted((node_list[i] for i in ids), key=lambda n: n.get_name())
+
+    def _neighbors(self, name, kind, reverse):
+        adjacency = self._adjacency(kind, reverse)
+        result = set()
+        for i in self._lookup_ids(name):
+            result.update(adjacency.targets_of(i))
+        return self._nodes(result)
+
+    def callers(self, name):
+        """Return the nodes that use the definition name."""
+        return self._neighbors(name, "uses", True)
+
+    def callees(self, name):
+        """Return the nodes that the definition name uses."""
+        return self._neighbors(name, "uses", False)
+
+    def defines_of(self, name):
+        """Return the nodes that the definition name defines."""
+        return self._neighbors(name, "defines", False)
+
+    def reachable(self, name, reverse=False, depth=None, kind="uses"):
+        """Return the transitive callees (or callers, if reverse is true) of
+        the definition name, within depth steps (unlimited if None), as a
+        list of (node, distance), nearest first. kind: "uses" or "defines"
+        edges."""
+        if depth is not None and depth < 0:
+            raise ValueError("depth must not be negative, not %d" % depth)
+        adjacency = self._adjacency(kind, reverse)
+        distance = _bfs(adjacency, self._lookup_ids(name), depth)
+        node_list = self.node_list
+        result = [(node_list[i], d) for i, d in distance.items() if d > 0]
+        result.sort(key=lambda item: (item[1], item[0].get_name()))
+        return result
+
+    def path(self, source, target, kind="uses"):
+        """Return a shortest chain of edges from the definition source to
+        the definition target, as a list of nodes, or None if there is
+        none. The search runs from both ends (bidirectional BFS), always
+        expanding the smaller frontier."""
+        forward = self._adjacency(kind, False)
+        backward = self._adjacency(kind, True)
+        sources = self._lookup_ids(source)
+        targets = self._lookup_ids(target)
+        parents = ({i: None for i in sources}, {i: None for i in targets})
+        distances = ({i: 0 for i in sources}, {i: 0 for i in targets})
+        frontiers = [list(sources), list(targets)]
+        meet = next((i for i in sources if i in parents[1]), None)
+        while meet is None and frontiers[0] and frontiers[1]:
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            adjacency = forward if side == 0 else backward
+            parent, distance = parents[side], distances[side]
+            other = distances[1 - side]
+            next_frontier = []
+            for i in frontiers[side]:
+                for j in adjacency.targets_of(i):
+                    if j not in parent:
+                        parent[j] = i
+                        distance[j] = distance[i] + 1
+                        next_frontier.append(j)
+                        # Complete the level, and keep the meeting point
+                        # nearest to the other end.
+                        if j in other and (meet is None or other[j] < other[meet]):
+                            meet = j
+            frontiers[side] = next_frontier
+        if meet is None:
+            return None
+        path = []
+        i = meet
+        while i is not None:
+            path.append(i)
+            i = parents[0][i]
+        path.reverse()
+        i = parents[1][meet]
+        while i is not None:
+            path.append(i)
+            i = parents[1][i]
+        return [self.node_list[i] for i in path]
+
+    def all_paths(self, source, target, max_length, kind="uses", limit=None):
+        """Return the simple chains of edges from the definition source to
+        the definition target with at most max_length edges, as lists of
+        nodes, shortest first, and at most limit of them (all if None).
+
+        The search only enters nodes from which the target is still
+        reachable within the remaining length (known from a BFS from the
+        target), so it explores no dead ends."""
+        forward = self._adjacency(kind, False)
+        backward = self._adjacency(kind, True)
+        sources = self._lookup_ids(source)
+        targets = set(self._lookup_ids(target))
+        to_target = _bfs(backward, targets, max_length)
+        paths = []
+        path = []
+        on_path = set()
+
+        def full():
+            return limit is not None and len(paths) >= limit
+
+        def extend(i, remaining):
+            """Add to paths the paths from path (ending at i) that reach a
+            target in exactly remaining more edges."""
+            if remaining == 0:
+                if i in targets:
+                    paths.append(list(path))
+                return
+            if i in targets:
+                return  # stop at the first target
+            for j in forward.targets_of(i):
+                if j not in on_path and to_target.get(j, remaining) < remaining:
+                    path.append(j)
+                    on_path.add(j)
+                    extend(j, remaining - 1)
+                    on_path.discard(j)
+                    path.pop()
+                    if full():
+                        return
+
+        for length in range(max_length + 1):
+            for i in sources:
+                if to_target.get(i, length + 1) <= length:
+                    path.append(i)
+                    on_path.add(i)
+                    extend(i, length)
+                    on_path.discard(i)
+                    path.pop()
+                if full():
+                    break
+            if full():
+                break
+        node_list = self.node_list
+        return [[node_list[i] for i in p] for p in paths]
+
+
+def _format_node(node):
+    if node.lineno is None:
+        return "%s\t%s" % (node.get_name(), node.filename)
+    return "%s\t%s:%d" % (node.get_name(), node.filename, node.lineno)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog="pyan query",
+        description=(
+            "Analyze Python source files, and answer a query about their call"
+            " graph: transitive callers or callees, or call paths between two"
+            " definitions (given by full name)."
+        ),
+    )
+    parser.add_argument(
+        "filename", nargs="+", help="Python files, directories or package names"
+    )
+    query_group = parser.add_mutually_exclusive_group(required=True)
+    query_group.add_argument(
+        "--callers", dest="callers", help="the callers of NAME", metavar="NAME"
+    )
+    query_group.add_argument(
+        "--callees", dest="callees", help="the callees of NAME", metavar="NAME"
+    )
+    query_group.add_argument(
+        "--path",
+        nargs=2,
+        dest="path",
+        help="a shortest call path from SOURCE to TARGET",
+        metavar=("SOURCE", "TARGET"),
+    )
+    query_group.add_argument(
+        "--all-paths",
+        nargs=2,
+        dest="all_paths",
+        help="all call paths from SOURCE to TARGET, up to --max-length",
+        metavar=("SOURCE", "TARGET"),
+    )
+    parser.add_argument(
+        "--depth",
+        type=int,
+        default=1,
+        dest="depth",
+        help=(
+            "with --callers or --callees, follow calls up to N steps away"
+            " (0 = no limit; default: 1)"
+        ),
+        metavar="N",
+    )
+    parser.add_argument(
+        "--max-length",
+        type=int,
+        default=5,
+        dest="max_length",
+        help="with --all-paths, the maximum number of calls (default: 5)",
+        metavar="K",
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=1000,
+        dest="limit",
+        help="with --all-paths, output at most N paths (default: 1000)",
+        metavar="N",
+    )
+    parser.add_argument(
+        "--edges",
+        choices=EDGE_KINDS,
+        default="uses",
+        dest="kind",
+        help="query the uses (default) or the defines edges",
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        default=False,
+        dest="json",
+        help="output JSON instead of text",
+    )
+    parser.add_argument("--include", action="append", dest="include", metavar="PATTERN")
+    parser.add_argument("--exclude", action="append", dest="exclude", metavar="PATTERN")
+    parser.add_argument("--cache-dir", dest="cache_dir", default=None, metavar="DIR")
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="count",
+        default=0,
+        dest="verbose",
+        help="verbose output. (Use twice for very verbose)",
+    )
+    args = parser.parse_args(argv)
+    if args.depth < 0:
+        parser.error("--depth must not be negative")
+
+    logger = logging.getLogger(__name__)
+    if args.verbose >= 2:
+        logger.setLevel(logging.DEBUG)
+    elif args.verbose == 1:
+        logger.setLevel(logging.INFO)
+    else:
+        logger.setLevel(logging.WARN)
+    logger.addHandler(logging.StreamHandler())
+
+    packages = PackageIndex()
+    filenames = find_source_files(
+        args.filename,
+        include=args.include,
+        exclude=args.exclude,
+        packages=packages,
+        logger=logger,
+    )
+    visitor = CallGraphVisitor(
+        filenames, logger, cache=args.cache_dir, packages=packages
+    )
+    visitor.freeze()
+    start = time.perf_counter()
+    graph = CallGraph(visitor)
+    logger.info("Indexed the graph in %.3f s" % (time.perf_counter() - start))
+
+    start = time.perf_counter()
+    try:
+        if args.callers or args.callees:
+            result = graph.reachable(
+                args.callers or args.callees,
+                reverse=bool(args.callers),
+                depth=args.depth or None,
+                kind=args.kind,
+            )
+        elif args.path:
+            path = graph.path(*args.path, kind=args.kind)
+            result = [] if path is None else [path]
+        else:
+            source, target = args.all_paths
+            result = graph.all_paths(
+                source, target, args.max_length, kind=args.kind, limit=args.limit
+            )
+    except ValueError as e:
+        print("%s." % e, file=sys.stderr)
+        return 1
+    logger.info("Answered in %.3f ms" % ((time.perf_counter() - start) * 1e3))
+
+    if args.callers or args.callees:
+        if args.json:
+            output = [dict(describe(node), distance=d) for node, d in result]
+            print(json.dumps(output, indent=2))
+        else:
+            for node, d in result:
+                print("%d\t%s" % (d, _format_node(node)))
+    elif args.json:
+        print(json.dumps([[describe(node) for node in p] for p in result], indent=2))
+    else:
+        for p in result:
+            print(" -> ".join(node.get_name() for node in p))
+    return 0
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Persistent cache of graphs rendered by Graphviz.
+
+An entry is keyed by the hash of the DOT text, the output format, the dot
+command line options and the Graphviz version, so an unchanged graph is
+served from the cache without running dot at all. (VisualGraph.from_visitor()
+orders nodes and edges deterministically, so the DOT text of an unchanged
+graph is stable from run to run.)
+
+The total size of the cache is bounded: when it grows beyond max_size bytes,
+the least recently used entries are deleted. An entry's modification time
+is its last use. The directory is scanned once to learn its size, which is
+then kept up to date as entries are stored; it is scanned again only when
+that size exceeds max_size.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+# Bump this when the layout of the cache directory changes.
+RENDER_CACHE_FORMAT = 1
+
+DEFAULT_MAX_SIZE = 256 * 2**20  # bytes
+
+# Outputs are written from several threads (see outputs.py). (A module-level
+# lock, since RenderCaches are also sent to the processes rendering partitions.)
+_size_lock = threading.Lock()
+
+
+class DigestStream(object):
+    """A write-only text stream that only computes the SHA-256 hash of the
+    text written to it."""
+
+    def __init__(self):
+        self._hash = hashlib.sha256()
+
+    def write(self, text):
+        self._hash.update(text.encode("utf-8"))
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+
+class RenderCache:
+    """Directory of rendered graphs, with least recently used eviction."""
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE, logger=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.logger = logger or logging.getLogger(__name__)
+        self.size = None  # total size of the entries, once known
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, dot_digest, output_format, dot_options, dot_version):
+        """Return the key of the rendering of the DOT text with the SHA-256
+        hash dot_digest, in output_format, with the given list of dot
+        command line options and Graphviz version string."""
+        text = "%d\0%s\0%s\0%s\0%s" % (
+            RENDER_CACHE_FORMAT,
+            dot_digest,
+            output_format,
+            "\0".join(dot_options),
+            dot_version,
+        )
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _path(self, key, output_format):
+        return os.path.join(self.cache_dir, key[:2], key + "." + output_format)
+
+    def fetch(self, key, output_format, output):
+        """Copy the entry to the file output, if it is in the cache. Return
+        whether it was."""
+        path = self._path(key, output_format)
+        try:
+            shutil.copyfile(path, output)
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:  # not cached, or just evicted
+            return False
+        return True
+
+    def store(self, key, output_format, output):
+        """Save the rendered file output as an entry, then evict the least
+        recently used entries if the cache has grown too large. If output
+        does not exist (dot wrote nothing), nothing is stored."""
+        try:
+            source = open(output, "rb")
+        except FileNotFoundError:
+            self.logger.warning("Render cache: %s was not written; not cached" % output)
+            return
+        path = self._path(key, output_format)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            replaced = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced = 0
+        # write atomically, so that concurrent runs never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f, source:
+                shutil.copyfileobj(source, f)
+                size = f.tell()
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        with _size_lock:
+            if self.size is None:
+                self.size = sum(size for _, size, _ in self.entries())
+            else:
+                self.size += size - replaced
+            if self.size > self.max_size:
+                self.evict()
+
+    def entries(self):
+        """Return a list of (mtime, size, path) of the entries."""
+        result = []
+        for dirpath, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                if filename.endswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:  # evicted concurrently
+                    continue
+                result.append((stat.st_mtime, stat.st_size, path))
+        return result
+
+    def evict(self):
+        """Delete the least recently used entries until the total size is
+        at most max_size."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        self.size = total
+        if total <= self.max_size:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.logger.info("Render cache: evicted %s" % path)
+        self.size = total
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Long-running analysis server answering queries over a Unix socket.
+
+    pyan serve --socket /tmp/pyan.sock src/
+
+analyzes the files once, keeps the analysis in memory (see session.py),
+and answers queries on the socket. Before answering, it checks, at most
+once per --check-interval seconds, whether any file has changed, and if so
+re-analyzes only the changed files and their importers.
+
+The protocol is one JSON object per line, in both directions. A request is
+
+    {"id": 1, "method": "callers", "params": {"name": "billing.charge"}}
+
+and its response
+
+    {"id": 1, "result": [...], "elapsed_ms": 0.12}
+
+or {"id": 1, "error": "message"}. If the files could not be analyzed
+again (e.g. a file with a syntax error, saved mid-edit), the queries are
+answered from the last successful analysis, and the response carries a
+"warning" with the reason. The methods are:
+
+  callers {name}          definitions using the definition name
+  callees {name}          definitions used by the definition name
+  defines {name}          definitions defined by the definition name
+  reachable {name, reverse, depth}
+                          transitive callees (callers, if reverse) of the
+                          definition name, up to depth, each with its
+                          "distance"
+  path {source, target}   a shortest chain of uses from source to target,
+                          or null
+  all_paths {source, target, max_length, limit}
+                          the chains of at most max_length uses from
+                          source to target, shortest first
+  reload {}               re-analyze now, even if no file has changed
+  stats {}                size of the analysis, and the last analysis time
+  shutdown {}             stop the server
+
+Definitions are described as {"name", "flavor", "filename", "lineno"}.
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import socketserver
+import stat
+import threading
+import time
+
+from .query import describe
+from .session import AnalysisSession
+
+
+class AnalysisServer:
+    """Answer requests (decoded JSON objects) from a warm AnalysisSession."""
+
+    def __init__(self, session, check_interval=1.0, logger=None):
+        self.session = session
+        self.check_interval = check_interval
+        self.logger = logger or logging.getLogger(__name__)
+        self.last_check = None
+        self.error = None  # why the last refresh failed, if it did
+        self.lock = threading.Lock()  # one request at a time
+        self.on_shutdown = None  # function stopping the socket server
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if (
+            force
+            or self.last_check is None
+            or now - self.last_check >= self.check_interval
+        ):
+            try:
+                changed = self.session.refresh(force=force)
+            except (SyntaxError, OSError, UnicodeDecodeError) as e:
+                # typically a file being edited; keep the last good analysis
+                self.error = str(e)
+                self.logger.warning("%s; keeping the previous analysis" % e)
+                return []
+            finally:
+                self.last_check = time.monotonic()
+            self.error = None
+            return changed
+        return []
+
+    def do_callers(self, name):
+        return [describe(node) for node in self.session.graph.callers(name)]
+
+    def do_callees(self, name):
+        return [describe(node) for node in self.session.graph.callees(name)]
+
+    def do_defines(self, name):
+        return [describe(node) for node in self.session.graph.defines_of(name)]
+
+    def do_reachable(self, name, reverse=False, depth=None):
+        return [
+            dict(describe(node), distance=distance)
+            for node, distance in self.session.graph.reachable(name, reverse, depth)
+        ]
+
+    def do_path(self, source, target):
+        path = self.session.graph.path(source, target)
+        return None if path is None else [describe(node) for node in path]
+
+    def do_all_paths(self, source, target, max_length=5, limit=1000):
+        paths = self.session.graph.all_paths(source, target, max_length, limit=limit)
+        return [[describe(node) for node in path] for path in paths]
+
+    def do_reload(self):
+        return {"changed": self.refresh(force=True)}
+
+    def do_stats(self):
+        visitor = self.session.visitor
+        return {
+            "files": len(visitor.filenames),
+            "definitions": sum(
+                len(nodes) for nodes in self.session.graph.by_name.values()
+            ),
+            "uses_edges": len(self.session.graph.forward["uses"].indices),
+            "analyses": self.session.analyses,
+            "analysis_s": self.session.analysis_time,
+        }
+
+    def do_shutdown(self):
+        if self.on_shutdown is not None:
+            self.on_shutdown()
+        return None
+
+    METHODS = (
+        "callers",
+        "callees",
+        "defines",
+        "reachable",
+        "path",
+        "all_paths",
+        "reload",
+        "stats",
+        "shutdown",
+    )
+
+    def handle(self, request):
+        """Return the response to request."""
+        start = time.perf_counter()
+        response = {"id": request.get("id") if isinstance(request, dict) else None}
+        try:
+            if not isinstance(request, dict) or request.get("method") not in (
+                self.METHODS
+            ):
+                raise ValueError(
+                    "Unknown method; expected one of %s" % ", ".join(self.METHODS)
+                )
+            params = request.get("params") or {}
+            if not isinstance(params, dict):
+                raise ValueError("params must be an object")
+            with self.lock:
+                if request["method"] not in ("reload", "shutdown"):
+                    self.refresh()
+                    if self.session.graph is None:
+                        raise ValueError("No analysis available: %s" % self.error)
+                method = getattr(self, "do_" + request["method"])
+                response["result"] = method(**params)
+        except (ValueError, TypeError) as e:
+            response["error"] = str(e)
+        else:
+            if self.error is not None:
+                response["warning"] = "Answered from the previous analysis: %s" % (
+                    self.error
+                )
+        response["elapsed_ms"] = round((time.perf_counter() - start) * 1e3, 3)
+        return response
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                response = {"id": None, "error": "Invalid JSON: %s" % e}
+            else:
+                try:
+                    response = self.server.analysis.handle(request)
+                except Exception as e:
+                    # answer every request, whatever went wrong
+                    self.server.analysis.logger.exception("Request failed")
+                    response = {
+                        "id": request.get("id") if isinstance(request, dict) else None,
+                        "error": "Internal error: %s: %s" % (type(e).__name__, e),
+                    }
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class _SocketServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(analysis, socket_path, logger=None):
+    """Answer requests to the AnalysisServer analysis on the Unix socket
+    socket_path, until a shutdown request."""
+    logger = logger or logging.getLogger(__name__)
+    try:
+        if stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            os.unlink(socket_path)  # left over from a previous server
+    except FileNotFoundError:
+        pass
+    with _SocketServer(socket_path, _Handler) as server:
+        server.analysis = analysis
+        analysis.on_shutdown = lambda: threading.Thread(target=server.shutdown).start()
+        logger.warning("Serving on %s" % socket_path)
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(socket_path)
+
+
+def request(socket_path, method, **params):
+    """Send one request to the server on socket_path. Return the response."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        message = {"id": 1, "method": method, "params": params}
+        sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as f:
+            return json.loads(f.readline())
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        prog="pyan serve",
+        description=(
+            "Analyze Python source files, and answer queries about them on a"
+            " Unix socket, re-analyzing the files that change."
+        ),
+    )
+    parser.add_argument(
+        "filename", nargs="+", help="Python files, directories or package names"
+    )
+    parser.add_argument(
+        "--socket", required=True, dest="socket", help="path of the Unix socket"
+    )
+    parser.add_argument("--include", action="append", dest="include", metavar="PATTERN")
+    parser.add_argument("--exclude", action="append", dest="exclude", metavar="PATTERN")
+    parser.add_argument(
+        "--check-interval",
+        type=float,
+        default=1.0,
+        dest="check_interval",
+        help="check for changed files at most every SECONDS (default: 1)",
+        metavar="SECONDS",
+    )
+    parser.add_argument("-v", "--verbose", action="count", default=0, dest="verbose")
+    parser.add_argument(
+        "-l", "--log", dest="logname", help="write log to LOG", metavar="LOG"
+    )
+    args = parser.parse_args(argv)
+
+    logger = logging.getLogger(__name__)
+    if args.verbose >= 2:
+        logger.setLevel(logging.DEBUG)
+    elif args.verbose == 1:
+        logger.setLevel(logging.INFO)
+    else:
+        logger.setLevel(logging.WARN)
+    logger.addHandler(logging.StreamHandler())
+    if args.logname:
+        logger.addHandler(logging.FileHandler(args.logname))
+
+    session = AnalysisSession(
+        args.filename,
+        include=args.include,
+        exclude=args.exclude,
+        logger=logger,
+    )
+    analysis = AnalysisServer(session, args.check_interval, logger=logger)
+    analysis.refresh(force=True)
+    try:
+        serve(analysis, args.socket, logger=logger)
+    except OSError as e:
+        logger.error("Cannot serve on %s: %s" % (args.socket, e))
+        return 1
+    return 0
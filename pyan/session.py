@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""A warm analysis, kept in memory and brought up to date on demand.
+
+An AnalysisSession remembers which source files were analyzed, and their
+modification times and sizes. refresh() searches for the files again, and
+if any was added, removed or modified, re-runs the analysis through an
+in-memory AnalysisCache: only the changed files, and the files importing
+them, are analyzed again; the results of the others are reloaded from
+the cache.
+"""
+
+import logging
+import os
+import time
+
+from .analyzer import CallGraphVisitor
+from .anutils import PackageIndex
+from .cache import AnalysisCache
+from .discovery import find_source_files
+from .query import CallGraph
+
+
+class AnalysisSession:
+    """Analysis of the files given by args (see discovery.SourceFinder),
+    kept up to date by refresh().
+
+    After a refresh, self.visitor is the analyzed CallGraphVisitor, and
+    self.graph a CallGraph of it (if index is true; otherwise None).
+
+    cache: directory of a persistent AnalysisCache, or None to keep the
+    analysis results in memory only. max_parse_cache: see CallGraphVisitor.
+
+    self.sources maps filenames to source text that replaces the contents of
+    the file (e.g. unsaved editor buffers); a change there is picked up by
+    the next refresh like a change to the file."""
+
+    def __init__(
+        self,
+        args,
+        include=None,
+        exclude=None,
+        logger=None,
+        cache=None,
+        max_parse_cache=None,
+        index=True,
+    ):
+        self.args = list(args)
+        self.include = include
+        self.exclude = exclude
+        self.logger = logger or logging.getLogger(__name__)
+        self.cache = AnalysisCache(cache, logger=self.logger)
+        self.max_parse_cache = max_parse_cache
+        self.index = index
+        self.sources = {}  # filename: source text overriding the file
+        self.signatures = {}  # filename: (mtime in ns, size), or source hash
+        self.filenames = []  # as of the last scan
+        self.packages = None
+        self.visitor = None
+        self.graph = None
+        self.analysis_time = None  # seconds taken by the last analysis
+        self.analyses = 0
+        self.failure = None  # (signatures, exception) of a failed analysis
+
+    def find_files(self):
+        """Return the current files, and a PackageIndex of their packages."""
+        packages = PackageIndex()
+        filenames = find_source_files(
+            self.args,
+            include=self.include,
+            exclude=self.exclude,
+            packages=packages,
+            logger=self.logger,
+        )
+        return filenames, packages
+
+    @staticmethod
+    def signature(filename):
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def current_signature(self, filename):
+        """Return the signature of filename, or of its text in self.sources."""
+        if filename in self.sources:
+            return ("source", hash(self.sources[filename]))
+        return self.signature(filename)
+
+    def changes(self, filenames):
+        """Return the files among filenames that were added or modified, or
+        that were analyzed before but are not among filenames any more."""
+        changed = [
+            filename
+            for filename in filenames
+            if self.signatures.get(filename) != self.current_signature(filename)
+        ]
+        current = set(filenames)
+        changed.extend(f for f in self.signatures if f not in current)
+        return changed
+
+    def refresh(self, force=False, rescan=True):
+        """Re-analyze if any file has changed (or if force is true). Return
+        the list of changed files.
+
+        If rescan is false, the files found by the last scan are checked for
+        changes, but the file system is not searched again for new files.
+
+        If the analysis fails (SyntaxError, OSError or UnicodeDecodeError),
+        the exception is raised and the previous analysis kept. Until a file
+        or source changes again (or force is true), further refreshes raise
+        the same exception without analyzing again."""
+        if rescan or self.visitor is None:
+            self.filenames, self.packages = self.find_files()
+        filenames, packages = self.filenames, self.packages
+        changed = self.changes(filenames)
+        if self.visitor is not None and not changed and not force:
+            return changed
+
+        start = time.perf_counter()
+        # Take the signatures before analyzing, so that a file modified
+        # during the analysis is seen as changed by the next refresh.
+        signatures = {f: self.current_signature(f) for f in filenames}
+        if not force and self.failure is not None and self.failure[0] == signatures:
+            raise self.failure[1]  # nothing has changed since it failed
+        try:
+            visitor = CallGraphVisitor(
+                filenames,
+                self.logger,
+                max_parse_cache=self.max_parse_cache,
+                cache=self.cache,
+                    packages=packages,
+                sources=dict(self.sources),
+            )
+        except (SyntaxError, OSError, UnicodeDecodeError) as e:
+            self.failure = (signatures, e)
+            raise
+        self.failure = None
+        self.visitor = visitor
+        self.graph = CallGraph(self.visitor) if self.index else None
+        self.signatures = signatures
+        self.analysis_time = time.perf_counter() - start
+        self.analyses += 1
+        self.logger.info(
+            "Analyzed %d files (%d changed) in %.3f s"
+            % (len(filenames), len(changed), self.analysis_time)
+        )
+        return changed
@@ -2,9 +2,12 @@
 # -*- coding: utf-8 -*-
 """Format-agnostic representation of the output graph."""
 
-import re
 import logging
 import colorsys
+from array import array
+
+from .edgestore import CSRAdjacency
+from .node import Flavor
 
 # Set node color by filename.
 #
@@ -17,6 +20,7 @@ import colorsys
 class Colorizer:
     def __init__(self, num_colors, colored=True, logger=None):
         self.logger = logger or logging.getLogger(__name__)
+        self.log_info = self.logger.isEnabledFor(logging.INFO)
         self.colored = colored
 
         self._hues = [j / num_colors for j in range(num_colors)]
@@ -33,7 +37,8 @@ class Colorizer:
 
     def _node_to_idx(self, node):
         ns = node.filename
-        self.logger.info("Coloring %s from file '%s'" % (node.get_short_name(), ns))
+        if self.log_info:
+            self.logger.info("Coloring %s from file '%s'" % (node.get_short_name(), ns))
         if ns not in self._idx_of:
             self._idx_of[ns] = self._next_idx()
         return self._idx_of[ns]
@@ -124,6 +129,60 @@ class VisualEdge(object):
         )
 
 
+class VisualEdgeArray(object):
+    """
+    A compact list of VisualEdges.
+
+    The edges are stored as parallel arrays of indices into a list of
+    VisualNodes, and into a small table of (flavor, color) styles.
+    VisualEdge objects are created on the fly when iterating.
+    """
+
+    def __init__(self, nodes):
+        self.nodes = nodes  # list of VisualNodes
+        self.sources = array("I")
+        self.targets = array("I")
+        self.style_ids = array("B")
+        self.styles = []  # (flavor, color)
+
+    def add(self, source, target, flavor, color):
+        """Add an edge between the VisualNodes at the given indices."""
+        style = (flavor, color)
+        if style not in self.styles:
+            self.styles.append(style)
+        self.sources.append(source)
+        self.targets.append(target)
+        self.style_ids.append(self.styles.index(style))
+
+    def __len__(self):
+        return len(self.sources)
+
+    def __iter__(self):
+        nodes = self.nodes
+        styles = self.styles
+        for source, target, style_id in zip(self.sources, self.targets, self.style_ids):
+            flavor, color = styles[style_id]
+            yield VisualEdge(nodes[source], nodes[target], flavor, color)
+
+    def sort(self):
+        """Sort the edges by the IDs of their source and target VisualNodes,
+        then by flavor, so that their order does not depend on the order in
+        which the analysis happened to create the nodes."""
+        nodes = self.nodes
+        styles = self.styles
+        order = sorted(
+            range(len(self.sources)),
+            key=lambda k: (
+                nodes[self.sources[k]].id,
+                nodes[self.targets[k]].id,
+                styles[self.style_ids[k]][0],
+            ),
+        )
+        self.sources = array("I", [self.sources[k] for k in order])
+        self.targets = array("I", [self.targets[k] for k in order])
+        self.style_ids = array("B", [self.style_ids[k] for k in order])
+
+
 class VisualGraph(object):
     def __init__(
         self, id, label, nodes=None, edges=None, subgraphs=None, grouped=False
@@ -135,6 +194,151 @@ class VisualGraph(object):
         self.subgraphs = subgraphs or []
         self.grouped = grouped
 
+    def count(self):
+        """Return (number of nodes, number of edges), including those of the
+        subgraphs, or (None, None) if the graph is made of iterables of
+        unknown length (e.g. generators)."""
+        try:
+            num_nodes = len(self.nodes)
+            num_edges = len(self.edges)
+            for subgraph in self.subgraphs:
+                num_nodes += subgraph.count()[0]
+        except TypeError:
+            return None, None
+        return num_nodes, num_edges
+
+    def partition(self):
+        """Split a grouped graph into one graph per top-level group.
+
+        The top-level groups are the subgraphs of the root graph, where
+        subgraphs with the same id count as one group (from_visitor() may
+        split a namespace into several subgraphs; Graphviz merges them). If
+        there is only one group, with no nodes of its own (e.g. a single
+        package when the groups are nested), its subgraphs are used instead,
+        and so on. Nodes outside of any group form a partition of their own.
+
+        Return (index graph, [(name, partition graph)]). Each partition
+        graph keeps the edges within the partition; the index graph has one
+        node per partition, whose id is the name of the partition, and an
+        edge wherever some edge of the full graph crosses from one
+        partition to another.
+        """
+        def groups_of(subgraphs):
+            groups = {}  # id: [subgraph]
+            for subgraph in subgraphs:
+                groups.setdefault(subgraph.id, []).append(subgraph)
+            return list(groups.values())
+
+        nodes = list(self.nodes)
+        groups = groups_of(self.subgraphs)
+        while len(groups) == 1 and not nodes:
+            nodes = [node for subgraph in groups[0] for node in subgraph.nodes]
+            groups = groups_of(
+                [child for subgraph in groups[0] for child in subgraph.subgraphs]
+            )
+        parts = []  # (name, label, graph)
+        if nodes:
+            parts.append(("root", "", VisualGraph("G", "", nodes=nodes)))
+        for group in groups:
+            graph = VisualGraph("G", "", subgraphs=group, grouped=True)
+            parts.append((group[0].id, group[0].label, graph))
+
+        index = VisualGraph("G", "")
+        part_of = {}  # VisualNode: partition number
+        first_node = {}  # partition number: its first VisualNode
+        index_node_of = []  # partition number: VisualNode in the index graph
+
+        def walk(graph, i):
+            for node in graph.nodes:
+                part_of[node] = i
+                first_node.setdefault(i, node)
+            for subgraph in graph.subgraphs:
+                walk(subgraph, i)
+
+        for i, (name, label, graph) in enumerate(parts):
+            walk(graph, i)
+            first = first_node.get(i)
+            index_node = VisualNode(
+                id=name,
+                label=label or "(top level)",
+                flavor="namespace",
+                fill_color=first.fill_color if first else "#ffffffb2",
+                text_color=first.text_color if first else "#000000",
+                group=i,
+            )
+            index_node_of.append(index_node)
+            index.nodes.append(index_node)
+
+        crossings = set()
+        for edge in self.edges:
+            i = part_of.get(edge.source)
+            j = part_of.get(edge.target)
+            if i is None or j is None:
+                continue
+            if i == j:
+                parts[i][2].edges.append(edge)
+            elif (i, j, edge.flavor) not in crossings:
+                crossings.add((i, j, edge.flavor))
+                index.edges.append(
+                    VisualEdge(
+                        index_node_of[i], index_node_of[j], edge.flavor, edge.color
+                    )
+                )
+        return index, [(name, graph) for name, _, graph in parts]
+
+    @classmethod
+    def modules_from_visitor(cls, visitor, options=None, logger=None):
+        """Build a coarse graph with one node per analyzed module, and a
+        uses edge between two modules when anything in one uses anything in
+        the other. Only the options "colored" and "annotated" apply.
+
+        This is much smaller than the full graph, so it can still be laid
+        out when the full graph is too large."""
+        options = options or {}
+        logger = logger or logging.getLogger(__name__)
+        annotated = options.get("annotated", False)
+
+        modules = []
+        for name in visitor.nodes:
+            for node in visitor.nodes[name]:
+                if node.defined and node.flavor == Flavor.MODULE:
+                    modules.append(node)
+        modules.sort(key=lambda x: (x.namespace, x.name))
+        colorizer = Colorizer(
+            num_colors=len(modules) + 1,
+            colored=options.get("colored", False),
+            logger=logger,
+        )
+
+        root_graph = cls("G", label="")
+        module_of = {}  # filename: VisualNode of its module
+        for node in modules:
+            idx, fill_RGBA, text_RGB = colorizer.make_colors(node)
+            visual_node = VisualNode(
+                id=node.get_label(),
+                label=node.get_annotated_name() if annotated else node.get_name(),
+                flavor=repr(node.flavor),
+                fill_color=fill_RGBA,
+                text_color=text_RGB,
+                group=idx,
+            )
+            module_of[node.filename] = visual_node
+            root_graph.nodes.append(visual_node)
+
+        pairs = set()
+        for n in visitor.uses_edges:
+            source = module_of.get(n.filename) if n.defined else None
+            if source is None:
+                continue
+            for n2 in visitor.uses_edges[n]:
+                target = module_of.get(n2.filename) if n2.defined else None
+                if target is not None and target is not source:
+                    pairs.add((source.id, target.id, source, target))
+        for _, _, source, target in sorted(pairs, key=lambda p: p[:2]):
+            root_graph.edges.append(VisualEdge(source, target, "uses", "#000000"))
+
+        return root_graph
+
     @classmethod
     def from_visitor(cls, visitor, options=None, logger=None):
         colored = options.get("colored", False)
@@ -182,13 +386,19 @@ class VisualGraph(object):
             num_colors=len(find_filenames()) + 1, colored=colored, logger=logger
         )
 
+        log_info = logger.isEnabledFor(logging.INFO)
         nodes_dict = dict()
         root_graph = cls("G", label="", grouped=grouped)
+        # Namespace trie: each namespace with nodes maps to its subgraph, and
+        # the subgraph of a namespace is nested in that of its nearest
+        # ancestor namespace. The namespace '' (first in visited_nodes)
+        # is the root graph.
+        subgraph_of = {"": root_graph}
         subgraph = root_graph
-        namespace_stack = []
-        prev_namespace = ""  # The namespace '' is first in visited_nodes.
+        prev_namespace = ""
         for node in visited_nodes:
-            logger.info("Looking at %s" % node.name)
+            if log_info:
+                logger.info("Looking at %s" % node.name)
 
             # Create the node itself and add it to nodes_dict
             idx, fill_RGBA, text_RGB = colorizer.make_colors(node)
@@ -204,42 +414,46 @@ class VisualGraph(object):
 
             # next namespace?
             if grouped and node.namespace != prev_namespace:
-                logger.info(
-                    "New namespace %s, old was %s" % (node.namespace, prev_namespace)
-                )
+                if log_info:
+                    logger.info(
+                        "New namespace %s, old was %s"
+                        % (node.namespace, prev_namespace)
+                    )
+                prev_namespace = node.namespace
 
+                # The nodes are sorted by namespace, so a namespace is new
+                # here, and its ancestors (prefixes) have been seen already.
                 label = node.get_namespace_label()
                 subgraph = cls(label, node.namespace)
+                subgraph_of[node.namespace] = subgraph
 
                 if nested:
-                    # Pop the stack until the newly found namespace is within
-                    # one of the parent namespaces, or until the stack runs out
-                    # (i.e. this is a sibling).
-                    if len(namespace_stack):
-                        m = re.match(namespace_stack[-1].label, node.namespace)
-                        # The '.' check catches siblings in cases like
-                        # MeshGenerator vs. Mesh.
-                        while (
-                            m is None
-                            or m.end() == len(node.namespace)
-                            or node.namespace[m.end()] != "."
-                        ):
-                            namespace_stack.pop()
-                            if not len(namespace_stack):
-                                break
-                            m = re.match(namespace_stack[-1].label, node.namespace)
-                    parentgraph = (
-                        namespace_stack[-1] if len(namespace_stack) else root_graph
-                    )
-                    parentgraph.subgraphs.append(subgraph)
-
-                    namespace_stack.append(subgraph)
+                    # The parent is the nearest enclosing namespace that has
+                    # nodes (e.g. Mesh is not the parent of MeshGenerator).
+                    parent = node.namespace.rpartition(".")[0]
+                    while parent not in subgraph_of:
+                        parent = parent.rpartition(".")[0]
+                    subgraph_of[parent].subgraphs.append(subgraph)
                 else:
                     root_graph.subgraphs.append(subgraph)
 
             subgraph.nodes.append(visual_node)
 
         # Now add edges
+        #
+        # If the visitor has been frozen, read the edges straight from its
+        # integer-ID arrays, and store them in the same compact form.
+        frozen = isinstance(visitor.uses_edges, CSRAdjacency)
+        if frozen:
+            # VisualNode of each node ID (None if the node is not drawn)
+            visual_nodes = [nodes_dict.get(node) for node in visitor.node_list]
+            root_graph.edges = VisualEdgeArray(visual_nodes)
+
+            def add_edges_by_id(adjacency, flavor, color):
+                for i, j in adjacency.id_pairs():
+                    if visual_nodes[i] is not None and visual_nodes[j] is not None:
+                        root_graph.edges.add(i, j, flavor, color)
+
         if draw_defines or grouped_alt:
             # If grouped, use gray lines so they won't visually obstruct
             # the "uses" lines.
@@ -250,24 +464,39 @@ class VisualGraph(object):
             # defines relationship.
             #
             color = "#838b8b" if draw_defines else "#ffffff00"
-            for n in visitor.defines_edges:
-                if n.defined:
-                    for n2 in visitor.defines_edges[n]:
-                        if n2.defined:
-                            root_graph.edges.append(
-                                VisualEdge(
-                                    nodes_dict[n], nodes_dict[n2], "defines", color
+            if frozen:
+                add_edges_by_id(visitor.defines_edges, "defines", color)
+            else:
+                for n in visitor.defines_edges:
+                    if n.defined:
+                        for n2 in visitor.defines_edges[n]:
+                            if n2.defined:
+                                root_graph.edges.append(
+                                    VisualEdge(
+                                        nodes_dict[n], nodes_dict[n2], "defines", color
+                                    )
                                 )
-                            )
 
         if draw_uses:
             color = "#000000"
-            for n in visitor.uses_edges:
-                if n.defined:
-                    for n2 in visitor.uses_edges[n]:
-                        if n2.defined:
-                            root_graph.edges.append(
-                                VisualEdge(nodes_dict[n], nodes_dict[n2], "uses", color)
-                            )
+            if frozen:
+                add_edges_by_id(visitor.uses_edges, "uses", color)
+            else:
+                for n in visitor.uses_edges:
+                    if n.defined:
+                        for n2 in visitor.uses_edges[n]:
+                            if n2.defined:
+                                root_graph.edges.append(
+                                    VisualEdge(
+                                        nodes_dict[n], nodes_dict[n2], "uses", color
+                                    )
+                                )
+
+        # A deterministic edge order keeps the output, and thus the layout
+        # and any render cache key, stable from run to run.
+        if frozen:
+            root_graph.edges.sort()
+        else:
+            root_graph.edges.sort(key=lambda e: (e.source.id, e.target.id, e.flavor))
 
         return root_graph
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Watch mode: regenerate the outputs whenever the source files change.
+
+    pyan mypkg/ -f calls.svg -f calls.dot --watch
+
+writes the outputs, then waits for changes to the .py files under the
+watched directories (the directories given on the command line, and the
+directories of the files found), and regenerates the outputs after each
+burst of changes. Changes are detected with Linux inotify, or, where it is
+unavailable, by polling the modification times and sizes of the files.
+
+A burst is debounced: after a change, the watcher waits until no further
+change has come for the debounce interval, so that saving many files (a
+checkout, a formatter run) triggers one regeneration. The analysis goes
+through an AnalysisSession, so only the changed modules and the modules
+importing them are analyzed again; the other modules keep their cached
+nodes and edges.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import time
+
+# inotify event masks, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = (
+    IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_ONLYDIR
+)
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+DEFAULT_DEBOUNCE = 0.3  # seconds
+POLL_INTERVAL = 1.0  # seconds
+
+
+def watch_dirs(args, filenames):
+    """Return the sorted list of directories to watch for the command line
+    arguments args, which found the source files filenames: the directories
+    given, with their subdirectories, and the directories of the files."""
+    dirs = set()
+    for arg in args:
+        if os.path.isdir(arg):
+            for dirpath, _, _ in os.walk(arg):
+                dirs.add(dirpath)
+    for filename in filenames:
+        dirs.add(os.path.dirname(filename) or os.curdir)
+    return sorted(dirs)
+
+
+class InotifyWatcher:
+    """Wait for changes to .py files in a set of directories, with inotify.
+
+    Raise OSError if inotify is not available."""
+
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger(__name__)
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        try:
+            self._add_watch = libc.inotify_add_watch
+            init = libc.inotify_init1
+        except AttributeError:
+            raise OSError("inotify is not available")
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = init(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, "inotify_init1: %s" % os.strerror(errno))
+        self.dirs = {}  # watch descriptor: directory
+
+    def add(self, dirname):
+        """Watch dirname (again watching it does nothing)."""
+        wd = self._add_watch(self.fd, os.fsencode(dirname), WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            self.logger.warning(
+                "Cannot watch directory %s: %s" % (dirname, os.strerror(errno))
+            )
+            return
+        self.dirs[wd] = dirname
+
+    def update(self, dirs):
+        for dirname in dirs:
+            self.add(dirname)
+
+    def _read_events(self):
+        """Read the pending events. Return whether any concerns a .py file
+        or a directory."""
+        relevant = False
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return relevant
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    relevant = True  # events were lost
+                elif mask & IN_ISDIR:
+                    relevant = True
+                    if mask & (IN_CREATE | IN_MOVED_TO) and wd in self.dirs:
+                        # watch the new directory tree, which may contain files
+                        new_dir = os.path.join(self.dirs[wd], os.fsdecode(name))
+                        for dirpath, _, _ in os.walk(new_dir):
+                            self.add(dirpath)
+                elif mask & IN_DELETE_SELF:
+                    relevant = True
+                    self.dirs.pop(wd, None)
+                elif name.endswith(b".py"):
+                    relevant = True
+
+    def wait(self, timeout=None):
+        """Wait for a change, for at most timeout seconds (None: forever).
+        Return whether there was one."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None
+            if deadline is not None:
+                remaining = max(0.0, deadline - time.monotonic())
+            readable, _, _ = select.select([self.fd], [], [], remaining)
+            if readable and self._read_events():
+                return True
+            if not readable:
+                return False
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Wait for changes by comparing the modification times and sizes of
+    the source files every interval seconds.
+
+    snapshot: function returning the current {filename: signature}."""
+
+    def __init__(self, snapshot, interval=POLL_INTERVAL, logger=None):
+        self.snapshot = snapshot
+        self.interval = interval
+        self.logger = logger or logging.getLogger(__name__)
+        self.last = snapshot()
+
+    def update(self, dirs):
+        self.last = self.snapshot()
+
+    def wait(self, timeout=None):
+        """Wait for a change, for at most timeout seconds (None: forever).
+        Return whether there was one."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self.interval
+            if deadline is not None:
+                delay = min(delay, deadline - time.monotonic())
+                if delay <= 0:
+                    return False
+            time.sleep(delay)
+            current = self.snapshot()
+            if current != self.last:
+                self.last = current
+                return True
+
+    def close(self):
+        pass
+
+
+def make_watcher(session, polling=False, logger=None):
+    """Return an InotifyWatcher, or a PollingWatcher of the files of the
+    AnalysisSession session if inotify is unavailable (or polling is true)."""
+    logger = logger or logging.getLogger(__name__)
+    if not polling:
+        try:
+            return InotifyWatcher(logger=logger)
+        except OSError as e:
+            logger.info("Cannot use inotify (%s); polling for changes" % e)
+
+    def snapshot():
+        filenames, _ = session.find_files()
+        return {filename: session.signature(filename) for filename in filenames}
+
+    return PollingWatcher(snapshot, logger=logger)
+
+
+def watch(session, write, debounce=DEFAULT_DEBOUNCE, polling=False, logger=None):
+    """Analyze the files of the AnalysisSession session and call write(visitor),
+    then do it again after each burst of changes, until interrupted.
+
+    A burst ends when no change has come for debounce seconds. An analysis
+    that fails, e.g. on a syntax error in a file being edited or on a file
+    deleted while it was being read, is logged, and the outputs are kept
+    until the next change."""
+    logger = logger or logging.getLogger(__name__)
+    watcher = make_watcher(session, polling=polling, logger=logger)
+    written = False
+    try:
+        while True:
+            filenames, _ = session.find_files()
+            watcher.update(watch_dirs(session.args, filenames))
+            try:
+                changed = session.refresh()
+            except (SyntaxError, OSError, UnicodeDecodeError) as e:
+                # e.g. a file being edited, or deleted while it was read
+                logger.warning("%s; waiting for the next change" % e)
+            else:
+                if changed or not written:
+                    start = time.perf_counter()
+                    write(session.visitor)
+                    written = True
+                    logger.info(
+                        "Wrote the outputs in %.3f s" % (time.perf_counter() - start)
+                    )
+            watcher.wait()
+            while watcher.wait(debounce):
+                pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
@@ -2,26 +2,98 @@
 # -*- coding: utf-8 -*-
 """Graph markup writers."""
 
-import io
 import subprocess
 import sys
 import logging
+import tempfile
+import time
+
+from .layout import choose_strategy
+from .profiling import NULL_PROFILER
+from .rendercache import DigestStream
 
 
 class NoDotError(Exception):
     pass
 
 
+class RenderTimeout(Exception):
+    pass
+
+
+def dot_version():
+    """Return the version string of Graphviz dot. Raise NoDotError if dot
+    is not installed."""
+    try:
+        dot_exe_check = subprocess.run(
+            ["dot", "-V"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+    except FileNotFoundError:
+        raise NoDotError
+    if dot_exe_check.returncode != 0:
+        raise NoDotError
+    return dot_exe_check.stderr.strip()
+
+
+class TeeStream(object):
+    """A write-only text stream that writes to several streams at once.
+
+    A stream whose pipe breaks (e.g. the stdin of a subprocess that has
+    exited) is dropped, and writing continues to the others."""
+
+    def __init__(self, streams):
+        self.streams = list(streams)
+
+    def write(self, text):
+        for stream in list(self.streams):
+            try:
+                stream.write(text)
+            except BrokenPipeError:
+                self.streams.remove(stream)
+
+
 class Writer(object):
+    """Base class for graph markup writers.
+
+    graph is a VisualGraph, or any object with the same attributes. Its
+    nodes, subgraphs and edges may be any iterables, e.g. generators: each
+    is iterated over only once (nodes and subgraphs recursively first, then
+    edges), so a graph can be written without holding all of it in memory.
+
+    output is a filename, an open text stream (which is written to, but not
+    closed), or None for stdout. Lines are collected in chunks of
+    BUFFER_LINES lines, and files are opened with a buffer of BUFFER_SIZE
+    bytes, to keep the number of system calls low on large graphs.
+    """
+
+    BUFFER_SIZE = 1 << 20
+    BUFFER_LINES = 4096
+
     def __init__(self, graph, output=None, logger=None, tabstop=4):
         self.graph = graph
         self.output = output
         self.logger = logger or logging.getLogger(__name__)
-        self.indent_level = 0
         self.tabstop = tabstop * " "
+        self.indent_level = 0
+        self.profiler = NULL_PROFILER
+        self._pending = []  # lines not yet written to self.outstream
 
-    def log(self, msg):
-        self.logger.info(msg)
+    @property
+    def indent_level(self):
+        return self._indent_level
+
+    @indent_level.setter
+    def indent_level(self, level):
+        self._indent_level = level
+        self._indent = self.tabstop * level
+
+    def log(self, msg, *args):
+        """Log msg % args at info level; the message is only formatted if
+        info messages are enabled."""
+        self.logger.info(msg, *args)
 
     def indent(self, level=1):
         self.indent_level += level
@@ -30,19 +102,32 @@ class Writer(object):
         self.indent_level -= level
 
     def write(self, line):
-        self.outstream.write(self.tabstop * self.indent_level + line + "\n")
+        pending = self._pending
+        pending.append(self._indent + line + "\n")
+        if len(pending) >= self.BUFFER_LINES:
+            self.flush()
+
+    def flush(self):
+        """Write out the pending lines."""
+        self.outstream.write("".join(self._pending))
+        self._pending.clear()
 
     def run(self):
-        self.log("%s running" % type(self))
-        try:
-            self.outstream = open(self.output, "w")
-        except TypeError:
+        self.log("%s running", type(self))
+        if self.output is None:
             self.outstream = sys.stdout
+        elif hasattr(self.output, "write"):
+            self.outstream = self.output
+        else:
+            self.outstream = open(self.output, "w", buffering=self.BUFFER_SIZE)
 
-        self.create_graph()
-
-        if self.output:
-            self.outstream.close()
+        try:
+            self.create_graph()
+            self.flush()
+        finally:
+            self._pending.clear()
+            if self.outstream is not self.output and self.outstream is not sys.stdout:
+                self.outstream.close()
 
     def create_graph(self):
         self.start_graph()
@@ -125,7 +210,7 @@ class DotWriter(Writer):
         self.indent()
 
     def start_subgraph(self, graph):
-        self.log("Start subgraph %s" % graph.label)
+        self.log("Start subgraph %s", graph.label)
         # Name must begin with "cluster" to be recognized as a cluster by GraphViz.
         self.write("subgraph cluster_%s {\n" % graph.id)
         self.indent()
@@ -138,13 +223,13 @@ class DotWriter(Writer):
         )
 
     def finish_subgraph(self, graph):
-        self.log("Finish subgraph %s" % graph.label)
+        self.log("Finish subgraph %s", graph.label)
         # terminate previous subgraph
         self.dedent()
         self.write("}")
 
     def write_node(self, node):
-        self.log("Write node %s" % node.label)
+        self.log("Write node %s", node.label)
         self.write(
             '%s [label="%s", style="filled", fillcolor="%s",'
             ' fontcolor="%s", group="%s"];'
@@ -171,6 +256,24 @@ class DotWriter(Writer):
 
 
 class DotRenderer(DotWriter):
+    """Render a graph with Graphviz.
+
+    layout: layout engine, "auto" to choose it (and speed-oriented options)
+    by the size of the graph; see layout.py. The chosen LayoutStrategy is
+    in self.strategy.
+    timeout: optional wall-clock limit in seconds; if the rendering takes
+    longer, dot is killed and RenderTimeout is raised.
+
+    renders: optional list of further (output_format, output) pairs to
+    render in the same dot run, so that the DOT text is generated and the
+    layout computed only once for all of them.
+    dot_outputs: optional list of filenames to which to save the DOT text,
+    too.
+    cache: optional RenderCache. Then the DOT text is first generated into
+    a temporary file while hashing it, and only the renders not found in
+    the cache are run through dot.
+    """
+
     def __init__(
         self,
         graph,
@@ -179,9 +282,21 @@ class DotRenderer(DotWriter):
         output_format=None,
         logger=None,
         tabstop=4,
+        renders=None,
+        dot_outputs=None,
+        cache=None,
+        layout="auto",
+        timeout=None,
     ):
         self.output_render = output
         self.output_format = output_format
+        self.renders = [(output_format, output)] + list(renders or [])
+        self.dot_outputs = list(dot_outputs or [])
+        self.cache = cache
+        self.timeout = timeout
+        self.num_nodes, self.num_edges = graph.count()
+        self.strategy = choose_strategy(self.num_nodes, self.num_edges, layout)
+        self.elapsed = None  # seconds, once rendered
 
         self.check_for_dot()
 
@@ -190,28 +305,134 @@ class DotRenderer(DotWriter):
         )
 
     def check_for_dot(self):
-        dot_exe_check = subprocess.run(
-            ["dot", "-V"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-        )
-        if dot_exe_check.returncode != 0:
-            raise NoDotError
+        self.dot_version = dot_version()
+
+    def dot_command(self, renders):
+        """Return the dot command line producing the given renders."""
+        cmd = self.strategy.command()
+        for output_format, output in renders:
+            cmd += ["-T{}".format(output_format), "-o{}".format(output)]
+        return cmd
+
+    def generate(self, streams):
+        """Write the DOT text to all of the given streams."""
+        copies = [
+            open(filename, "w", buffering=self.BUFFER_SIZE)
+            for filename in self.dot_outputs
+        ]
+        self.outstream = TeeStream(list(streams) + copies)
+        try:
+            self.create_graph()
+            self.flush()
+        finally:
+            self._pending.clear()
+            for stream in copies:
+                stream.close()
 
     def run(self):
-        self.log("%s running" % type(self))
-
-        self.outstream = io.StringIO()
-        self.create_graph()
-        dot_buffer = self.outstream.getvalue()
-        self.outstream.close()
-
-        dot_options = ["-Granksep=1.5"]
-        cmd = [
-            "dot",
-            *dot_options,
-            "-T{}".format(self.output_format),
-            "-o{}".format(self.output_render),
-        ]
-        subprocess.run(cmd, input=dot_buffer, text=True)
+        """Render the graph. Without a cache, stream the DOT text straight
+        into the stdin of dot (so that it is never held in memory as a
+        whole)."""
+        self.log("%s running", type(self))
+        self.log(
+            "Layout with %s %s (%s)",
+            self.strategy.engine,
+            " ".join(self.strategy.options),
+            self.strategy.reason,
+        )
+        start = time.perf_counter()
+        if self.cache is not None:
+            self.run_cached()
+        else:
+            self.run_streaming()
+        self.elapsed = time.perf_counter() - start
+        self.log("Rendered %s in %.2f s", self.output_render, self.elapsed)
+
+    def timed_out(self):
+        return RenderTimeout(
+            "%s did not finish rendering %s within %g s"
+            % (self.strategy.engine, self.output_render, self.timeout)
+        )
+
+    def run_streaming(self):
+        """Render the graph, streaming the DOT text into the stdin of dot."""
+        formats = ",".join(output_format for output_format, _ in self.renders)
+        with self.profiler.phase(
+            "dot subprocess", format=formats, engine=self.strategy.engine
+        ):
+            deadline = None
+            if self.timeout is not None:
+                deadline = time.monotonic() + self.timeout
+            process = subprocess.Popen(
+                self.dot_command(self.renders),
+                stdin=subprocess.PIPE,
+                text=True,
+                bufsize=self.BUFFER_SIZE,
+            )
+            try:
+                try:
+                    self.generate([process.stdin])
+                finally:
+                    try:
+                        process.stdin.close()
+                    except BrokenPipeError:
+                        pass  # dot exited early; it has reported the error itself
+                try:
+                    if deadline is None:
+                        returncode = process.wait()
+                    else:
+                        returncode = process.wait(max(deadline - time.monotonic(), 0))
+                except subprocess.TimeoutExpired:
+                    raise self.timed_out()
+            finally:
+                # on a timeout, or an error while generating: leave no dot behind
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+        if returncode != 0:
+            self.logger.warning("dot exited with status %d" % returncode)
+
+    def run_cached(self):
+        """Render the graph through self.cache."""
+        digest = DigestStream()
+        with tempfile.TemporaryFile("w+") as spool:
+            with self.profiler.phase("generate dot"):
+                self.generate([spool, digest])
+            dot_digest = digest.hexdigest()
+
+            misses = []  # (key, output_format, output)
+            for output_format, output in self.renders:
+                key = self.cache.key(
+                    dot_digest,
+                    output_format,
+                    self.strategy.command(),
+                    self.dot_version,
+                )
+                if self.cache.fetch(key, output_format, output):
+                    self.log("Render cache hit for %s", output)
+                else:
+                    misses.append((key, output_format, output))
+            if not misses:
+                return
+
+            renders = [(output_format, output) for _, output_format, output in misses]
+            formats = ",".join(output_format for output_format, _ in renders)
+            with self.profiler.phase(
+                "dot subprocess", format=formats, engine=self.strategy.engine
+            ):
+                spool.flush()
+                spool.seek(0)
+                try:
+                    returncode = subprocess.run(
+                        self.dot_command(renders), stdin=spool, timeout=self.timeout
+                    ).returncode
+                except subprocess.TimeoutExpired:
+                    raise self.timed_out()
+        if returncode != 0:
+            self.logger.warning("dot exited with status %d" % returncode)
+            return
+        for key, output_format, output in misses:
+            self.cache.store(key, output_format, output)
 
 
 class YedWriter(Writer):
@@ -244,7 +465,7 @@ class YedWriter(Writer):
         self.indent()
 
     def start_subgraph(self, graph):
-        self.log("Start subgraph %s" % graph.label)
+        self.log("Start subgraph %s", graph.label)
 
         self.write('<node id="%s:" yfiles.foldertype="group">' % graph.id)
         self.indent()
@@ -274,14 +495,14 @@ class YedWriter(Writer):
         self.indent()
 
     def finish_subgraph(self, graph):
-        self.log("Finish subgraph %s" % graph.label)
+        self.log("Finish subgraph %s", graph.label)
         self.dedent()
         self.write("</graph>")
         self.dedent()
         self.write("</node>")
 
     def write_node(self, node):
-        self.log("Write node %s" % node.label)
+        self.log("Write node %s", node.label)
         width = 20 + 10 * len(node.label)
         self.write('<node id="%s">' % node.id)
         self.indent()
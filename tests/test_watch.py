@@ -0,0 +1,72 @@
+import logging
+
+import pyan.watch
+from pyan.session import AnalysisSession
+from pyan.watch import watch
+
+
+class ScriptedWatcher:
+    """A watcher running one scripted change per wait(), until it runs out
+    of changes; then it interrupts watch()."""
+
+    def __init__(self, changes):
+        self.changes = list(changes)
+
+    def update(self, dirs):
+        pass
+
+    def wait(self, timeout=None):
+        if timeout is not None:
+            return False  # end of the burst
+        if not self.changes:
+            raise KeyboardInterrupt
+        self.changes.pop(0)()
+        return True
+
+    def close(self):
+        pass
+
+
+def defined_names(visitor):
+    return {
+        node.get_name()
+        for nodes in visitor.nodes.values()
+        for node in nodes
+        if node.defined
+    }
+
+
+def test_watch_survives_file_deleted_during_analysis(tmp_path, monkeypatch, caplog):
+    (tmp_path / "a.py").write_text("import b\n\ndef f():\n    b.g()\n")
+    (tmp_path / "b.py").write_text("def g():\n    pass\n")
+    session = AnalysisSession([str(tmp_path)])
+
+    # While stale, the scan still lists b.py, as if it had been deleted
+    # between the scan and the reading of the file.
+    find_files = session.find_files
+    listing = []
+
+    def scan():
+        if listing:
+            return listing[0]
+        return find_files()
+
+    monkeypatch.setattr(session, "find_files", scan)
+
+    def delete_b():
+        listing.append(find_files())
+        (tmp_path / "b.py").unlink()
+
+    watcher = ScriptedWatcher([delete_b, listing.clear])
+    monkeypatch.setattr(pyan.watch, "make_watcher", lambda *a, **k: watcher)
+
+    written = []
+    with caplog.at_level(logging.WARNING):
+        watch(session, written.append, logger=logging.getLogger("test_watch"))
+
+    # The failed analysis is logged and keeps the outputs; the next change
+    # is analyzed and written again.
+    assert "waiting for the next change" in caplog.text
+    assert len(written) == 2
+    assert "b.g" in defined_names(written[0])
+    assert "b.g" not in defined_names(written[1])